@@ -0,0 +1,190 @@
+"""
+Cold-start benchmark for every Lambda handler.
+
+Each handler runs in a fresh subprocess against moto (see local_aws.py),
+so module import, first invocation and warm invocations are measured the
+way a new Lambda container would see them:
+
+  init     time to import app.py (includes any client/SSM work at import)
+  first    first lambda_handler call (lazy clients and caches are built here)
+  warm     median of the following calls
+  aws      median AWS API call time of those warm calls (instrumentation; summed,
+           so handlers that call in parallel can exceed their wall time)
+  rss      peak RSS growth of the process while importing and invoking
+
+Usage:
+  pip install -r benchmarks/requirements.txt
+  python benchmarks/cold_start.py [--warm 20] [--json] [handler ...]
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import local_aws
+
+OWNER = "bench@example.com"
+
+
+def events(aws, name):
+    """Return (prepare, event) for a handler. prepare() runs untimed before every call."""
+    owner_api = local_aws.api_event(OWNER)
+
+    def seed_running():
+        aws.seed_owner(OWNER, status="RUNNING", instance_id=aws.ids["instance_id"])
+
+    def seed_pending():
+        aws.seed_owner(OWNER, status="PENDING", instance_id=aws.ids["instance_id"])
+
+    def seed_offline():
+        aws.seed_owner(OWNER, status="OFFLINE")
+
+    def seed_world():
+        seed_offline()
+        aws.seed_world(OWNER)
+
+    def seed_usage():
+        # A month of daily rollups, as creditDeduction would have left them
+        for day in range(30):
+            aws.table.put_item(Item={
+                "PK": f"USAGE#{OWNER}", "SK": time.strftime("DAY#%Y-%m-%d", time.gmtime(time.time() - day * 86400)),
+                "Credits": 432, "Ticks": 144, "InstanceTypes": {local_aws.INSTANCE_TYPE},
+                "FirstBalance": 5000 - 432 * (day + 1), "LastBalance": 5000 - 432 * day
+            })
+
+    def register_connection():
+        import connections
+        connections.register(aws.table, OWNER, "bench-conn")
+
+    def clear():
+        aws.clear_owner(OWNER)
+
+    table = {
+        "createResources": (local_aws.LocalAWS.seed_catalog.__get__(aws), {"body": local_aws.CATALOG}),
+        "getResources": (None, {"headers": {}}),
+        "getUserData": (seed_running, owner_api),
+        "getUsageHistory": (seed_usage, owner_api),
+        "operationSwitch": (None, {"Records": [{
+            "messageId": "bench-1",
+            "body": json.dumps({"operation": "TURNON", "payload": {"owner": OWNER, "region": local_aws.REGION}})
+        }]}),
+        "serverMessagesHandler": (seed_running, {"body": json.dumps({"operation": "TURNON", "owner": OWNER})}),
+        "serverStatus": (seed_running, owner_api),
+        "statusStream": (register_connection, {"Records": [local_aws.stream_record(
+            {"PK": f"USERS#{OWNER}", "SK": "SERVER", "status": "PENDING", "InstanceId": aws.ids["instance_id"]},
+            {"PK": f"USERS#{OWNER}", "SK": "SERVER", "status": "RUNNING", "InstanceId": aws.ids["instance_id"],
+             "PublicIp": "203.0.113.10"}
+        )]}),
+        "wsConnections": (register_connection, {"requestContext": {"routeKey": "$disconnect", "connectionId": "bench-conn"}}),
+        "signUpHandler": (None, {
+            "triggerSource": "PostConfirmation_ConfirmSignUp",
+            "request": {"userAttributes": {"email": OWNER, "name": "Bench"}}
+        }),
+        "billingSweep": (seed_running, {}),
+        "fleetQuery": (seed_running, {"status": "RUNNING", "limit": 50}),
+        "createServer": (clear, {"owner": OWNER, "type": local_aws.INSTANCE_TYPE, "version": local_aws.VERSION, "serverName": "bench"}),
+        "creditDeduction": (seed_running, {"owner": OWNER, "instanceType": local_aws.INSTANCE_TYPE}),
+        "deleteServer": (seed_offline, {"owner": OWNER}),
+        "ingestMetrics": (None, {"owner": OWNER, "serverUUID": f"uuid-{OWNER}", "instanceType": local_aws.INSTANCE_TYPE, "samples": [
+            {"ts": int(time.time()) - 15 * i, "tps": 19.5 - i, "mspt": 12.0, "players": 3, "cpu": 41.5, "heapUsedMB": 900.0}
+            for i in range(4)
+        ]}),
+        "poolManager": (None, {}),
+        "serverStateChange": (seed_pending, {"detail": {"instance-id": aws.ids["instance_id"], "state": "running"}}),
+        "snapshotServer": (seed_world, {"detail": {"instance-id": aws.ids["instance_id"], "state": "terminated"}}),
+        "stuckStateReaper": (None, {}),
+        "turnOffServer": (seed_running, {"owner": OWNER}),
+        "turnOnServer": (seed_offline, {"owner": OWNER}),
+    }
+    return table[name]
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_one(name, warm):
+    """Body of the per-handler subprocess."""
+    local_aws.configure_env(global_stack=local_aws.HANDLERS[name][1])
+    aws = local_aws.LocalAWS().start()
+    aws.ids["instance_id"] = aws.run_instance(OWNER)
+    prepare, event = events(aws, name)
+
+    rss_before = peak_rss_kb()
+    start = time.perf_counter()
+    module = local_aws.load_handler(name)
+    init_ms = (time.perf_counter() - start) * 1000
+
+    import instrumentation
+
+    timings = []
+    aws_ms = []
+    # EMF lines are collected instead of printed; the summary gives the AWS call share
+    with instrumentation.capture():
+        for _ in range(warm + 1):
+            if prepare:
+                prepare()
+            start = time.perf_counter()
+            response = module.lambda_handler(event, None)
+            timings.append((time.perf_counter() - start) * 1000)
+            aws_ms.append(sum(c["totalMs"] for c in instrumentation.summary()["calls"].values()))
+
+    return {
+        "handler": name,
+        "init_ms": round(init_ms, 2),
+        "first_ms": round(timings[0], 2),
+        "warm_ms": round(statistics.median(timings[1:]), 2) if warm else None,
+        "first_aws_ms": round(aws_ms[0], 2),
+        "warm_aws_ms": round(statistics.median(aws_ms[1:]), 2) if warm else None,
+        "rss_kb": peak_rss_kb() - rss_before,
+        "status": response.get("statusCode") if isinstance(response, dict) else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("handlers", nargs="*", default=list(local_aws.HANDLERS))
+    parser.add_argument("--warm", type=int, default=20, help="warm invocations per handler")
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_one(args.child, args.warm)))
+        return
+
+    results = []
+    for name in args.handlers:
+        proc = subprocess.run(
+            [sys.executable, __file__, "--child", name, "--warm", str(args.warm)],
+            capture_output=True, text=True
+        )
+        lines = proc.stdout.strip().splitlines()
+        if proc.returncode != 0 or not lines:
+            results.append({"handler": name, "error": (proc.stderr.strip().splitlines() or ["no output"])[-1]})
+            continue
+        # Handlers print their own logs; the result is the last line
+        results.append(json.loads(lines[-1]))
+
+    if args.json:
+        for r in results:
+            print(json.dumps(r))
+        return
+
+    print(f"{'handler':<22}{'init ms':>10}{'first ms':>10}{'warm ms':>10}{'aws ms':>10}{'rss KB':>10}{'status':>8}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['handler']:<22}  ERROR: {r['error']}")
+            continue
+        warm_ms = "-" if r["warm_ms"] is None else r["warm_ms"]
+        warm_aws_ms = "-" if r["warm_aws_ms"] is None else r["warm_aws_ms"]
+        print(f"{r['handler']:<22}{r['init_ms']:>10}{r['first_ms']:>10}{warm_ms:>10}{warm_aws_ms:>10}{r['rss_kb']:>10}{str(r['status'] or '-'):>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Local AWS stand-ins for running the Lambda handlers in-process.
+
+Starts moto's mock_aws, creates the global table, SSM parameters, versions
+bucket, SQS queue, VPC/subnet/security group and instance profile the
+handlers expect, and seeds the resources catalog and a test owner.
+"""
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+import boto3
+from moto import mock_aws
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDAS = os.path.join(ROOT, "lambdas")
+
+GLOBAL_REGION = "us-east-1"
+REGION = "us-east-1"
+TABLE_NAME = "App"
+BUCKET = "minecraft-versions-bench"
+SNAPSHOT_BUCKET = "minecraft-snapshots-bench"
+VERSION = "1.21.10"
+INSTANCE_TYPE = "t2.medium"
+
+CATALOG = {
+    "types": [
+        {"id": "t2.small", "name": "Chico (2–4 jugadores)", "serverFlags": "-Xms512M -Xmx1G", "creditCost": 1},
+        {"id": "t2.medium", "name": "Mediano (5–10 jugadores)", "serverFlags": "-Xms1G -Xmx2G", "creditCost": 3},
+        {"id": "t2.large", "name": "Grande (11–20 jugadores)", "serverFlags": "-Xms2G -Xmx4G", "creditCost": 2}
+    ],
+    "versions": [
+        {"id": "1.21.10", "label": "1.21.10", "java": "21"},
+        {"id": "1.20", "label": "1.20", "java": "17"}
+    ],
+    "regions": [
+        {"id": "us-east-1", "name": "US NORTH"},
+        {"id": "sa-east-1", "name": "SA EAST"}
+    ]
+}
+
+# Handlers, relative to lambdas/, and whether they live in the global stack
+HANDLERS = {
+    "createResources": ("global/createResources", True),
+    "getResources": ("global/getResources", True),
+    "getUserData": ("global/getUserData", True),
+    "getUsageHistory": ("global/getUsageHistory", True),
+    "operationSwitch": ("global/operationSwitch", True),
+    "serverMessagesHandler": ("global/serverMessagesHandler", True),
+    "serverStatus": ("global/serverStatus", True),
+    "signUpHandler": ("global/signUpHandler", True),
+    "statusStream": ("global/statusStream", True),
+    "wsConnections": ("global/wsConnections", True),
+    "billingSweep": ("global/billingSweep", True),
+    "fleetQuery": ("global/fleetQuery", True),
+    "createServer": ("regional/createServer", False),
+    "creditDeduction": ("regional/creditDeduction", False),
+    "deleteServer": ("regional/deleteServer", False),
+    "ingestMetrics": ("regional/ingestMetrics", False),
+    "poolManager": ("regional/poolManager", False),
+    "serverStateChange": ("regional/serverStateChange", False),
+    "snapshotServer": ("regional/snapshotServer", False),
+    "stuckStateReaper": ("regional/stuckStateReaper", False),
+    "turnOffServer": ("regional/turnOffServer", False),
+    "turnOnServer": ("regional/turnOnServer", False),
+}
+
+
+def configure_env(global_stack=True, efs_path=None):
+    """Set the environment the deployed stacks give each function."""
+    os.environ.update({
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_DEFAULT_REGION": REGION,
+        "REGION": REGION,
+        "GLOBAL_REGION": GLOBAL_REGION,
+        "EFS_PATH": efs_path or tempfile.mkdtemp(prefix="efs-"),
+        "TURN_OFF_LAMBDA_NAME": f"turnOffServer-{REGION}",
+        "SNAPSHOT_BUCKET": SNAPSHOT_BUCKET,
+        "METRICS_LAMBDA": f"ingestMetrics-{REGION}",
+        "POOL_LAMBDA": f"poolManager-{REGION}",
+        "WEBSOCKET_ENDPOINT": f"https://local.execute-api.{REGION}.amazonaws.com/Prod",
+    })
+    if global_stack:
+        os.environ["TABLE_NAME"] = TABLE_NAME
+    else:
+        # Regional functions resolve the table through SSM
+        os.environ.pop("TABLE_NAME", None)
+
+    shared = os.path.join(LAMBDAS, "shared")
+    if shared not in sys.path:
+        sys.path.insert(0, shared)
+
+
+def load_handler(name):
+    """Import a handler's app.py under a unique module name."""
+    path = os.path.join(LAMBDAS, HANDLERS[name][0], "app.py")
+    spec = importlib.util.spec_from_file_location(f"{name}_app", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class LocalAWS:
+    def __init__(self):
+        self.mock = mock_aws()
+        self.ids = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.mock.stop()
+
+    def start(self):
+        self.mock.start()
+
+        dynamodb = boto3.resource("dynamodb", region_name=GLOBAL_REGION)
+        self.table = dynamodb.create_table(
+            TableName=TABLE_NAME,
+            BillingMode="PAY_PER_REQUEST",
+            AttributeDefinitions=[
+                {"AttributeName": "PK", "AttributeType": "S"},
+                {"AttributeName": "SK", "AttributeType": "S"},
+                {"AttributeName": "StatusRegion", "AttributeType": "S"},
+                {"AttributeName": "StatusSince", "AttributeType": "S"},
+            ],
+            KeySchema=[
+                {"AttributeName": "PK", "KeyType": "HASH"},
+                {"AttributeName": "SK", "KeyType": "RANGE"},
+            ],
+            GlobalSecondaryIndexes=[{
+                "IndexName": "StatusRegionIndex",
+                "KeySchema": [
+                    {"AttributeName": "StatusRegion", "KeyType": "HASH"},
+                    {"AttributeName": "StatusSince", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            }],
+        )
+
+        ssm = boto3.client("ssm", region_name=GLOBAL_REGION)
+        ssm.put_parameter(Name="/global/dynamo/table-name", Value=TABLE_NAME, Type="String")
+        ssm.put_parameter(Name="/global/s3/minecraft-versions/id", Value=BUCKET, Type="String")
+
+        s3 = boto3.client("s3", region_name=GLOBAL_REGION)
+        s3.create_bucket(Bucket=BUCKET)
+        s3.put_object(Bucket=BUCKET, Key=f"{VERSION}/server.jar", Body=os.urandom(256 * 1024))
+        s3.create_bucket(Bucket=SNAPSHOT_BUCKET)
+
+        queue_url = boto3.client("sqs", region_name=GLOBAL_REGION).create_queue(
+            QueueName="globalServerQueue.fifo",
+            Attributes={"FifoQueue": "true", "DeduplicationScope": "messageGroup", "FifoThroughputLimit": "perMessageGroupId"}
+        )["QueueUrl"]
+        os.environ["QUEUE_URL"] = queue_url
+
+        ec2 = boto3.client("ec2", region_name=REGION)
+        vpc_id = ec2.create_vpc(CidrBlock="10.0.0.0/16")["Vpc"]["VpcId"]
+        subnet_id = ec2.create_subnet(VpcId=vpc_id, CidrBlock="10.0.0.0/17")["Subnet"]["SubnetId"]
+        sg_id = ec2.create_security_group(GroupName="bench", Description="bench", VpcId=vpc_id)["GroupId"]
+        os.environ.update({"SUBNET_ID": subnet_id, "SECURITY_GROUP_ID": sg_id, "EFS_ID": "fs-bench"})
+
+        iam = boto3.client("iam", region_name=GLOBAL_REGION)
+        iam.create_instance_profile(InstanceProfileName="EC2ServerInstanceProfile")
+
+        self.ids = {"queue_url": queue_url, "subnet_id": subnet_id, "security_group_id": sg_id}
+        self.seed_catalog()
+        return self
+
+    def seed_catalog(self):
+        self.table.put_item(Item={"PK": "GLOBAL", "SK": "RESOURCES", "version": "bench", **CATALOG})
+
+    def seed_owner(self, owner, credits=1000, status="RUNNING", instance_id=None, server_uuid=None):
+        """Profile, config profile and server item for one owner."""
+        server_uuid = server_uuid or f"uuid-{owner}"
+        self.table.put_item(Item={"PK": f"USERS#{owner}", "SK": "PROFILE", "Name": owner, "Credits": credits})
+        self.table.put_item(Item={
+            "PK": f"USERS#{owner}", "SK": "CONFIGPROFILE", "ServerUUID": server_uuid,
+            "Type": INSTANCE_TYPE, "Version": VERSION, "Region": REGION, "ServerName": owner
+        })
+        server = {
+            "PK": f"USERS#{owner}", "SK": "SERVER", "status": status,
+            "StatusRegion": f"{status}#{REGION}", "StatusSince": datetime.now(timezone.utc).isoformat()
+        }
+        if instance_id:
+            server["InstanceId"] = instance_id
+        self.table.put_item(Item=server)
+
+    def seed_world(self, owner, region_files=32, size=64 * 1024):
+        """A small world folder on the local EFS stand-in."""
+        path = os.path.join(os.environ["EFS_PATH"], f"uuid-{owner}")
+        os.makedirs(os.path.join(path, "world", "region"), exist_ok=True)
+        for i in range(region_files):
+            with open(os.path.join(path, "world", "region", f"r.{i}.0.mca"), "wb") as f:
+                f.write(os.urandom(size))
+        with open(os.path.join(path, "server.properties"), "w") as f:
+            f.write("motd=bench\n")
+        return path
+
+    def clear_owner(self, owner, keep_profile=True):
+        for sk in ("CONFIGPROFILE", "SERVER") + (() if keep_profile else ("PROFILE",)):
+            self.table.delete_item(Key={"PK": f"USERS#{owner}", "SK": sk})
+
+    def run_instance(self, owner):
+        """A running, tagged instance as turnOnServer would have launched it."""
+        ec2 = boto3.client("ec2", region_name=REGION)
+        image_id = ec2.describe_images(Owners=["amazon"])["Images"][0]["ImageId"]
+        instance = ec2.run_instances(
+            ImageId=image_id, InstanceType=INSTANCE_TYPE, MinCount=1, MaxCount=1,
+            SubnetId=self.ids["subnet_id"],
+            TagSpecifications=[{"ResourceType": "instance", "Tags": [
+                {"Key": "Name", "Value": f"uuid-{owner}"},
+                {"Key": "serverOwner", "Value": owner}
+            ]}]
+        )["Instances"][0]
+        return instance["InstanceId"]
+
+
+def stream_record(old=None, new=None, event_name=None):
+    """A synthetic DynamoDB stream record (NEW_AND_OLD_IMAGES) for a write that turned `old` into `new`."""
+    from boto3.dynamodb.types import TypeSerializer
+    serializer = TypeSerializer()
+    item = new or old
+    data = {"Keys": {k: serializer.serialize(item[k]) for k in ("PK", "SK")}, "StreamViewType": "NEW_AND_OLD_IMAGES"}
+    if old:
+        data["OldImage"] = {k: serializer.serialize(v) for k, v in old.items()}
+    if new:
+        data["NewImage"] = {k: serializer.serialize(v) for k, v in new.items()}
+    return {
+        "eventName": event_name or ("INSERT" if not old else "REMOVE" if not new else "MODIFY"),
+        "eventSource": "aws:dynamodb",
+        "dynamodb": data,
+    }
+
+
+def api_event(owner, body=None, headers=None):
+    event = {"queryStringParameters": {"owner": owner}, "headers": headers or {}}
+    if body is not None:
+        event["body"] = json.dumps(body)
+    return event
@@ -0,0 +1,463 @@
+"""
+End-to-end load benchmark of the control plane, in one process against moto.
+
+  serverMessagesHandler -> SQS (FIFO) -> operationSwitch -> createServer /
+  turnOnServer / turnOffServer / deleteServer
+
+serverStateChange stands in for the EC2 "running" event after each launch,
+and creditDeduction ticks run for every RUNNING server. Lambda invocations
+go through an in-process runtime with a fixed concurrency (the regional
+concurrency limit we want to size).
+
+N simulated owners poll serverStatus and click through create / start /
+stop / delete, with duplicate clicks and quick on/off/on flips mixed in.
+At the end the pipeline is drained and the suite reports:
+
+  throughput     API requests and Lambda invocations per second
+  latency        p50/p90/p99/max per stage (API, queue wait, Lambda wait,
+                 each handler, and request -> handler done per operation)
+  dynamodb       requests per operation
+  consistency    duplicate instances, stuck transitions and other states
+                 that should not exist once everything settled
+
+Usage:
+  pip install -r benchmarks/requirements.txt
+  python benchmarks/pipeline_load.py [--owners 50] [--rounds 20] [--lambda-concurrency 20]
+                                     [--dup-rate 0.1] [--flip-rate 0.05] [--seed 1] [--json] [--verbose]
+
+Exits non-zero when the consistency check finds anything.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import boto3
+
+import local_aws
+
+REGION = local_aws.REGION
+TRANSIENT = {"CREATING", "STARTING", "PENDING", "STOPPING", "DELETING"}
+LIVE_STATES = ["pending", "running", "stopping", "stopped"]
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.counters = {}
+
+    def add(self, stage, ms):
+        with self.lock:
+            self.latencies.setdefault(stage, []).append(ms)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def time(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, (time.perf_counter() - started) * 1000)
+
+
+def percentiles(values):
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {
+        "n": len(values),
+        "p50": round(pick(0.50), 2),
+        "p90": round(pick(0.90), 2),
+        "p99": round(pick(0.99), 2),
+        "max": round(values[-1], 2)
+    }
+
+
+class LocalLambda:
+    """Stand-in for the Lambda client: Event invokes run on a bounded thread pool."""
+
+    OPERATIONS = {"createServer": "CREATE", "turnOnServer": "TURNON", "turnOffServer": "TURNOFF", "deleteServer": "DELETE"}
+
+    def __init__(self, sim, concurrency):
+        self.sim = sim
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def invoke(self, FunctionName, InvocationType="RequestResponse", Payload="{}", **kwargs):
+        name = FunctionName.split("-", 1)[0]
+        payload = json.loads(Payload)
+        if InvocationType != "Event":
+            return {"StatusCode": 200, "Payload": self.run(name, payload, time.perf_counter())}
+
+        future = self.pool.submit(self.run, name, payload, time.perf_counter())
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self.done)
+        return {"StatusCode": 202}
+
+    def done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+
+    def busy(self):
+        with self.lock:
+            return bool(self.pending)
+
+    def run(self, name, payload, submitted):
+        stats = self.sim.stats
+        stats.add("lambda_wait", (time.perf_counter() - submitted) * 1000)
+        stats.count(f"invocations.{name}")
+        try:
+            with stats.time(name):
+                result = self.sim.handlers[name].lambda_handler(payload, None)
+        except Exception as e:
+            stats.count(f"errors.{name}")
+            print(f"{name} raised {e!r}", file=sys.stderr)
+            return None
+
+        status = result.get("statusCode") if isinstance(result, dict) else None
+        stats.count(f"status.{name}.{status or '-'}")
+
+        owner = payload.get("owner")
+        operation = self.OPERATIONS.get(name)
+        sent = self.sim.sent.get((owner, operation))
+        if sent:
+            stats.add(f"e2e.{operation}", (time.perf_counter() - sent) * 1000)
+
+        # EventBridge stand-in: moto instances are running as soon as they launch
+        body = result.get("body") if isinstance(result, dict) else None
+        if name == "turnOnServer" and isinstance(body, dict) and body.get("status") == "PENDING":
+            self.invoke(f"serverStateChange-{REGION}", "Event", json.dumps(
+                {"detail": {"instance-id": body["instance_id"], "state": "running"}}
+            ))
+        if name == "serverStateChange" and status == 200:
+            owner = self.sim.instance_owner(payload["detail"]["instance-id"])
+            sent = self.sim.sent.get((owner, "TURNON"))
+            if sent:
+                stats.add("e2e.TURNON_RUNNING", (time.perf_counter() - sent) * 1000)
+        return result
+
+
+class Simulation:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.stats = Stats()
+        self.sent = {}
+        self.stop = threading.Event()
+
+        # Everything shares one table; regional handlers take TABLE_NAME over SSM too
+        local_aws.configure_env(global_stack=True)
+        os.environ.pop("POOL_LAMBDA", None)
+        self.aws = local_aws.LocalAWS().start()
+
+        import clients
+        import instrumentation
+        # Handlers run concurrently here, so per-invocation EMF would mix; count calls instead
+        instrumentation.ENABLED = False
+        instrumentation.add_listener(self.on_call)
+
+        self.lambda_runtime = LocalLambda(self, args.lambda_concurrency)
+        clients._clients[("lambda", REGION)] = self.lambda_runtime
+
+        self.handlers = {name: local_aws.load_handler(name) for name in (
+            "serverMessagesHandler", "serverStatus", "operationSwitch", "createServer", "turnOnServer",
+            "turnOffServer", "deleteServer", "serverStateChange", "creditDeduction"
+        )}
+        self.sqs = boto3.client("sqs", region_name=local_aws.GLOBAL_REGION)
+        self.ec2 = boto3.client("ec2", region_name=REGION)
+        self.owners = [f"owner{i}@bench" for i in range(args.owners)]
+        for owner in self.owners:
+            self.aws.table.put_item(Item={
+                "PK": f"USERS#{owner}", "SK": "PROFILE", "Name": owner,
+                "Credits": self.rng.randint(args.min_credits, args.max_credits)
+            })
+
+    def on_call(self, service, operation, ms, error):
+        self.stats.count(f"{service}.{operation}")
+        if error:
+            self.stats.count(f"{service}.{operation}.errors")
+
+    def instance_owner(self, instance_id):
+        reservations = self.ec2.describe_instances(InstanceIds=[instance_id])["Reservations"]
+        tags = {t["Key"]: t["Value"] for t in reservations[0]["Instances"][0].get("Tags", [])}
+        return tags.get("serverOwner")
+
+    # --- API side ---
+
+    def api(self, owner, operation):
+        body = {"operation": operation, "owner": owner}
+        if operation == "CREATE":
+            body |= {"serverType": local_aws.INSTANCE_TYPE, "serverVersion": local_aws.VERSION,
+                     "serverRegion": REGION, "serverName": owner}
+        self.sent[(owner, operation)] = time.perf_counter()
+        self.stats.count(f"api.{operation}")
+        with self.stats.time("api.serverMessagesHandler"):
+            response = self.handlers["serverMessagesHandler"].lambda_handler({"body": json.dumps(body)}, None)
+        self.stats.count(f"status.serverMessagesHandler.{response['statusCode']}")
+
+    def status(self, owner):
+        with self.stats.time("api.serverStatus"):
+            response = self.handlers["serverStatus"].lambda_handler(local_aws.api_event(owner), None)
+        if response["statusCode"] != 200:
+            return None
+        return json.loads(response["body"]).get("status")
+
+    def owner_step(self, owner, rng):
+        """One UI interaction: look at the server, maybe click something."""
+        status = self.status(owner)
+        args = self.args
+
+        if status is None:
+            clicks = ["CREATE"] if rng.random() < 0.6 else []
+        elif status == "OFFLINE":
+            roll = rng.random()
+            if roll < args.flip_rate:
+                clicks = ["TURNON", "TURNOFF", "TURNON"]
+            elif roll < 0.5:
+                clicks = ["TURNON"]
+            elif roll < 0.55:
+                clicks = ["DELETE"]
+            else:
+                clicks = []
+        elif status == "RUNNING":
+            clicks = ["TURNOFF"] if rng.random() < 0.3 else []
+        else:
+            # Transitioning: impatient users click again
+            clicks = []
+
+        for operation in clicks:
+            self.api(owner, operation)
+            if rng.random() < args.dup_rate:
+                self.stats.count("api.duplicate_clicks")
+                self.api(owner, operation)
+
+    # --- Queue side ---
+
+    def poll(self):
+        queue_url = os.environ["QUEUE_URL"]
+        while not self.stop.is_set():
+            messages = self.sqs.receive_message(
+                QueueUrl=queue_url, MaxNumberOfMessages=10, AttributeNames=["SentTimestamp"]
+            ).get("Messages", [])
+            if not messages:
+                time.sleep(0.005)
+                continue
+
+            now_ms = time.time() * 1000
+            for m in messages:
+                self.stats.add("queue_wait", now_ms - int(m["Attributes"]["SentTimestamp"]))
+
+            records = [{"messageId": m["MessageId"], "body": m["Body"], "receiptHandle": m["ReceiptHandle"]} for m in messages]
+            with self.stats.time("operationSwitch"):
+                result = self.handlers["operationSwitch"].lambda_handler({"Records": records}, None)
+
+            failed = {f["itemIdentifier"] for f in result["batchItemFailures"]}
+            self.stats.count("queue.messages", len(messages))
+            self.stats.count("queue.retried", len(failed))
+            for m in messages:
+                if m["MessageId"] in failed:
+                    self.sqs.change_message_visibility(QueueUrl=queue_url, ReceiptHandle=m["ReceiptHandle"], VisibilityTimeout=0)
+                else:
+                    self.sqs.delete_message(QueueUrl=queue_url, ReceiptHandle=m["ReceiptHandle"])
+
+    def queue_empty(self):
+        attributes = self.sqs.get_queue_attributes(
+            QueueUrl=os.environ["QUEUE_URL"],
+            AttributeNames=["ApproximateNumberOfMessages", "ApproximateNumberOfMessagesNotVisible"]
+        )["Attributes"]
+        return all(int(v) == 0 for v in attributes.values())
+
+    def drain(self, timeout=120):
+        deadline = time.monotonic() + timeout
+        quiet = 0
+        while time.monotonic() < deadline and quiet < 3:
+            quiet = quiet + 1 if self.queue_empty() and not self.lambda_runtime.busy() else 0
+            time.sleep(0.05)
+        return quiet >= 3
+
+    # --- Billing ---
+
+    def credit_tick(self):
+        for item in self.aws.table.scan()["Items"]:
+            if item["SK"] == "SERVER" and item.get("status") == "RUNNING":
+                owner = item["PK"].split("#", 1)[1]
+                self.lambda_runtime.invoke(f"creditDeduction-{REGION}", "Event", json.dumps(
+                    {"owner": owner, "instanceType": local_aws.INSTANCE_TYPE}
+                ))
+
+    # --- Run ---
+
+    def run(self):
+        args = self.args
+        pollers = [threading.Thread(target=self.poll, daemon=True) for _ in range(args.pollers)]
+        for t in pollers:
+            t.start()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.client_concurrency) as clients_pool:
+            for round_number in range(args.rounds):
+                # Each owner gets its own RNG stream so the click mix is reproducible
+                seeds = [self.rng.random() for _ in self.owners]
+                list(clients_pool.map(lambda o: self.owner_step(o[0], random.Random(o[1])), zip(self.owners, seeds)))
+                if args.tick_every and round_number % args.tick_every == args.tick_every - 1:
+                    self.credit_tick()
+                time.sleep(args.think_ms / 1000)
+
+        drained = self.drain()
+        elapsed = time.perf_counter() - started
+        self.stop.set()
+        for t in pollers:
+            t.join()
+        self.lambda_runtime.pool.shutdown(wait=True)
+
+        return self.report(elapsed, drained)
+
+    def report(self, elapsed, drained):
+        counters = self.stats.counters
+        api_requests = sum(v for k, v in counters.items() if k.startswith("api.") and k.split(".")[1].isupper())
+        invocations = sum(v for k, v in counters.items() if k.startswith("invocations."))
+        return {
+            "config": vars(self.args),
+            "seconds": round(elapsed, 2),
+            "drained": drained,
+            "throughput": {
+                "api_requests": api_requests,
+                "api_per_second": round(api_requests / elapsed, 1),
+                "invocations": invocations,
+                "invocations_per_second": round(invocations / elapsed, 1)
+            },
+            "latency_ms": {stage: percentiles(v) for stage, v in sorted(self.stats.latencies.items())},
+            "dynamodb": {k.split(".", 1)[1]: v for k, v in sorted(counters.items()) if k.startswith("dynamodb.")},
+            "counters": {k: v for k, v in sorted(counters.items()) if not k.startswith(("dynamodb.", "ec2.", "ssm.", "s3.", "sqs."))},
+            "consistency": self.check()
+        }
+
+    def check(self):
+        """States that must not exist once the pipeline has settled."""
+        items = self.aws.table.scan()["Items"]
+        owners = {}
+        for item in items:
+            if item["PK"].startswith("USERS#"):
+                owners.setdefault(item["PK"].split("#", 1)[1], {})[item["SK"]] = item
+
+        live = {}
+        paginator = self.ec2.get_paginator("describe_instances")
+        for page in paginator.paginate(Filters=[
+            {"Name": "tag-key", "Values": ["serverOwner"]},
+            {"Name": "instance-state-name", "Values": LIVE_STATES}
+        ]):
+            for reservation in page["Reservations"]:
+                for instance in reservation["Instances"]:
+                    tags = {t["Key"]: t["Value"] for t in instance.get("Tags", [])}
+                    live.setdefault(tags["serverOwner"], []).append(instance["InstanceId"])
+
+        problems = {
+            "stuck_transition": [],
+            "duplicate_instances": [],
+            "running_without_instance": [],
+            "orphan_instance": [],
+            "offline_with_instance": [],
+            "profile_mismatch": [],
+            "index_mismatch": [],
+            "negative_credits": []
+        }
+        for owner, by_sk in owners.items():
+            server = by_sk.get("SERVER")
+            status = server.get("status") if server else None
+            instances = live.get(owner, [])
+
+            if status in TRANSIENT:
+                problems["stuck_transition"].append(f"{owner}: {status}")
+            if len(instances) > 1:
+                problems["duplicate_instances"].append(f"{owner}: {instances}")
+            if status == "RUNNING" and server.get("InstanceId") not in instances:
+                problems["running_without_instance"].append(owner)
+            for instance_id in instances:
+                if not server or server.get("InstanceId") != instance_id:
+                    if status == "OFFLINE" and server.get("StoppedAt"):
+                        continue
+                    problems["orphan_instance"].append(f"{owner}: {instance_id}")
+            if status == "OFFLINE" and instances and not server.get("StoppedAt"):
+                problems["offline_with_instance"].append(owner)
+            if ("CONFIGPROFILE" in by_sk) != ("SERVER" in by_sk):
+                problems["profile_mismatch"].append(owner)
+            if server and server.get("StatusRegion") != f"{status}#{REGION}":
+                problems["index_mismatch"].append(f"{owner}: {status} indexed as {server.get('StatusRegion')}")
+            if by_sk.get("PROFILE", {}).get("Credits", 0) < 0:
+                problems["negative_credits"].append(owner)
+
+        return {name: {"count": len(found), "examples": found[:5]} for name, found in problems.items()}
+
+
+def print_report(report):
+    t = report["throughput"]
+    print(f"{report['config']['owners']} owners, {report['config']['rounds']} rounds in {report['seconds']}s"
+          f"{'' if report['drained'] else ' (NOT fully drained)'}")
+    print(f"  {t['api_requests']} API requests ({t['api_per_second']}/s), "
+          f"{t['invocations']} Lambda invocations ({t['invocations_per_second']}/s)")
+
+    print(f"\n{'stage':<28}{'n':>7}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for stage, p in report["latency_ms"].items():
+        print(f"{stage:<28}{p['n']:>7}{p['p50']:>10}{p['p90']:>10}{p['p99']:>10}{p['max']:>10}")
+
+    print(f"\n{'dynamodb operation':<28}{'requests':>10}")
+    for operation, n in report["dynamodb"].items():
+        print(f"{operation:<28}{n:>10}")
+
+    print(f"\n{'counter':<40}{'value':>8}")
+    for name, n in report["counters"].items():
+        print(f"{name:<40}{n:>8}")
+
+    print("\nconsistency")
+    for name, found in report["consistency"].items():
+        examples = f"  e.g. {found['examples']}" if found["count"] else ""
+        print(f"  {name:<26}{found['count']:>5}{examples}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--owners", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=20, help="UI interactions per owner")
+    parser.add_argument("--think-ms", type=int, default=50, help="pause between rounds")
+    parser.add_argument("--client-concurrency", type=int, default=16, help="concurrent API callers")
+    parser.add_argument("--pollers", type=int, default=2, help="concurrent operationSwitch batches")
+    parser.add_argument("--lambda-concurrency", type=int, default=20, help="concurrent regional invocations")
+    parser.add_argument("--dup-rate", type=float, default=0.1, help="chance a click is sent twice")
+    parser.add_argument("--flip-rate", type=float, default=0.05, help="chance of TURNON, TURNOFF, TURNON in a row")
+    parser.add_argument("--tick-every", type=int, default=5, help="creditDeduction tick every N rounds (0 disables)")
+    parser.add_argument("--min-credits", type=int, default=5)
+    parser.add_argument("--max-credits", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep the handlers' own log output")
+    args = parser.parse_args()
+
+    stdout = sys.stdout
+    if not args.verbose:
+        sys.stdout = open(os.devnull, "w")
+    try:
+        report = Simulation(args).run()
+    finally:
+        sys.stdout = stdout
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    # Non-zero exit when the run left broken state behind, so CI can gate on it
+    if any(found["count"] for found in report["consistency"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Micro-benchmark of API response serialization, no AWS involved.
+
+Compares the shared response layer (lambdas/shared/api_response.py) with the
+per-handler code it replaced, on payloads shaped like what DynamoDB returns
+(numbers as Decimal, PK/SK attached):
+
+  clean        getUserData: recursive copy turning Decimals into floats, then json.dumps
+  default=str  serverStatus / getResources: pop PK/SK, json.dumps(default=str)
+               (numbers come out as strings)
+  encode       api_response.encode: one pass in the C encoder, numbers stay numeric
+  gzip         api_response.compress on top of encode, with the size it saves
+
+Payloads: the resources catalog (as seeded locally and with 40 types), a
+serverStatus body and a PROFILE item with nested numeric history.
+
+Usage:
+  pip install -r benchmarks/requirements.txt
+  python benchmarks/serialize.py [--number 2000] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lambdas", "shared"))
+import api_response
+
+import local_aws
+
+
+def as_dynamodb(obj):
+    """Numbers as the boto3 deserializer returns them."""
+    if isinstance(obj, dict):
+        return {k: as_dynamodb(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [as_dynamodb(v) for v in obj]
+    if isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        return Decimal(str(obj))
+    return obj
+
+
+def payloads():
+    catalog = {"PK": "GLOBAL", "SK": "RESOURCES", "version": "0123456789abcdef", **local_aws.CATALOG}
+    large = dict(catalog, types=[
+        {"id": f"t{i}.large", "name": f"Tipo {i} (hasta {i * 2} jugadores)", "serverFlags": "-Xms1G -Xmx2G",
+         "creditCost": i % 5 + 1, "vcpus": 2, "memoryGiB": 4.0}
+        for i in range(40)
+    ])
+    status = {
+        "PK": "USERS#bench@example.com", "SK": "SERVER", "ServerUUID": "0b8e6a9c-5a53-4c57-9d62-9f3f0f6b1d2e",
+        "Type": "Mediano (5–10 jugadores)", "Version": "1.21.10", "Region": "US NORTH", "ServerName": "bench",
+        "status": "RUNNING", "InstanceId": "i-0123456789abcdef0", "PublicIp": "203.0.113.10",
+        "LaunchedAt": "2026-10-18T12:00:00+00:00", "StatusRegion": "RUNNING#us-east-1",
+        "StatusSince": "2026-10-18T12:00:00+00:00",
+    }
+    profile = {
+        "PK": "USERS#bench@example.com", "SK": "PROFILE", "Name": "Bench", "Credits": 1234,
+        "history": [{"ts": 1760788800 + 600 * i, "deducted": 3, "balance": 1234 - 3 * i, "rate": 0.5} for i in range(100)],
+    }
+    return {
+        "catalog": as_dynamodb(catalog),
+        "catalog (40 types)": as_dynamodb(large),
+        "serverStatus": as_dynamodb(status),
+        "profile + history": as_dynamodb(profile),
+    }
+
+
+def clean_path(item):
+    def clean(obj):
+        if isinstance(obj, list):
+            return [clean(i) for i in obj]
+        if isinstance(obj, dict):
+            return {k: clean(v) for k, v in obj.items() if k not in ("PK", "SK")}
+        if isinstance(obj, Decimal):
+            return float(obj)
+        return obj
+    return json.dumps(clean(item))
+
+
+def default_str_path(item):
+    item = dict(item)
+    item.pop("PK", None)
+    item.pop("SK", None)
+    return json.dumps(item, default=str)
+
+
+def run(number):
+    results = {}
+    for name, item in payloads().items():
+        body = api_response.encode(item)
+        row = {"bytes": len(body.encode()), "gzip_bytes": len(api_response.compress(body)) * 3 // 4}
+        for label, fn in (
+            ("clean", lambda: clean_path(item)),
+            ("default=str", lambda: default_str_path(item)),
+            ("encode", lambda: api_response.encode(item)),
+            ("encode+gzip", lambda: api_response.compress(api_response.encode(item))),
+        ):
+            row[label] = round(min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6, 2)
+        results[name] = row
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=2000, help="calls per timing")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.number)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'payload':<22}{'bytes':>8}{'gzip':>8}{'clean us':>11}{'str us':>9}{'encode us':>11}{'+gzip us':>10}")
+    for name, r in results.items():
+        print(f"{name:<22}{r['bytes']:>8}{r['gzip_bytes']:>8}{r['clean']:>11}{r['default=str']:>9}"
+              f"{r['encode']:>11}{r['encode+gzip']:>10}")
+
+
+if __name__ == "__main__":
+    main()
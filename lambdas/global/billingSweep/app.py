@@ -0,0 +1,123 @@
+import os
+import json
+import clients
+import config_cache
+import credits
+import instrumentation
+import status_index
+import usage
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+# ENV: REGION, TABLE_NAME, MAX_WORKERS
+# Scheduled every 10 minutes: bills every RUNNING server in one pass and
+# shuts down the servers of depleted accounts. RUNNING servers come from the
+# status index, so the cost follows active servers, not signups.
+
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "16"))
+DEFAULT_CREDIT_COST = 1
+BATCH_GET_SIZE = 100
+
+@instrumentation.handler
+def lambda_handler(event, context):
+    table = config_cache.get_table()
+    with instrumentation.step("find_running"):
+        servers = find_running_servers(table)
+    prices = get_price_table()
+
+    # One deduction per owner per tick
+    charges = [(s["owner"], prices.get(s["type"], DEFAULT_CREDIT_COST), s["region"], s["type"]) for s in servers]
+
+    with instrumentation.step("deduct"), ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        results = list(pool.map(lambda c: deduct(table, *c), charges))
+
+    depleted = [r for r in results if r["depleted"]]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        list(pool.map(turn_off, depleted))
+
+    summary = {
+        "running": len(servers),
+        "billed": sum(1 for r in results if r["error"] is None),
+        "errors": sum(1 for r in results if r["error"] is not None),
+        "depleted": len(depleted),
+        "deducted": int(sum(r["deducted"] for r in results)),
+    }
+    print(f"Billing sweep: {json.dumps(summary)}")
+    return {"statusCode": 200, "body": summary}
+
+
+def find_running_servers(table):
+    """RUNNING servers from the status index, joined with their CONFIGPROFILE for the type."""
+    resources = config_cache.get_resources()
+    regions = list(resources.regions) if resources else []
+
+    owners = {}
+    for server in status_index.iter_servers(table, "RUNNING", regions):
+        owners[status_index.owner_of(server)] = status_index.region_of(server)
+
+    servers = []
+    keys = [{"PK": f"USERS#{owner}", "SK": "CONFIGPROFILE"} for owner in owners]
+    for i in range(0, len(keys), BATCH_GET_SIZE):
+        for config in batch_get(table, keys[i:i + BATCH_GET_SIZE]):
+            owner = config["PK"].split("#", 1)[1]
+            servers.append({
+                "owner": owner,
+                "type": config.get("Type"),
+                "region": owners[owner],
+            })
+    return servers
+
+
+def batch_get(table, keys):
+    """BatchGetItem that retries whatever DynamoDB returns as unprocessed."""
+    dynamodb = clients.resource("dynamodb", config_cache.global_region())
+    request = {table.name: {"Keys": keys, "ProjectionExpression": "PK, #t", "ExpressionAttributeNames": {"#t": "Type"}}}
+    items = []
+    while request:
+        response = dynamodb.batch_get_item(RequestItems=request)
+        items.extend(response.get("Responses", {}).get(table.name, []))
+        request = response.get("UnprocessedKeys") or None
+    return items
+
+
+def get_price_table():
+    resources = config_cache.get_resources()
+    if not resources:
+        return {}
+    return {type_id: t.get("creditCost", DEFAULT_CREDIT_COST) for type_id, t in resources.types.items()}
+
+
+def deduct(table, owner, deduction, region, instance_type):
+    result = {"owner": owner, "region": region, "deducted": 0, "depleted": False, "error": None}
+
+    try:
+        outcome = credits.deduct_credits(table, owner, deduction)
+    except ClientError as e:
+        print(f"DynamoDB update error for {owner}: {e}")
+        result["error"] = str(e)
+        return result
+    except credits.CreditsContention as e:
+        print(e)
+        result["error"] = "Contention"
+        return result
+
+    if outcome is None:
+        result["error"] = "Profile not found"
+        return result
+
+    usage.record(table, owner, outcome, instance_type, "billingSweep")
+    result["deducted"] = outcome["deducted"]
+    result["depleted"] = outcome["depleted"]
+    return result
+
+
+def turn_off(result):
+    region = result["region"]
+    try:
+        clients.client("lambda", region).invoke(
+            FunctionName=f"turnOffServer-{region}",
+            InvocationType="Event",
+            Payload=json.dumps({"owner": result["owner"]}),
+        )
+    except ClientError as e:
+        print(f"Error invoking turnOffServer for {result['owner']}: {e}")
@@ -1,13 +1,13 @@
-import boto3
-import os
 import json
+import hashlib
+import config_cache
+import instrumentation
 
 #ENV: REGION, TABLE_NAME
 
-dynamodb = boto3.resource("dynamodb", region_name=os.environ["REGION"])
-table = dynamodb.Table(os.environ["TABLE_NAME"])
-
+@instrumentation.handler
 def lambda_handler(event, context):
+    table = config_cache.get_table()
     try:
         body = event.get("body", {})
         if not isinstance(body, dict):
@@ -20,6 +20,10 @@ def lambda_handler(event, context):
             "versions": body.get("versions", []),
             "regions": body.get("regions", [])
         }
+        # Catalog version (content hash): readers invalidate their cached copy
+        # when it changes, and getResources serves it as the ETag
+        catalog = json.dumps({k: item[k] for k in ("types", "versions", "regions")}, sort_keys=True, default=str)
+        item["version"] = hashlib.sha256(catalog.encode()).hexdigest()[:16]
 
         table.put_item(Item=item)
 
@@ -34,12 +38,13 @@ def lambda_handler(event, context):
 #       "types":[
 #             {"id":"t2.small","name":"Chico (2–4 jugadores)", "serverFlags": "-Xms512M -Xmx1G", "creditCost": 1},
 #             {"id":"t2.medium","name":"Mediano (5–10 jugadores)", "serverFlags": "-Xms1G -Xmx2G", "creditCost": 3},
-#             {"id":"t2.large","name":"Grande (11–20 jugadores)", "serverFlags": "-Xms2G -Xmx4G", "creditCost": 2}
+#             {"id":"t2.large","name":"Grande (11–20 jugadores)", "serverFlags": "-Xms2G -Xmx4G", "creditCost": 2,
+#              "jvmOverrides": {"MaxGCPauseMillis": 150}}
 #         ],
 #         "versions":[
-#             {"id":"1.24","label":"1.24"},
-#             {"id":"1.21.10","label":"1.21.10"},
-#             {"id":"1.20","label":"1.20"}
+#             {"id":"1.24","label":"1.24", "java": "21"},
+#             {"id":"1.21.10","label":"1.21.10", "java": "21"},
+#             {"id":"1.20","label":"1.20", "java": "17"}
 #         ],
 #         "regions":[
 #             {"id":"us-east-1","name":"US NORTH"},
@@ -0,0 +1,136 @@
+import json
+from datetime import datetime, timezone, timedelta
+import config_cache
+import instrumentation
+import status_index
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+#ENV: REGION, TABLE_NAME
+
+# Back office fleet query over the status index, invoked directly (dashboards,
+# reapers). Event:
+#   {"status": "RUNNING" | ["STARTING", "DELETING"], "region": "sa-east-1" (default: every
+#    catalog region), "olderThanMinutes": 15, "limit": 100, "nextToken": "..."}
+# Returns up to `limit` servers and a nextToken while there are more.
+# {"backfill": true} indexes SERVER items written before the index existed.
+
+MAX_LIMIT = 1000
+
+@instrumentation.handler
+def lambda_handler(event, context):
+    table = config_cache.get_table()
+
+    if event.get("backfill"):
+        with instrumentation.step("backfill"):
+            indexed = backfill(table)
+        return {"statusCode": 200, "body": {"indexed": indexed}}
+
+    statuses = event.get("status")
+    if not statuses:
+        return {"statusCode": 400, "body": "Missing 'status' in request"}
+    if isinstance(statuses, str):
+        statuses = [statuses]
+
+    if event.get("region"):
+        regions = [event["region"]]
+    else:
+        resources = config_cache.get_resources()
+        regions = list(resources.regions) if resources else []
+
+    try:
+        limit = min(int(event.get("limit", 100)), MAX_LIMIT)
+        older_than = None
+        if event.get("olderThanMinutes") is not None:
+            older_than = datetime.now(timezone.utc) - timedelta(minutes=float(event["olderThanMinutes"]))
+    except (TypeError, ValueError):
+        return {"statusCode": 400, "body": "'limit' and 'olderThanMinutes' must be numbers"}
+
+    # Partitions in a fixed order; the token says where the last page stopped
+    partitions = [(s, r) for s in statuses for r in regions]
+    start = 0
+    start_key = None
+    if event.get("nextToken"):
+        try:
+            status, region, start_key = status_index.decode_token(event["nextToken"])
+            start = partitions.index((status, region))
+        except ValueError as e:
+            return {"statusCode": 400, "body": str(e)}
+
+    servers = []
+    next_token = None
+    try:
+        with instrumentation.step("query"):
+            for status, region in partitions[start:]:
+                while len(servers) < limit:
+                    items, start_key = status_index.query_page(
+                        table, status, region, older_than, limit - len(servers), start_key
+                    )
+                    servers.extend(summarize(item) for item in items)
+                    if not start_key:
+                        break
+                if start_key:
+                    next_token = status_index.encode_token(status, region, start_key)
+                    break
+                if len(servers) >= limit and (status, region) != partitions[-1]:
+                    # Page is full at a partition boundary: resume at the next one
+                    next_status, next_region = partitions[partitions.index((status, region)) + 1]
+                    next_token = status_index.encode_token(next_status, next_region, None)
+                    break
+    except ClientError as e:
+        return {"statusCode": 500, "body": f"Error querying fleet: {e}"}
+
+    return {"statusCode": 200, "body": {"servers": servers, "count": len(servers), "nextToken": next_token}}
+
+
+def summarize(item):
+    return {
+        "owner": status_index.owner_of(item),
+        "status": item.get("status"),
+        "region": status_index.region_of(item),
+        "since": item.get("StatusSince"),
+        "instanceId": item.get("InstanceId"),
+        "publicIp": item.get("PublicIp"),
+        "launchedAt": item.get("LaunchedAt"),
+    }
+
+
+def backfill(table):
+    """Add the index attributes to SERVER items that lack them. One Scan, run once after deploying the index."""
+    regions = {}
+    unindexed = []
+    scan_kwargs = {"FilterExpression": Attr("SK").is_in(["SERVER", "CONFIGPROFILE"])}
+
+    while True:
+        response = table.scan(**scan_kwargs)
+        for item in response.get("Items", []):
+            if item["SK"] == "CONFIGPROFILE":
+                regions[item["PK"]] = item.get("Region")
+            elif "StatusRegion" not in item:
+                unindexed.append(item)
+        if "LastEvaluatedKey" not in response:
+            break
+        scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    indexed = 0
+    for item in unindexed:
+        region = regions.get(item["PK"])
+        if not region or not item.get("status"):
+            print(f"Skipping {item['PK']}: no region or status")
+            continue
+        set_status, status_values = status_index.update(item["status"], region)
+        try:
+            # Only if no status write got there first
+            table.update_item(
+                Key={"PK": item["PK"], "SK": "SERVER"},
+                UpdateExpression=f"SET {set_status}",
+                ConditionExpression="#s = :current AND attribute_not_exists(StatusRegion)",
+                ExpressionAttributeNames={"#s": "status"},
+                ExpressionAttributeValues={":current": item["status"]} | status_values
+            )
+            indexed += 1
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+    print(f"Backfill: {json.dumps({'scanned': len(unindexed), 'indexed': indexed})}")
+    return indexed
@@ -1,27 +1,42 @@
-import boto3
-import json
 import os
+import json
+import hashlib
+import config_cache
+import http_utils
+import instrumentation
+import api_response
 
-# ENV: REGION, TABLE_NAME
+# ENV: REGION, TABLE_NAME, CACHE_MAX_AGE
 
-def lambda_handler(event, context):
-    dynamodb = boto3.resource("dynamodb", region_name=os.environ["REGION"])
-    table = dynamodb.Table(os.environ["TABLE_NAME"])
+CACHE_MAX_AGE = int(os.environ.get("CACHE_MAX_AGE", "300"))
+
+# Serialized catalog for the Resources object it was built from, kept per warm container
+_catalog = {"resources": None, "body": None, "gzip": None, "etag": None}
 
+@instrumentation.handler
+def lambda_handler(event, context):
     try:
-        response = table.get_item(Key={"PK": "GLOBAL", "SK": "RESOURCES"})
-        item = response.get("Item", {})
+        # Cached item; refetched only when its version changes
+        resources = config_cache.get_resources()
 
-        # Remove PK and SK
-        item.pop("PK", None)
-        item.pop("SK", None)
+        if _catalog["resources"] is not resources or _catalog["body"] is None:
+            item = resources.item if resources else {}
+            body = api_response.encode(item)
+            version = item.get("version") or hashlib.sha256(body.encode()).hexdigest()[:16]
+            # Compressed once per catalog version, not per poll
+            gzipped = api_response.compress(body) if len(body) >= api_response.GZIP_MIN_BYTES else None
+            _catalog.update(resources=resources, body=body, gzip=gzipped, etag=f'"{version}"')
 
-        return {
-            "statusCode": 200,
-            "headers": {"Content-Type": "application/json"},
-            "body": json.dumps(item, default=str)
+        headers = {
+            "ETag": _catalog["etag"],
+            "Cache-Control": f"private, max-age={CACHE_MAX_AGE}"
         }
 
+        if http_utils.etag_matches(event, _catalog["etag"]):
+            return {"statusCode": 304, "headers": headers, "body": ""}
+
+        return api_response.json_response(event, _catalog["body"], headers=headers, gzipped=_catalog["gzip"])
+
     except Exception as e:
         return {
             "statusCode": 500,
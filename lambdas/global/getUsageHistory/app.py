@@ -0,0 +1,70 @@
+from datetime import datetime, timezone, timedelta
+import config_cache
+import instrumentation
+import api_response
+import usage
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+#ENV: REGION, TABLE_NAME
+
+# GET /usage?owner=<email>&days=30            daily credit usage, oldest first
+# GET /usage?owner=<email>&months=12          monthly totals instead
+# One Query over the rollup items (see shared/usage.py), never the raw events.
+
+DEFAULT_DAYS = 30
+MAX_DAYS = 366
+MAX_MONTHS = 24
+
+@instrumentation.handler
+def lambda_handler(event, context):
+    table = config_cache.get_table()
+    query = event.get("queryStringParameters") or {}
+    user_email = query.get("owner")
+
+    if not user_email:
+        return {"statusCode": 400, "body": "Missing 'owner' in request"}
+
+    try:
+        days = min(int(query.get("days", DEFAULT_DAYS)), MAX_DAYS)
+        months = min(int(query["months"]), MAX_MONTHS) if "months" in query else None
+    except ValueError:
+        return {"statusCode": 400, "body": "'days' and 'months' must be integers"}
+    if days < 1 or (months is not None and months < 1):
+        return {"statusCode": 400, "body": "'days' and 'months' must be positive"}
+
+    today = datetime.now(timezone.utc).date()
+    if months is None:
+        first = f"{today - timedelta(days=days - 1)}"
+        last = f"{today}"
+        sk = Key("SK").between(usage.day_key(first), usage.day_key(last))
+    else:
+        year, month = today.year, today.month - (months - 1)
+        while month < 1:
+            year, month = year - 1, month + 12
+        first = f"{year:04d}-{month:02d}"
+        last = f"{today:%Y-%m}"
+        sk = Key("SK").between(usage.month_key(first), usage.month_key(last))
+
+    try:
+        items = table.query(KeyConditionExpression=Key("PK").eq(usage.partition(user_email)) & sk).get("Items", [])
+    except ClientError as e:
+        return {"statusCode": 500, "body": f"Error fetching item: {e}"}
+
+    periods = [{
+        "period": item["SK"].split("#", 1)[1],
+        "credits": item.get("Credits", 0),
+        "ticks": item.get("Ticks", 0),
+        "instanceTypes": item.get("InstanceTypes", set()),
+        "firstBalance": item.get("FirstBalance"),
+        "lastBalance": item.get("LastBalance"),
+    } for item in items]
+
+    return api_response.json_response(event, api_response.encode({
+        "owner": user_email,
+        "granularity": "day" if months is None else "month",
+        "from": first,
+        "to": last,
+        "total": sum(p["credits"] for p in periods),
+        "periods": periods,
+    }))
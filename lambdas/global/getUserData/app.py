@@ -1,15 +1,13 @@
-import os
-import boto3
-import json
+import config_cache
+import instrumentation
+import api_response
 from botocore.exceptions import ClientError
-from decimal import Decimal
 
 #ENV: REGION, TABLE_NAME
 
-dynamodb = boto3.resource("dynamodb", region_name=os.environ['REGION'])
-table = dynamodb.Table(os.environ["TABLE_NAME"])
-
+@instrumentation.handler
 def lambda_handler(event, context):
+    table = config_cache.get_table()
     query = event.get("queryStringParameters") or {}
     user_email = query.get("owner")
 
@@ -25,14 +23,4 @@ def lambda_handler(event, context):
     if not item:
         return {"statusCode": 404, "body": "No server found for this user"}
 
-    def clean(obj):
-        if isinstance(obj, list):
-            return [clean(i) for i in obj]
-        if isinstance(obj, dict):
-            return {k: clean(v) for k, v in obj.items() if k not in ("PK", "SK")}
-        if isinstance(obj, Decimal):
-            return float(obj)
-        return obj
-
-    item = clean(item)
-    return {"statusCode": 200, "body": json.dumps(item)}
+    return api_response.json_response(event, api_response.encode(item))
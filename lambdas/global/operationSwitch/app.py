@@ -1,46 +1,176 @@
+import os
 import json
-import boto3
+import time
+import clients
+import config_cache
+import instrumentation
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
 
+# ENV: MAX_CONCURRENCY, TABLE_NAME, IDEMPOTENCY_TTL_HOURS
+
+MAX_CONCURRENCY = int(os.environ.get("MAX_CONCURRENCY", "10"))
+
+# IDEMPOTENCY#<key> items: IN_PROGRESS while dispatching, DONE after.
+# An IN_PROGRESS claim older than CLAIM_TIMEOUT_SECONDS (crashed invocation) can be retaken.
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_HOURS", "24")) * 3600
+CLAIM_TIMEOUT_SECONDS = 300
+
+FUNCTIONS = {
+    "CREATE": "createServer",
+    "DELETE": "deleteServer",
+    "TURNON": "turnOnServer",
+    "TURNOFF": "turnOffServer"
+}
+
+# Only the last of consecutive power operations matters: TURNON, TURNOFF, TURNON == TURNON
+POWER_OPERATIONS = {"TURNON", "TURNOFF"}
+
+@instrumentation.handler
 def lambda_handler(event, context):
     messages = event.get("Records", [event])
-    results = []
 
-    for record in messages:
-        body = record.get("body", record)
-        if isinstance(body, str):
+    # The queue is FIFO with one message group per owner, so an owner's messages
+    # arrive in order. Owners run in parallel, each owner's messages in sequence.
+    by_owner = {}
+    for index, record in enumerate(messages):
+        body = parse(record)
+        owner = (body or {}).get("payload", {}).get("owner")
+        by_owner.setdefault(owner, []).append((index, record, body))
+
+    outcomes = [None] * len(messages)
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENCY, len(by_owner)) or 1) as pool:
+        for owner_outcomes in pool.map(run_owner, by_owner.values()):
+            for index, outcome in owner_outcomes:
+                outcomes[index] = outcome
+
+    results = [result for result, _ in outcomes if result]
+
+    # Only failed messages go back to the queue (ReportBatchItemFailures)
+    failures = [
+        {"itemIdentifier": record["messageId"]}
+        for record, (_, failed) in zip(messages, outcomes)
+        if failed and "messageId" in record
+    ]
+
+    return {"results": results, "batchItemFailures": failures}
+
+
+def parse(record):
+    body = record.get("body", record)
+    if isinstance(body, str):
+        try:
             body = json.loads(body)
+        except json.JSONDecodeError:
+            print(f"Malformed message {record.get('messageId')}: {body}")
+            return None
+    return body
+
+
+def run_owner(entries):
+    """Dispatch one owner's messages in order. Returns [(index, (result, failed))]."""
+    outcomes = []
+    failed = False
+    for position, (index, record, body) in enumerate(entries):
+        if failed:
+            # A later message must not overtake a failed one of the same group
+            outcomes.append((index, (None, True)))
+            continue
 
+        following = entries[position + 1][2] if position + 1 < len(entries) else None
+        if body and following and body.get("operation") in POWER_OPERATIONS and following.get("operation") in POWER_OPERATIONS:
+            print(f"Coalesced {body['operation']} for {body['payload'].get('owner')} into a later {following['operation']}")
+            outcomes.append((index, ({"operation": body["operation"], "coalesced": True}, False)))
+            continue
+
+        outcome = dispatch(record, body)
+        failed = outcome[1]
+        outcomes.append((index, outcome))
+    return outcomes
+
+
+def dispatch(record, body):
+    """Route a single message. Returns (result, failed)."""
+    if body is None:
+        # Retrying won't help, drop it
+        return None, False
+
+    try:
         operation = body.get("operation")
         payload = body.get("payload", {})
         region = payload.get("region", "us-east-1")
 
         # Construct name dynamically
-        function_base = {
-            "CREATE": "createServer",
-            "DELETE": "deleteServer",
-            "TURNON": "turnOnServer",
-            "TURNOFF": "turnOffServer"
-        }.get(operation)
+        function_base = FUNCTIONS.get(operation)
 
         if not function_base:
+            # Retrying won't help, drop it
             print(f"Unknown operation: {operation}")
-            continue
+            return None, False
+
+        # Client-supplied key, or the SQS message id so redeliveries are caught
+        key = body.get("idempotencyKey") or record.get("messageId")
+        table = config_cache.get_table()
+        if key and not claim_key(table, key, operation, payload.get("owner")):
+            print(f"Duplicate {operation} ({key}), already dispatched")
+            return {"operation": operation, "idempotencyKey": key, "duplicate": True}, False
 
         function_name = f"{function_base}-{region}"
         print(f"Routing {operation} with body {payload} to {function_name} in {region}")
 
-        lambda_client = boto3.client("lambda", region_name=region)
-        response = lambda_client.invoke(
-            FunctionName=function_name,
-            InvocationType="Event",
-            Payload=json.dumps(payload)
-        )
+        try:
+            # One Lambda client per region, reused across warm invocations
+            response = clients.client("lambda", region).invoke(
+                FunctionName=function_name,
+                InvocationType="Event",
+                Payload=json.dumps(payload)
+            )
+        except Exception:
+            if key:
+                table.delete_item(Key=idempotency_key(key))
+            raise
+
+        if key:
+            table.update_item(
+                Key=idempotency_key(key),
+                UpdateExpression="SET #s = :done, Target = :target",
+                ExpressionAttributeNames={"#s": "status"},
+                ExpressionAttributeValues={":done": "DONE", ":target": function_name}
+            )
 
-        results.append({
+        return {
             "operation": operation,
             "region": region,
             "target": function_name,
             "status": response["StatusCode"]
-        })
+        }, False
+    except Exception as e:
+        print(f"Error routing message {record.get('messageId')}: {e}")
+        return None, True
+
 
-    return {"results": results}
+def idempotency_key(key):
+    return {"PK": f"IDEMPOTENCY#{key}", "SK": "IDEMPOTENCY"}
+
+
+def claim_key(table, key, operation, owner):
+    """Record the key as IN_PROGRESS. False if it was already dispatched (or is being dispatched)."""
+    now = int(time.time())
+    try:
+        table.put_item(
+            Item=idempotency_key(key) | {
+                "status": "IN_PROGRESS",
+                "Operation": operation,
+                "Owner": owner,
+                "StartedAt": now,
+                "ttl": now + IDEMPOTENCY_TTL_SECONDS
+            },
+            ConditionExpression="attribute_not_exists(PK) OR (#s = :in_progress AND StartedAt < :stale)",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues={":in_progress": "IN_PROGRESS", ":stale": now - CLAIM_TIMEOUT_SECONDS}
+        )
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+        raise
@@ -1,17 +1,26 @@
-import boto3
 import json
 import os
+import time
+import hashlib
+import uuid
+from collections import OrderedDict
+import clients
+import config_cache
+import http_utils
+import instrumentation
 from botocore.exceptions import ClientError
 
-#ENV: QUEUE_URL
+#ENV: QUEUE_URL, REGION, TABLE_NAME, REGION_CACHE_SIZE, REGION_CACHE_TTL_SECONDS
 
-sqs = boto3.client('sqs')
-#ENV: REGION, TABLE_NAME
+# owner -> (region, expires_at), least recently used first. A server's region only
+# changes through DELETE + CREATE; this container drops the entry on either, other
+# warm containers within REGION_CACHE_TTL_SECONDS.
+REGION_CACHE_SIZE = int(os.environ.get("REGION_CACHE_SIZE", "1024"))
+REGION_CACHE_TTL = int(os.environ.get("REGION_CACHE_TTL_SECONDS", "60"))
+_regions = OrderedDict()
 
-dynamodb = boto3.resource("dynamodb", region_name=os.environ['REGION'])
-table = dynamodb.Table(os.environ["TABLE_NAME"])
-        
-def lambda_handler(event, context):    
+@instrumentation.handler
+def lambda_handler(event, context):
     body_raw = event.get("body", "{}")
     
     try:
@@ -54,9 +63,11 @@ def lambda_handler(event, context):
             }
         case 'DELETE' | 'TURNON' | 'TURNOFF':
             try:
-                region = table.get_item(Key={"PK": f"USERS#{body.get('owner')}", "SK": "CONFIGPROFILE"}).get('Item').get('Region')
+                region = get_region(body['owner'])
             except ClientError as e:
                 return {"statusCode": 500, "body": f"Error fetching item: {e}"}
+            if not region:
+                return {'statusCode': 404, 'body': json.dumps('No server found for this owner')}
             message_body = {
                 'operation': operation,
                 'payload': {
@@ -70,15 +81,29 @@ def lambda_handler(event, context):
                 'body': json.dumps(f"Unsupported operation: {operation}")
             }
 
+    # Only a client-supplied key makes two requests the same operation. Without one,
+    # every request is its own: identical bodies are legitimate repeats
+    # (TURNON, TURNOFF, TURNON), so the key is the API Gateway request id.
+    idempotency_key = http_utils.get_header(event, 'Idempotency-Key') or body.get('idempotencyKey')
+    if not idempotency_key:
+        request_id = (event.get('requestContext') or {}).get('requestId') or uuid.uuid4().hex
+        idempotency_key = f"req-{request_id}"
+    message_body['idempotencyKey'] = idempotency_key
+
     try:
-        sqs.send_message(
+        # FIFO queue: one message group per owner keeps each owner's operations in order
+        clients.client('sqs').send_message(
             QueueUrl=os.environ['QUEUE_URL'],
             MessageBody=json.dumps(message_body),
+            MessageGroupId=body['owner'],
+            MessageDeduplicationId=hashlib.sha256(idempotency_key.encode()).hexdigest(),
             MessageAttributes={
                 'Operation': {'DataType': 'String', 'StringValue': operation},
                 'Owner': {'DataType': 'String', 'StringValue': body['owner']}
             }
         )
+        if operation in ('CREATE', 'DELETE'):
+            _regions.pop(body['owner'], None)
         return {
             'statusCode': 200,
             'body': json.dumps('Message sent successfully!')
@@ -89,3 +114,27 @@ def lambda_handler(event, context):
             'statusCode': 500,
             'body': json.dumps(f'Error sending message: {str(e)}')
         }
+
+
+def get_region(owner):
+    """Region of the owner's server, or None if they have none."""
+    cached = _regions.get(owner)
+    if cached and cached[1] > time.monotonic():
+        _regions.move_to_end(owner)
+        return cached[0]
+
+    item = config_cache.get_table().get_item(
+        Key={"PK": f"USERS#{owner}", "SK": "CONFIGPROFILE"},
+        ProjectionExpression="#r",
+        ExpressionAttributeNames={"#r": "Region"}
+    ).get('Item') or {}
+    region = item.get('Region')
+    if not region:
+        _regions.pop(owner, None)
+        return None
+
+    _regions[owner] = (region, time.monotonic() + REGION_CACHE_TTL)
+    _regions.move_to_end(owner)
+    while len(_regions) > REGION_CACHE_SIZE:
+        _regions.popitem(last=False)
+    return region
@@ -1,50 +1,49 @@
-import os
-import boto3
-import json
+import hashlib
+import config_cache
+import http_utils
+import instrumentation
+import api_response
+from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
-from decimal import Decimal
 
 #ENV: REGION, TABLE_NAME
 
-dynamodb = boto3.resource("dynamodb", region_name=os.environ['REGION'])
-table = dynamodb.Table(os.environ["TABLE_NAME"])
-
+@instrumentation.handler
 def lambda_handler(event, context):
+    table = config_cache.get_table()
     query = event.get("queryStringParameters") or {}
     user_email = query.get("owner")
 
     if not user_email:
         return {"statusCode": 400, "body": "Missing 'owner' in request"}
 
+    # One Query returns CONFIGPROFILE and SERVER (and PROFILE) for the owner
     try:
-        config = table.get_item(Key={"PK": f"USERS#{user_email}", "SK": "CONFIGPROFILE"})
-        server = table.get_item(Key={"PK": f"USERS#{user_email}", "SK": "SERVER"})
-        config_item = config.get("Item")
-        server_item = server.get("Item")
+        items = table.query(KeyConditionExpression=Key("PK").eq(f"USERS#{user_email}")).get("Items", [])
     except ClientError as e:
         return {"statusCode": 500, "body": f"Error fetching item: {e}"}
 
+    by_sk = {item["SK"]: item for item in items}
+    config_item = by_sk.get("CONFIGPROFILE")
+    server_item = by_sk.get("SERVER")
+
     if not config_item or not server_item:
         return {"statusCode": 404, "body": "No server found for this user"}
 
     try:
-        resources = table.get_item(Key={"PK": "GLOBAL", "SK": "RESOURCES"}).get("Item")
+        resources = config_cache.get_resources()
     except ClientError as e:
         return {"statusCode": 500, "body": f"Error fetching item: {e}"}
 
-    config_item['Type'] = getResourceName(resources.get('types'), config_item['Type'])
-    config_item['Region'] = getResourceName(resources.get('regions'), config_item['Region'])
-
-    server_status = config_item | server_item
-    server_status.pop('PK')
-    server_status.pop('SK')
-
-    return {"statusCode": 200, "body": json.dumps(server_status, default=str)}
+    if resources:
+        config_item['Type'] = resources.type_name(config_item['Type'])
+        config_item['Region'] = resources.region_name(config_item['Region'])
 
+    body = api_response.encode(config_item | server_item, sort_keys=True)
+    etag = '"' + hashlib.sha256(body.encode()).hexdigest()[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
 
-def getResourceName(resources, id):
-    for t in resources:
-        if t.get("id") == id:
-            return t.get("name")
+    if http_utils.etag_matches(event, etag):
+        return {"statusCode": 304, "headers": headers, "body": ""}
 
-    return id
+    return api_response.json_response(event, body, headers=headers)
@@ -1,12 +1,13 @@
-import os
-import boto3
+import config_cache
+import instrumentation
 
-dynamodb = boto3.resource("dynamodb", region_name=os.environ['REGION'])
-table = dynamodb.Table(os.environ["TABLE_NAME"])
+#ENV: REGION, TABLE_NAME
 
+@instrumentation.handler
 def lambda_handler(event, context):
     print(f"Received {event}")
     if event['triggerSource'] == 'PostConfirmation_ConfirmSignUp':
+        table = config_cache.get_table()
         user_email = event['request']['userAttributes'].get('email')
         user_name = event['request']['userAttributes'].get('name')
 
@@ -0,0 +1,96 @@
+import os
+import json
+import clients
+import config_cache
+import connections
+import instrumentation
+import api_response
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+
+#ENV: REGION, TABLE_NAME, WEBSOCKET_ENDPOINT, MAX_WORKERS
+# DynamoDB stream consumer (filtered to SK=SERVER) that pushes server status
+# changes to the owner's open WebSocket connections:
+#   {"type": "serverStatus", "owner", "status", "previousStatus", "server": {...SERVER item}}
+# A deleted SERVER item is pushed as status DELETED. Only the last change per owner
+# in a batch is sent. Clients still poll serverStatus as a fallback, just less often.
+
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "16"))
+
+# A change to any of these is worth a push; other writes (e.g. backfills) are not
+WATCHED = ("status", "PublicIp", "InstanceId")
+
+_deserializer = TypeDeserializer()
+
+
+@instrumentation.handler
+def lambda_handler(event, context):
+    latest = {}
+    for record in event.get("Records", []):
+        change = to_change(record)
+        if change:
+            # Records of one item arrive in order; keep the newest per owner
+            latest[change["owner"]] = change
+
+    if not latest:
+        return {"batchItemFailures": []}
+
+    table = config_cache.get_table()
+    api = clients.client("apigatewaymanagementapi", endpoint_url=os.environ["WEBSOCKET_ENDPOINT"])
+
+    with instrumentation.step("connections"), ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        owners = list(latest)
+        found = dict(zip(owners, pool.map(lambda owner: owner_connections(table, owner), owners)))
+
+    messages = {owner: api_response.encode(latest[owner]).encode() for owner, ids in found.items() if ids}
+    sends = [(owner, connection_id, messages[owner]) for owner, ids in found.items() for connection_id in ids]
+
+    with instrumentation.step("fan_out"), ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        delivered = list(pool.map(lambda s: connections.post(api, s[1], s[2]), sends))
+
+    gone = [(owner, connection_id) for (owner, connection_id, _), ok in zip(sends, delivered) if not ok]
+    for owner, connection_id in gone:
+        try:
+            connections.unregister(table, connection_id, owner)
+        except ClientError as e:
+            print(f"Error removing stale connection {connection_id}: {e}")
+
+    summary = {"changes": len(latest), "pushed": len(sends) - len(gone), "gone": len(gone)}
+    print(f"Status push: {json.dumps(summary)}")
+    # Pushes are best effort: nothing here is worth retrying the batch for
+    return {"batchItemFailures": []}
+
+
+def owner_connections(table, owner):
+    """connections.for_owner, but a failed lookup only skips this owner's push."""
+    try:
+        return connections.for_owner(table, owner)
+    except ClientError as e:
+        print(f"Error looking up connections of {owner}: {e}")
+        return []
+
+
+def to_change(record):
+    """The push message for a stream record, or None if there is nothing to tell."""
+    data = record.get("dynamodb", {})
+    keys = image(data.get("Keys"))
+    if keys.get("SK") != "SERVER" or not str(keys.get("PK", "")).startswith("USERS#"):
+        return None
+
+    old = image(data.get("OldImage"))
+    new = image(data.get("NewImage"))
+    if record.get("eventName") != "REMOVE" and all(old.get(k) == new.get(k) for k in WATCHED):
+        return None
+
+    return {
+        "type": "serverStatus",
+        "owner": keys["PK"].split("#", 1)[1],
+        "status": "DELETED" if record.get("eventName") == "REMOVE" else new.get("status"),
+        "previousStatus": old.get("status"),
+        "server": api_response.strip_keys(new),
+    }
+
+
+def image(attributes):
+    return {k: _deserializer.deserialize(v) for k, v in (attributes or {}).items()}
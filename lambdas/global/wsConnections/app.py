@@ -0,0 +1,55 @@
+import json
+import clients
+import config_cache
+import connections
+import instrumentation
+from botocore.exceptions import ClientError
+
+#ENV: REGION, TABLE_NAME, CONNECTION_TTL_SECONDS
+
+# Routes of the status WebSocket API:
+#   $connect     wss://...?token=<Cognito access token>  registers the connection for the token's user
+#   $disconnect  unregisters it
+#   $default     {"action": "ping"} keeps an idle connection open
+# statusStream pushes SERVER changes to the registered connections.
+
+@instrumentation.handler
+def lambda_handler(event, context):
+    request = event.get("requestContext", {})
+    route = request.get("routeKey")
+    connection_id = request.get("connectionId")
+    table = config_cache.get_table()
+
+    match route:
+        case "$connect":
+            token = (event.get("queryStringParameters") or {}).get("token")
+            owner = owner_for_token(token) if token else None
+            if not owner:
+                return {"statusCode": 401, "body": "Unauthorized"}
+            try:
+                connections.register(table, owner, connection_id)
+            except ClientError as e:
+                print(f"Error registering {connection_id}: {e}")
+                return {"statusCode": 500, "body": "Error registering connection"}
+            return {"statusCode": 200, "body": "Connected"}
+
+        case "$disconnect":
+            try:
+                connections.unregister(table, connection_id)
+            except ClientError as e:
+                print(f"Error unregistering {connection_id}: {e}")
+            return {"statusCode": 200, "body": "Disconnected"}
+
+        case _:
+            return {"statusCode": 200, "body": json.dumps({"action": "pong"})}
+
+
+def owner_for_token(token):
+    """Email of the Cognito user the access token belongs to, or None if it is not valid."""
+    try:
+        user = clients.client("cognito-idp").get_user(AccessToken=token)
+    except ClientError as e:
+        print(f"Rejected WebSocket token: {e.response['Error']['Code']}")
+        return None
+    attributes = {a["Name"]: a["Value"] for a in user.get("UserAttributes", [])}
+    return attributes.get("email")
@@ -1,11 +1,35 @@
 import os
-import boto3
 import json
 import uuid
+import time
+import base64
+import shutil
+import hashlib
+import clients
+import config_cache
+import instrumentation
+import status_index
+import desired_state
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 
-# ENV: GLOBAL_REGION, REGION, EFS_PATH 
+# ENV: GLOBAL_REGION, REGION, EFS_PATH, JAR_CACHE_DIR (optional)
 
+# server.jar cache on EFS:
+#   <cache>/blobs/<sha256>.jar      content-addressed jars, hard linked into server folders
+#   <cache>/versions/<version>.json  {"sha256", "etag"} of the jar currently published for a version
+#   <cache>/locks/<version>.lock     held by the one create that fills a missing version
+LOCK_WAIT_SECONDS = 40
+LOCK_STALE_SECONDS = 120
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=10,
+    use_threads=True
+)
+
+@instrumentation.handler
 def lambda_handler(event, context):
     user_email = event["owner"]
     server_type = event["type"]
@@ -16,18 +40,11 @@ def lambda_handler(event, context):
     server_uuid = str(uuid.uuid4())
 
     # Clients
-    ssm = boto3.client('ssm', region_name=os.environ["GLOBAL_REGION"])
-    dynamodb = boto3.resource("dynamodb", region_name=os.environ["GLOBAL_REGION"])
-    s3 = boto3.client("s3", region_name=os.environ["GLOBAL_REGION"])
-
-    # Fetch table and bucket names from SSM
-    table_name = ssm.get_parameter(Name="/global/dynamo/table-name")['Parameter']['Value']
-    bucket_name = ssm.get_parameter(Name="/global/s3/minecraft-versions/id")['Parameter']['Value']
-    table = dynamodb.Table(table_name)
+    s3 = clients.client("s3", os.environ["GLOBAL_REGION"])
 
-    existing = table.get_item(Key={"PK": f"USERS#{user_email}", "SK": "SERVER"}).get("Item")
-    if existing:
-        return { "statusCode": 409, "body": json.dumps({"error": "Server already exists for this user"})}
+    # Table and bucket names (cached from SSM)
+    table = config_cache.get_table()
+    bucket_name = config_cache.get_parameter("/global/s3/minecraft-versions/id")
 
     # Create Config Profile in DynamoDB
     config_item = {
@@ -43,12 +60,19 @@ def lambda_handler(event, context):
     server_item = {
         "PK": f"USERS#{user_email}",
         "SK": "SERVER",
-        "status": "CREATING"
+        **status_index.item("CREATING")
     }
 
+    # Claim the owner's single server slot; a duplicate CREATE finds it taken
+    try:
+        table.put_item(Item=server_item, ConditionExpression="attribute_not_exists(PK)")
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return { "statusCode": 409, "body": json.dumps({"error": "Server already exists for this user"})}
+        raise
+
     try:
         table.put_item(Item=config_item)
-        table.put_item(Item=server_item)
         print(f"Created DynamoDB config profile: {server_uuid}")
     except ClientError as e:
         print(f"Error writing to DynamoDB: {e}")
@@ -72,26 +96,141 @@ def lambda_handler(event, context):
     except Exception as e:
         print("Failed to create eula.txt: {e}")
 
-    # Download server.jar from S3
+    # Link server.jar from the EFS cache, filling it from S3 on first use
     s3_key = f"{version}/server.jar"
     dest_path = f"{server_path}/server.jar"
+    cache_dir = os.environ.get("JAR_CACHE_DIR", f"{efs_path}/.jar-cache")
 
     try:
-        s3.download_file(bucket_name, s3_key, dest_path)
-        print(f"Downloaded {s3_key} -> {dest_path}")
-    except ClientError as e:
-        print("Failed to download server.jar: {e}")
+        with instrumentation.step("jar_cache"):
+            blob = get_cached_jar(s3, bucket_name, s3_key, version, cache_dir)
+            link_jar(blob, dest_path)
+        print(f"Linked {blob} -> {dest_path}")
+    except (ClientError, OSError, TimeoutError) as e:
+        print(f"Jar cache unavailable ({e}), downloading directly")
+        try:
+            s3.download_file(bucket_name, s3_key, dest_path, Config=TRANSFER_CONFIG)
+            print(f"Downloaded {s3_key} -> {dest_path}")
+        except ClientError as e:
+            print(f"Failed to download server.jar: {e}")
 
     server_item = {
         "PK": f"USERS#{user_email}",
         "SK": "SERVER",
-        "status": "OFFLINE"
+        **status_index.item("OFFLINE")
     }
     try:
         table.put_item(Item=config_item)
-        table.put_item(Item=server_item)
+        # A TURNON/DELETE that arrived while CREATING runs now
+        previous = table.put_item(Item=server_item, ReturnValues="ALL_OLD").get("Attributes", {})
         print(f"Created DynamoDB config profile: {server_uuid}")
+        desired_state.honour(previous, user_email, "OFFLINE")
     except ClientError as e:
         print(f"Error writing to DynamoDB: {e}")
 
-    print(f"serverUUID {server_uuid}, Server profile created and jar prepared at {server_path}")
\ No newline at end of file
+    print(f"serverUUID {server_uuid}, Server profile created and jar prepared at {server_path}")
+
+
+def get_cached_jar(s3, bucket, key, version, cache_dir):
+    """Return the cached blob path for the jar currently published at bucket/key."""
+    for sub_dir in ("blobs", "versions", "locks"):
+        os.makedirs(f"{cache_dir}/{sub_dir}", exist_ok=True)
+
+    # One HEAD per create so a re-published jar is picked up
+    head = s3.head_object(Bucket=bucket, Key=key, ChecksumMode="ENABLED")
+    etag = head["ETag"]
+
+    pointer_path = f"{cache_dir}/versions/{version}.json"
+    lock_path = f"{cache_dir}/locks/{version}.lock"
+    deadline = time.monotonic() + LOCK_WAIT_SECONDS
+
+    while True:
+        blob = read_pointer(pointer_path, etag, cache_dir)
+        if blob:
+            return blob
+
+        if acquire_lock(lock_path):
+            try:
+                # Another create may have filled it while we were acquiring
+                return read_pointer(pointer_path, etag, cache_dir) or fill_cache(s3, bucket, key, head, pointer_path, cache_dir)
+            finally:
+                os.remove(lock_path)
+
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Timed out waiting for {lock_path}")
+        time.sleep(0.5)
+
+
+def read_pointer(pointer_path, etag, cache_dir):
+    try:
+        with open(pointer_path) as f:
+            pointer = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    blob = f"{cache_dir}/blobs/{pointer['sha256']}.jar"
+    if pointer.get("etag") != etag or not os.path.exists(blob):
+        return None
+    return blob
+
+
+def acquire_lock(lock_path):
+    """O_CREAT|O_EXCL is atomic on EFS (NFSv4.1). Locks left by crashed invocations expire."""
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        os.close(fd)
+        return True
+    except FileExistsError:
+        try:
+            if time.time() - os.path.getmtime(lock_path) > LOCK_STALE_SECONDS:
+                os.remove(lock_path)
+        except OSError:
+            pass
+        return False
+
+
+def fill_cache(s3, bucket, key, head, pointer_path, cache_dir):
+    """Download once, verify the checksum and publish blob + pointer atomically."""
+    tmp_path = f"{cache_dir}/blobs/.{uuid.uuid4()}.tmp"
+    s3.download_file(bucket, key, tmp_path, Config=TRANSFER_CONFIG)
+
+    try:
+        digest = hashlib.sha256()
+        with open(tmp_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+
+        size = os.path.getsize(tmp_path)
+        if size != head["ContentLength"]:
+            raise OSError(f"Size mismatch for {key}: {size} != {head['ContentLength']}")
+
+        # Full-object SHA256 is only present when the object was uploaded with one
+        expected = head.get("ChecksumSHA256")
+        if expected and "-" not in expected and base64.b64encode(digest.digest()).decode() != expected:
+            raise OSError(f"Checksum mismatch for {key}")
+
+        sha256 = digest.hexdigest()
+        blob = f"{cache_dir}/blobs/{sha256}.jar"
+        os.replace(tmp_path, blob)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    tmp_pointer = f"{pointer_path}.{uuid.uuid4()}.tmp"
+    with open(tmp_pointer, "w") as f:
+        json.dump({"sha256": sha256, "etag": head["ETag"]}, f)
+    os.replace(tmp_pointer, pointer_path)
+
+    print(f"Cached {key} as {blob}")
+    return blob
+
+
+def link_jar(blob, dest_path):
+    """Hard link the shared jar into the server folder (the server never writes to it)."""
+    if os.path.exists(dest_path):
+        os.remove(dest_path)
+    try:
+        os.link(blob, dest_path)
+    except OSError:
+        # Filesystem without hard links: fall back to a copy
+        shutil.copyfile(blob, dest_path)
@@ -1,53 +1,41 @@
-import boto3
 import json
 import os
+import clients
+import config_cache
+import credits
+import instrumentation
+import usage
 from botocore.exceptions import ClientError
 
 # ENV: GLOBAL_REGION, TURN_OFF_LAMBDA_NAME
 
-dynamodb = boto3.resource("dynamodb", region_name=os.environ["GLOBAL_REGION"])
-lambda_client = boto3.client("lambda", region_name=os.environ["GLOBAL_REGION"])
-ssm = boto3.client("ssm", region_name=os.environ["GLOBAL_REGION"])
-# Dynamo
-table_name = ssm.get_parameter(Name="/global/dynamo/table-name")["Parameter"]["Value"]
-table = dynamodb.Table(table_name)
-
+@instrumentation.handler
 def lambda_handler(event, context):
+    table = config_cache.get_table()
     owner = event["owner"]
     instance_type = event["instanceType"]
 
-    # Fetch user profile
-    try:
-        response = table.get_item(Key={"PK": f"USERS#{owner}", "SK": "PROFILE"})
-        profile = response.get("Item")
-        if not profile:
-            raise ValueError(f"Profile not found for {owner}")
-    except ClientError as e:
-        print(f"DynamoDB get_item error: {e}")
-        return {"statusCode": 500, "body": "Error reading profile"}
-
-    name = profile.get("Name", "")
-    credits = profile.get("Credits", 0)
-
-    # Deduct credits
     deduction = calculate_deduction(instance_type)
-    new_credits = max(0, credits - deduction)
 
-    # Update record
+    # Single conditional UpdateItem, floors at zero and reports depletion
     try:
-        table.update_item(
-            Key={"PK": f"USERS#{owner}", "SK": "PROFILE"},
-            UpdateExpression="SET Credits = :new",
-            ExpressionAttributeValues={":new": new_credits},
-        )
+        result = credits.deduct_credits(table, owner, deduction)
     except ClientError as e:
         print(f"DynamoDB update error: {e}")
         return {"statusCode": 500, "body": "Error updating credits"}
+    except credits.CreditsContention as e:
+        print(e)
+        return {"statusCode": 503, "body": "Credits busy, retry the deduction"}
+
+    if result is None:
+        return {"statusCode": 404, "body": f"Profile not found for {owner}"}
+
+    usage.record(table, owner, result, instance_type, "creditDeduction")
 
     # If credits exhausted, trigger server shutdown
-    if new_credits == 0:
+    if result["depleted"]:
         try:
-            lambda_client.invoke(
+            clients.client("lambda", os.environ["GLOBAL_REGION"]).invoke(
                 FunctionName=os.environ["TURN_OFF_LAMBDA_NAME"],
                 InvocationType="Event",
                 Payload=json.dumps({"owner": owner}),
@@ -59,24 +47,22 @@ def lambda_handler(event, context):
         "statusCode": 200,
         "body": {
             "owner": owner,
-            "name": name,
-            "oldCredits": credits,
-            "deducted": deduction,
-            "newCredits": new_credits,
+            "name": result["name"],
+            "oldCredits": result["oldCredits"],
+            "deducted": result["deducted"],
+            "newCredits": result["newCredits"],
         },
     }
 
 
 def calculate_deduction(instance_type: str) -> int:
     """Return credits to deduct per 10-minute interval."""
-    response = table.get_item(Key={"PK": "GLOBAL", "SK": "RESOURCES"})
-    item = response.get("Item")
+    resources = config_cache.get_resources()
 
-    if not item or "types" not in item:
+    if not resources or not resources.types:
         return None
 
-    for t in item["types"]:
-        if t.get("id") == instance_type:
-            return t.get("creditCost")
+    if instance_type in resources.types:
+        return resources.types[instance_type].get("creditCost")
 
     return 1
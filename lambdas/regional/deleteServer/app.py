@@ -1,47 +1,204 @@
-import boto3
 import os
+import json
+import time
+import clients
+import config_cache
+import instrumentation
+import status_index
+import desired_state
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
 from botocore.exceptions import ClientError
-import shutil
 
-# ENV: GLOBAL_REGION, EFS_PATH
+# ENV: REGION, GLOBAL_REGION, EFS_PATH, DELETE_WORKERS, MAX_DELETE_PASSES, DELETE_STALE_MINUTES
 
+# Every unlink on EFS is a network round trip, so files are removed from a
+# thread pool, one task per directory. When the invocation runs low on time
+# the handler re-invokes itself to continue; the filesystem itself is the
+# checkpoint (whatever is gone stays gone), the event only carries counters.
+DELETE_WORKERS = int(os.environ.get("DELETE_WORKERS", "32"))
+MAX_DELETE_PASSES = int(os.environ.get("MAX_DELETE_PASSES", "20"))
+# A DELETING server whose last pass (ProgressAt) is older than this lost its
+# chain of passes (crash, dropped async invoke) and a new DELETE may take it over,
+# as may one written before ProgressAt existed.
+# Giving up after MAX_DELETE_PASSES leaves DELETE_FAILED, which is retaken at once.
+DELETE_STALE_MINUTES = int(os.environ.get("DELETE_STALE_MINUTES", "30"))
+SAFETY_MARGIN_MS = 10000
+
+@instrumentation.handler
 def lambda_handler(event, context):
     user_email = event.get("owner")
-
-    # Clients
-    ssm = boto3.client('ssm', region_name=os.environ["GLOBAL_REGION"])
-    dynamodb = boto3.resource("dynamodb", region_name=os.environ["GLOBAL_REGION"])
+    progress = event.get("progress") or {"passes": 0, "files": 0, "bytes": 0, "seconds": 0}
 
     # Table
-    table_name = ssm.get_parameter(Name="/global/dynamo/table-name")['Parameter']['Value']
-    table = dynamodb.Table(table_name)
+    table = config_cache.get_table()
+    server_key = {"PK": f"USERS#{user_email}", "SK": "SERVER"}
 
-    server_item = {
-        "PK": f"USERS#{user_email}",
-        "SK": "SERVER",
-        "status": "DELETING"
-    }
+    server_uuid = event.get("serverUUID")
+    if not server_uuid:
+        # First pass
+        deleting = status_index.item("DELETING")
+        stale = datetime.now(timezone.utc) - timedelta(minutes=DELETE_STALE_MINUTES)
+        for _ in range(2):
+            try:
+                server = table.put_item(
+                    Item=server_key | deleting | {"ProgressAt": deleting["StatusSince"]},
+                    ConditionExpression="attribute_not_exists(PK) OR #s IN (:offline, :running, :pending, :failed)"
+                                        " OR (#s = :deleting AND ProgressAt < :stale)"
+                                        " OR (#s = :deleting AND attribute_not_exists(ProgressAt))",
+                    ExpressionAttributeNames={"#s": "status"},
+                    ExpressionAttributeValues={
+                        ":offline": "OFFLINE",
+                        ":running": "RUNNING",
+                        ":pending": "PENDING",
+                        ":failed": "DELETE_FAILED",
+                        ":deleting": "DELETING",
+                        ":stale": stale.isoformat()
+                    },
+                    ReturnValues="ALL_OLD"
+                ).get("Attributes", {})
+                break
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+            # Mid create/start/stop: delete once that is over. If it just ended,
+            # the second round deletes right away.
+            if desired_state.record(table, user_email, "DELETED"):
+                return {"statusCode": 202, "body": "Delete queued behind the current transition"}
+        else:
+            # Already deleting
+            server = table.get_item(Key=server_key).get("Item") or {}
+            print(f"Server for {user_email} is {server.get('status')}, not deleting")
+            return {"statusCode": 409, "body": f"Server is {server.get('status')}"}
 
-    try:
-        table.put_item(Item=server_item)
-    except ClientError as e:
-        print(f"Error writing to DynamoDB: {e}")
+        # A running or stopped (SHUTDOWN_MODE=stop) instance would outlive its world
+        if server.get("InstanceId"):
+            try:
+                clients.client("ec2").terminate_instances(InstanceIds=[server["InstanceId"]])
+                print(f"Terminating instance {server['InstanceId']}")
+            except ClientError as e:
+                print(f"Error terminating instance {server['InstanceId']}: {e}")
 
-
-    #Get CONFIGPROFILE
-    response = table.get_item(Key={"PK": f"USERS#{user_email}", "SK": f"CONFIGPROFILE"})
-    configprofile = response.get("Item")
-    server_uuid = configprofile.get('ServerUUID')
-    table.delete_item(Key={"PK": f"USERS#{user_email}", "SK": f"CONFIGPROFILE"})
-    table.delete_item(Key={"PK": f"USERS#{user_email}", "SK": f"SERVER"})
+        #Get CONFIGPROFILE
+        response = table.get_item(Key={"PK": f"USERS#{user_email}", "SK": f"CONFIGPROFILE"})
+        configprofile = response.get("Item")
+        if not configprofile:
+            table.delete_item(Key=server_key)
+            return {"statusCode": 404, "body": "No server found for this user"}
+        server_uuid = configprofile.get('ServerUUID')
 
     # EFS path
     efs_path = os.environ.get("EFS_PATH", "/mnt/efs")
     server_path = f"{efs_path}/{server_uuid}"
 
-    try:
-        #SUDO DELETE server_path
-        if os.path.exists(server_path):
-            shutil.rmtree(server_path, ignore_errors=True)
-    except ClientError as e:
-        print(f"Failed to delete EFS folder: {e}")
\ No newline at end of file
+    started = time.monotonic()
+    stats = {"files": 0, "bytes": 0}
+    done = True
+    if os.path.exists(server_path):
+        with instrumentation.step("delete_tree"):
+            done = delete_tree(server_path, context, stats)
+
+    elapsed = time.monotonic() - started
+    progress = {
+        "passes": progress["passes"] + 1,
+        "files": progress["files"] + stats["files"],
+        "bytes": progress["bytes"] + stats["bytes"],
+        "seconds": round(progress["seconds"] + elapsed, 3)
+    }
+    print(json.dumps({
+        "deleteServer": server_uuid,
+        "pass": progress["passes"],
+        "files": stats["files"],
+        "bytesFreed": stats["bytes"],
+        "filesPerSecond": round(stats["files"] / elapsed, 1) if elapsed else None,
+        "done": done
+    }))
+
+    if not done:
+        if progress["passes"] >= MAX_DELETE_PASSES:
+            print(f"Gave up deleting {server_path} after {progress['passes']} passes, marking DELETE_FAILED")
+            set_status, status_values = status_index.update("DELETE_FAILED")
+            table.update_item(
+                Key=server_key,
+                UpdateExpression=f"SET {set_status}, DeletedFiles = :f, BytesFreed = :b",
+                ExpressionAttributeNames={"#s": "status"},
+                ExpressionAttributeValues={":f": progress["files"], ":b": progress["bytes"], **status_values}
+            )
+            return {"statusCode": 500, "body": progress}
+
+        table.update_item(
+            Key=server_key,
+            UpdateExpression="SET DeletedFiles = :f, BytesFreed = :b, ProgressAt = :at",
+            ExpressionAttributeValues={
+                ":f": progress["files"],
+                ":b": progress["bytes"],
+                ":at": datetime.now(timezone.utc).isoformat()
+            }
+        )
+        clients.client("lambda").invoke(
+            FunctionName=context.function_name,
+            InvocationType="Event",
+            Payload=json.dumps({"owner": user_email, "serverUUID": server_uuid, "progress": progress})
+        )
+        return {"statusCode": 202, "body": progress}
+
+    # Tree is gone: now the server can disappear
+    table.delete_item(Key={"PK": f"USERS#{user_email}", "SK": f"CONFIGPROFILE"})
+    table.delete_item(Key=server_key)
+    return {"statusCode": 200, "body": progress}
+
+
+def delete_tree(root, context, stats):
+    """
+    Delete `root` in parallel. Returns False if time ran out before it was gone.
+    Counts files unlinked and bytes actually freed (hard-linked files free nothing).
+    """
+    def out_of_time():
+        return context is not None and context.get_remaining_time_in_millis() < SAFETY_MARGIN_MS
+
+    dirs = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        # os.walk lists symlinks to directories as directories but never enters
+        # them; they are unlinked like files, or their parent could not be removed
+        links = [d for d in dir_names if os.path.islink(os.path.join(dir_path, d))]
+        dirs.append((dir_path, file_names + links))
+        if out_of_time():
+            return False
+
+    def delete_files(entry):
+        dir_path, file_names = entry
+        files = freed = 0
+        for name in file_names:
+            if out_of_time():
+                break
+            path = os.path.join(dir_path, name)
+            try:
+                st = os.lstat(path)
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                print(f"Failed to delete {path}: {e}")
+                continue
+            files += 1
+            if st.st_nlink == 1:
+                freed += st.st_size
+        return files, freed
+
+    with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as pool:
+        for files, freed in pool.map(delete_files, dirs):
+            stats["files"] += files
+            stats["bytes"] += freed
+
+    # Directories bottom-up, deepest first
+    for dir_path, _ in reversed(dirs):
+        if out_of_time():
+            return False
+        try:
+            os.rmdir(dir_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Failed to delete {dir_path}: {e}")
+
+    return not os.path.exists(root)
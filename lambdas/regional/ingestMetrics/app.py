@@ -0,0 +1,86 @@
+import os
+import time
+from decimal import Decimal
+import config_cache
+import instrumentation
+
+# ENV: GLOBAL_REGION, METRICS_RETENTION_DAYS
+# Invoked once a minute by the mc_agent on each server instance with a batch of samples:
+#   {"owner", "serverUUID", "instanceType", "samples": [{"ts", "tps", "mspt", "players", "cpu", ...}]}
+#
+# Items under PK=METRICS#<owner>:
+#   SK=LATEST               last sample, for "is it lagging right now"
+#   SK=HOUR#<yyyy-mm-ddThh>  one attribute per minute (m00..m59) plus per-metric sums/counts
+# Both expire through the table's `ttl` attribute.
+
+RETENTION_DAYS = int(os.environ.get("METRICS_RETENTION_DAYS", "7"))
+LATEST_TTL_SECONDS = 24 * 3600
+
+# Lower is worse for these, so the minute keeps the minimum instead of the maximum
+LOW_IS_BAD = {"tps"}
+
+@instrumentation.handler
+def lambda_handler(event, context):
+    owner = event["owner"]
+    samples = [s for s in event.get("samples", []) if "ts" in s]
+    if not samples:
+        return {"statusCode": 400, "body": "No samples"}
+
+    table = config_cache.get_table()
+    samples.sort(key=lambda s: s["ts"])
+    last = samples[-1]
+    bucket = time.gmtime(last["ts"])
+    hour_key = time.strftime("HOUR#%Y-%m-%dT%H", bucket)
+    now = int(time.time())
+
+    metrics = sorted({k for s in samples for k in s if k != "ts" and isinstance(s[k], (int, float))})
+    minute = {}
+    names = {"#ttl": "ttl", "#minute": f"m{bucket.tm_min:02d}"}
+    values = {
+        ":uuid": event.get("serverUUID", ""),
+        ":type": event.get("instanceType", ""),
+        ":ttl": now + RETENTION_DAYS * 86400,
+    }
+    adds = []
+
+    for i, name in enumerate(metrics):
+        points = [s[name] for s in samples if isinstance(s.get(name), (int, float))]
+        minute[name] = to_decimal(sum(points) / len(points))
+        if name in LOW_IS_BAD:
+            minute[f"{name}_min"] = to_decimal(min(points))
+        else:
+            minute[f"{name}_max"] = to_decimal(max(points))
+
+        # Hourly averages: dashboards divide sum by count
+        names[f"#s{i}"] = f"{name}_sum"
+        names[f"#n{i}"] = f"{name}_count"
+        values[f":s{i}"] = to_decimal(sum(points))
+        values[f":n{i}"] = len(points)
+        adds.append(f"#s{i} :s{i}, #n{i} :n{i}")
+
+    values[":minute"] = minute
+    update = "SET ServerUUID = :uuid, InstanceType = :type, #ttl = :ttl, #minute = :minute"
+    if adds:
+        update += " ADD " + ", ".join(adds)
+
+    table.update_item(
+        Key={"PK": f"METRICS#{owner}", "SK": hour_key},
+        UpdateExpression=update,
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values
+    )
+
+    table.put_item(Item={
+        "PK": f"METRICS#{owner}",
+        "SK": "LATEST",
+        "ServerUUID": event.get("serverUUID", ""),
+        "InstanceType": event.get("instanceType", ""),
+        "sample": {k: to_decimal(v) if isinstance(v, float) else v for k, v in last.items()},
+        "ttl": now + LATEST_TTL_SECONDS
+    })
+
+    return {"statusCode": 200, "body": {"hour": hour_key, "samples": len(samples)}}
+
+
+def to_decimal(value):
+    return Decimal(str(round(value, 2)))
@@ -0,0 +1,233 @@
+import os
+import json
+import math
+import clients
+import config_cache
+import launch_templates
+import bootstrap
+import warm_pool
+import instrumentation
+from datetime import datetime, timezone, timedelta
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+# ENV: REGION, GLOBAL_REGION, EFS_ID, SECURITY_GROUP_ID, SUBNET_ID, SHUTDOWN_MODE, POOL_LAMBDA,
+#      POOL_MIN, POOL_MAX, POOL_REFILL_MINUTES, POOL_BOOT_TIMEOUT_MINUTES
+# Keeps the regional warm pool (see warm_pool) sized to demand.
+#   {"ready": "<instanceId>"}  sent by a pooled instance once its user data finished
+#   {"refill": "<pool PK>"}    sent by turnOnServer on every start
+#   anything else (schedule)   reconcile every type/Java pool of the catalog
+# Reconciling also cleans up after crashed starts: CLAIMED items older than
+# CLAIM_TIMEOUT are dropped (attached) or retired (not), and instances tagged
+# for the pool that no item references are terminated.
+
+POOL_MIN = int(os.environ.get("POOL_MIN", "0"))
+POOL_MAX = int(os.environ.get("POOL_MAX", "3"))
+# Idle instances should cover the starts expected while their replacements boot
+REFILL_MINUTES = int(os.environ.get("POOL_REFILL_MINUTES", "10"))
+BOOT_TIMEOUT = timedelta(minutes=int(os.environ.get("POOL_BOOT_TIMEOUT_MINUTES", "15")))
+# Longer than turnOnServer can run, so the start that claimed the instance is gone
+CLAIM_TIMEOUT = timedelta(minutes=20)
+# launch() writes the items right after run_instances returns
+ORPHAN_GRACE = timedelta(minutes=5)
+LIVE_STATES = ["pending", "running", "stopping", "stopped"]
+HISTORY_DAYS = 7
+
+@instrumentation.handler
+def lambda_handler(event, context):
+    table = config_cache.get_table()
+
+    if "ready" in event:
+        return mark_ready(table, event["ready"])
+
+    pools = [event["refill"]] if "refill" in event else all_pools()
+    results = {pk: reconcile(table, pk) for pk in pools}
+    print(json.dumps({"poolManager": results}))
+    return {"statusCode": 200, "body": results}
+
+
+def all_pools():
+    resources = config_cache.get_resources()
+    if not resources:
+        return []
+    region = os.environ["REGION"]
+    javas = {launch_templates.java_for_version(resources, v) for v in resources.versions} or {launch_templates.DEFAULT_JAVA}
+    return [warm_pool.partition(region, t, j) for t in resources.types for j in sorted(javas)]
+
+
+def target_size(demand, now):
+    """
+    Idle instances to keep: the start rate expected this hour times REFILL_MINUTES.
+    The rate is the higher of the last hours and the same time of day over the past
+    week, so pools grow ahead of the evening peak instead of after it.
+    """
+    if not demand:
+        return 0
+
+    def starts(t):
+        return demand.get(f"DEMAND#{t:%Y-%m-%dT%H}", 0)
+
+    recent = max(starts(now), starts(now - timedelta(hours=1)))
+    daily = [
+        max(starts(now - timedelta(days=d)), starts(now - timedelta(days=d, hours=-1)))
+        for d in range(1, HISTORY_DAYS + 1)
+    ]
+    expected = max(recent, sum(daily) / len(daily))
+    return max(POOL_MIN, min(POOL_MAX, math.ceil(expected * REFILL_MINUTES / 60)))
+
+
+def reconcile(table, pk):
+    now = datetime.now(timezone.utc)
+    items = table.query(KeyConditionExpression=Key("PK").eq(pk), ConsistentRead=True).get("Items", [])
+    demand = {i["SK"]: int(i.get("starts", 0)) for i in items if i["SK"].startswith("DEMAND#")}
+    target = target_size(demand, now)
+
+    members = [i for i in items if i["SK"].startswith("INSTANCE#")]
+    live = []
+    for member in members:
+        if member["status"] == "CLAIMED":
+            # Out of the pool already; only left behind if the start crashed
+            if now - datetime.fromisoformat(member["ClaimedAt"]) > CLAIM_TIMEOUT:
+                settle_claim(table, member)
+        elif member["status"] == "BOOTING" and now - datetime.fromisoformat(member["LaunchedAt"]) > BOOT_TIMEOUT:
+            print(f"Pooled instance {member['InstanceId']} never reported ready, retiring it")
+            retire(table, member, "BOOTING")
+        else:
+            live.append(member)
+    orphans = terminate_orphans(pk, {m["InstanceId"] for m in members}, now)
+
+    launched = retired = 0
+    if len(live) < target:
+        launched = launch(table, pk, target - len(live))
+    elif len(live) > target:
+        # Only idle instances can go; booting ones are counted until they are ready
+        idle = sorted((m for m in live if m["status"] == "IDLE"), key=lambda m: m.get("ReadyAt", ""))
+        for member in idle[:len(live) - target]:
+            retired += retire(table, member, "IDLE")
+
+    return {"target": target, "live": len(live), "launched": launched, "retired": retired, "orphans": orphans}
+
+
+def settle_claim(table, member):
+    """
+    A claim whose start never released it. If the owner's server runs on the
+    instance the attach got through and only the item is left; otherwise the
+    instance never became a server and is retired.
+    """
+    owner = member["ClaimedBy"]
+    server = table.get_item(Key={"PK": f"USERS#{owner}", "SK": "SERVER"}, ConsistentRead=True).get("Item") or {}
+    if server.get("InstanceId") == member["InstanceId"]:
+        print(f"Pooled instance {member['InstanceId']} was attached to the server of {owner}, dropping the claim")
+        warm_pool.release(table, member)
+    else:
+        print(f"Claim of pooled instance {member['InstanceId']} by {owner} never finished, retiring it")
+        retire(table, member, "CLAIMED")
+
+
+def terminate_orphans(pk, known, now):
+    """Terminate instances tagged for the pool that no item references (e.g. the item was lost in a crash)."""
+    ec2 = clients.client("ec2")
+    reservations = ec2.describe_instances(Filters=[
+        {"Name": "tag:pool", "Values": [pk]},
+        {"Name": "instance-state-name", "Values": LIVE_STATES}
+    ])["Reservations"]
+    orphans = [
+        i["InstanceId"] for r in reservations for i in r["Instances"]
+        if i["InstanceId"] not in known and now - i["LaunchTime"] > ORPHAN_GRACE
+    ]
+    if orphans:
+        print(f"Terminating pooled instances no item references in {pk}: {orphans}")
+        try:
+            ec2.terminate_instances(InstanceIds=orphans)
+        except ClientError as e:
+            print(f"Error terminating orphaned pool instances: {e}")
+    return len(orphans)
+
+
+def launch(table, pk, count):
+    region, server_type, java = warm_pool.parse_partition(pk)
+    user_data = bootstrap.base_user_data(bootstrap.install_for(java), os.getenv("EFS_ID")) + ready_user_data()
+    params = bootstrap.instance_params(server_type, java, user_data, {"Name": f"pool-{server_type}", "pool": pk}, count=count)
+
+    try:
+        instances = clients.client("ec2").run_instances(**params)["Instances"]
+    except ClientError as e:
+        print(f"Error launching pooled {server_type} instances: {e}")
+        return 0
+
+    launched_at = datetime.now(timezone.utc).isoformat()
+    for instance in instances:
+        table.put_item(Item={
+            "PK": pk,
+            "SK": f"INSTANCE#{instance['InstanceId']}",
+            "InstanceId": instance["InstanceId"],
+            "status": "BOOTING",
+            "LaunchedAt": launched_at
+        })
+    return len(instances)
+
+
+def retire(table, member, status):
+    """Remove a member that is still in `status` (not claimed meanwhile) and terminate it."""
+    try:
+        table.delete_item(
+            Key={"PK": member["PK"], "SK": member["SK"]},
+            ConditionExpression="#s = :status",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues={":status": status}
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+        raise
+
+    try:
+        clients.client("ec2").terminate_instances(InstanceIds=[member["InstanceId"]])
+    except ClientError as e:
+        print(f"Error terminating pooled instance {member['InstanceId']}: {e}")
+    return True
+
+
+def mark_ready(table, instance_id):
+    reservations = clients.client("ec2").describe_instances(InstanceIds=[instance_id])["Reservations"]
+    if not reservations:
+        return {"statusCode": 404, "body": f"Instance {instance_id} not found"}
+    instance = reservations[0]["Instances"][0]
+
+    tags = {t["Key"]: t["Value"] for t in instance.get("Tags", [])}
+    pk = tags.get("pool")
+    if not pk:
+        return {"statusCode": 200, "body": f"Ignored {instance_id}"}
+
+    try:
+        table.update_item(
+            Key={"PK": pk, "SK": f"INSTANCE#{instance_id}"},
+            UpdateExpression="SET #s = :idle, PublicIp = :ip, ReadyAt = :now",
+            ConditionExpression="#s = :booting",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues={
+                ":idle": "IDLE",
+                ":booting": "BOOTING",
+                ":ip": instance.get("PublicIpAddress", ""),
+                ":now": datetime.now(timezone.utc).isoformat()
+            }
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            # Retired while booting; terminate_instances is already on its way
+            return {"statusCode": 409, "body": f"{instance_id} is no longer pooled"}
+        raise
+
+    print(f"Pooled instance {instance_id} ready in {pk}")
+    return {"statusCode": 200, "body": {"instance_id": instance_id, "pool": pk}}
+
+
+def ready_user_data():
+    return f"""
+# Pooled: no world attached. turnOnServer attaches one over SSM (bootstrap.server_user_data)
+TOKEN=$(curl -s -X PUT http://169.254.169.254/latest/api/token -H "X-aws-ec2-metadata-token-ttl-seconds: 60")
+INSTANCE_ID=$(curl -s -H "X-aws-ec2-metadata-token: $TOKEN" http://169.254.169.254/latest/meta-data/instance-id)
+aws lambda invoke --region {os.environ['REGION']} --function-name {os.environ['POOL_LAMBDA']} \\
+  --invocation-type Event --cli-binary-format raw-in-base64-out \\
+  --payload "{{\\"ready\\": \\"$INSTANCE_ID\\"}}" /dev/null
+"""
@@ -0,0 +1,61 @@
+import clients
+import config_cache
+import instrumentation
+import status_index
+import desired_state
+from botocore.exceptions import ClientError
+
+# ENV: GLOBAL_REGION, REGION
+# Triggered by EventBridge "EC2 Instance State-change Notification" (state=running).
+# Completes the start that turnOnServer launched: RUNNING, PublicIp, LaunchedAt.
+
+@instrumentation.handler
+def lambda_handler(event, context):
+    instance_id = event["detail"]["instance-id"]
+
+    reservations = clients.client('ec2').describe_instances(InstanceIds=[instance_id])["Reservations"]
+    if not reservations:
+        print(f"Instance {instance_id} not found")
+        return {"statusCode": 404, "body": f"Instance {instance_id} not found"}
+    instance = reservations[0]["Instances"][0]
+
+    tags = {t["Key"]: t["Value"] for t in instance.get("Tags", [])}
+    user_email = tags.get("serverOwner")
+    if not user_email:
+        # Not one of our Minecraft servers
+        return {"statusCode": 200, "body": f"Ignored {instance_id}"}
+
+    table = config_cache.get_table()
+
+    # Only complete the start this instance belongs to. The event may also
+    # beat turnOnServer's PENDING write, in which case the item is still STARTING,
+    # either without an instance (launch) or on this one (resume of a stopped instance).
+    # A server already STOPPING/DELETING stays that way. An operation queued
+    # during the start (DesiredState) runs once the server is RUNNING.
+    set_status, status_values = status_index.update("RUNNING")
+    try:
+        previous = table.update_item(
+            Key={"PK": f"USERS#{user_email}", "SK": "SERVER"},
+            UpdateExpression=f"SET {set_status}, InstanceId = :id, PublicIp = :ip, LaunchedAt = :launched"
+                             " REMOVE StoppedAt, StoppedInstanceType, DesiredState, DesiredAt",
+            ConditionExpression="(InstanceId = :id AND #s IN (:pending, :starting))"
+                                " OR (attribute_not_exists(InstanceId) AND #s = :starting)",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues={
+                ":starting": "STARTING",
+                ":pending": "PENDING",
+                ":id": instance_id,
+                ":ip": instance.get("PublicIpAddress", ""),
+                ":launched": instance["LaunchTime"].isoformat()
+            } | status_values,
+            ReturnValues="ALL_OLD"
+        )["Attributes"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            print(f"Stale state change for {instance_id} ({user_email}), ignoring")
+            return {"statusCode": 409, "body": f"Stale instance {instance_id}"}
+        raise
+
+    print(f"Server for {user_email} running on {instance_id}")
+    desired_state.honour(previous, user_email, "RUNNING")
+    return {"statusCode": 200, "body": {"instance_id": instance_id, "public_ip": instance.get("PublicIpAddress")}}
@@ -0,0 +1,197 @@
+import os
+import json
+import gzip
+import time
+import hashlib
+import clients
+import config_cache
+import instrumentation
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+# ENV: REGION, GLOBAL_REGION, EFS_PATH, SNAPSHOT_BUCKET, SNAPSHOT_WORKERS
+# Triggered by EventBridge when a server instance is terminated or stopped,
+# i.e. once the world is no longer being written. Also restores: {"restore": {"serverUUID", "manifest"}}
+#
+# Layout in SNAPSHOT_BUCKET:
+#   <serverUUID>/objects/<sha256>               content-addressed file bodies
+#   <serverUUID>/manifests/<timestamp>.json.gz  {"created", "files": [[path, sha256, size, mtime_ns], ...]}
+#   <serverUUID>/latest                         key of the newest manifest
+
+SNAPSHOT_WORKERS = int(os.environ.get("SNAPSHOT_WORKERS", "16"))
+
+# Regenerated by the server or shared: not part of the world
+EXCLUDED_DIRS = {"libraries", "versions", "logs", "crash-reports", "cache"}
+EXCLUDED_FILES = {"server.jar", "session.lock"}
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=16 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=4
+)
+
+@instrumentation.handler
+def lambda_handler(event, context):
+    bucket = os.environ["SNAPSHOT_BUCKET"]
+    efs_path = os.environ.get("EFS_PATH", "/mnt/efs")
+
+    if "restore" in event:
+        restore = event["restore"]
+        with instrumentation.step("restore_snapshot"):
+            files = restore_snapshot(bucket, restore["serverUUID"], restore.get("manifest"), efs_path)
+        return {"statusCode": 200, "body": {"restored": files}}
+
+    instance_id = event["detail"]["instance-id"]
+    reservations = clients.client('ec2').describe_instances(InstanceIds=[instance_id])["Reservations"]
+    if not reservations:
+        return {"statusCode": 404, "body": f"Instance {instance_id} not found"}
+
+    tags = {t["Key"]: t["Value"] for t in reservations[0]["Instances"][0].get("Tags", [])}
+    user_email = tags.get("serverOwner")
+    server_uuid = tags.get("Name")
+    if not user_email or not server_uuid:
+        return {"statusCode": 200, "body": f"Ignored {instance_id}"}
+
+    table = config_cache.get_table()
+    server = table.get_item(Key={"PK": f"USERS#{user_email}", "SK": "SERVER"}).get("Item") or {}
+    if server.get("status") not in ("OFFLINE", None):
+        # Restarted (or being deleted) before we got here; the next shutdown snapshots it
+        print(f"Skipping snapshot of {server_uuid}, server is {server.get('status')}")
+        return {"statusCode": 409, "body": f"Server is {server.get('status')}"}
+
+    server_path = f"{efs_path}/{server_uuid}"
+    if not os.path.isdir(server_path):
+        return {"statusCode": 404, "body": f"No world at {server_path}"}
+
+    with instrumentation.step("take_snapshot"):
+        result = take_snapshot(bucket, server_uuid, server_path)
+
+    try:
+        table.update_item(
+            Key={"PK": f"USERS#{user_email}", "SK": "CONFIGPROFILE"},
+            UpdateExpression="SET LastSnapshot = :m",
+            ConditionExpression="attribute_exists(PK)",
+            ExpressionAttributeValues={":m": result["manifest"]}
+        )
+    except ClientError as e:
+        print(f"Error recording snapshot for {user_email}: {e}")
+
+    return {"statusCode": 200, "body": result}
+
+
+def take_snapshot(bucket, server_uuid, server_path):
+    s3 = clients.client("s3")
+    started = time.monotonic()
+    previous = load_manifest(bucket, server_uuid)
+
+    # Fast path: unchanged size + mtime reuses the previous hash without reading the file
+    known = {row[0]: row for row in previous["files"]} if previous else {}
+    uploaded = {row[1] for row in previous["files"]} if previous else set()
+
+    def snapshot_file(rel_path):
+        path = os.path.join(server_path, rel_path)
+        st = os.stat(path)
+        row = known.get(rel_path)
+        if row and row[2] == st.st_size and row[3] == st.st_mtime_ns:
+            return row, 0
+
+        sha256 = hash_file(path)
+        sent = 0
+        if sha256 not in uploaded:
+            s3.upload_file(path, bucket, f"{server_uuid}/objects/{sha256}", Config=TRANSFER_CONFIG)
+            sent = st.st_size
+        return [rel_path, sha256, st.st_size, st.st_mtime_ns], sent
+
+    with ThreadPoolExecutor(max_workers=SNAPSHOT_WORKERS) as pool:
+        results = list(pool.map(snapshot_file, list_world_files(server_path)))
+
+    manifest = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "files": [row for row, _ in results]
+    }
+    manifest_key = f"{server_uuid}/manifests/{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}.json.gz"
+    s3.put_object(Bucket=bucket, Key=manifest_key, Body=gzip.compress(json.dumps(manifest, separators=(",", ":")).encode()))
+    s3.put_object(Bucket=bucket, Key=f"{server_uuid}/latest", Body=manifest_key.encode())
+
+    summary = {
+        "manifest": manifest_key,
+        "files": len(results),
+        "changed": sum(1 for _, sent in results if sent),
+        "bytesUploaded": sum(sent for _, sent in results),
+        "seconds": round(time.monotonic() - started, 3)
+    }
+    print(json.dumps({"snapshotServer": server_uuid} | summary))
+    return summary
+
+
+def list_world_files(server_path):
+    for dir_path, dir_names, file_names in os.walk(server_path):
+        if dir_path == server_path:
+            dir_names[:] = [d for d in dir_names if d not in EXCLUDED_DIRS and not d.startswith(".")]
+        for name in file_names:
+            if name not in EXCLUDED_FILES:
+                yield os.path.relpath(os.path.join(dir_path, name), server_path)
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(bucket, server_uuid, manifest_key=None):
+    s3 = clients.client("s3")
+    try:
+        if not manifest_key:
+            manifest_key = s3.get_object(Bucket=bucket, Key=f"{server_uuid}/latest")["Body"].read().decode()
+        body = s3.get_object(Bucket=bucket, Key=manifest_key)["Body"].read()
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return json.loads(gzip.decompress(body))
+
+
+def restore_snapshot(bucket, server_uuid, manifest_key, efs_path):
+    """
+    Make the server folder match a manifest (latest by default): world files the
+    manifest does not list are removed, every listed file is written back.
+    Excluded paths (server.jar, libraries, ...) are left alone.
+    """
+    manifest = load_manifest(bucket, server_uuid, manifest_key)
+    if not manifest:
+        raise ValueError(f"No snapshot found for {server_uuid}")
+
+    s3 = clients.client("s3")
+    server_path = f"{efs_path}/{server_uuid}"
+
+    # Restoring over a live folder must not leave a mix of both states
+    listed = {row[0] for row in manifest["files"]}
+    stale = [rel_path for rel_path in list_world_files(server_path) if rel_path not in listed]
+    emptied = set()
+    for rel_path in stale:
+        os.unlink(os.path.join(server_path, rel_path))
+        emptied.add(os.path.dirname(rel_path))
+    # Directories left empty by that, deepest first, up to (not including) the server folder
+    for rel_dir in sorted(emptied, key=lambda d: d.count(os.sep), reverse=True):
+        while rel_dir:
+            try:
+                os.rmdir(os.path.join(server_path, rel_dir))
+            except OSError:
+                break
+            rel_dir = os.path.dirname(rel_dir)
+    if stale:
+        print(f"Removed {len(stale)} files of {server_uuid} not in {manifest_key or 'the latest snapshot'}")
+
+    def restore_file(row):
+        rel_path, sha256 = row[0], row[1]
+        path = os.path.join(server_path, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        s3.download_file(bucket, f"{server_uuid}/objects/{sha256}", path, Config=TRANSFER_CONFIG)
+
+    with ThreadPoolExecutor(max_workers=SNAPSHOT_WORKERS) as pool:
+        list(pool.map(restore_file, manifest["files"]))
+    return len(manifest["files"])
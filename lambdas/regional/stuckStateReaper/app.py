@@ -0,0 +1,270 @@
+import os
+import json
+import clients
+import config_cache
+import instrumentation
+import status_index
+import desired_state
+from datetime import datetime, timezone, timedelta
+from botocore.exceptions import ClientError
+
+# ENV: REGION, GLOBAL_REGION, STUCK_MINUTES, DELETE_STALE_MINUTES, MAX_STOPPED_DAYS
+# Scheduled. Every intermediate status is written and cleared by one handler
+# invocation (a chain of them for DELETING); a crash or timeout in between
+# leaves it behind and blocks every later operation. Servers that have been
+# CREATING, STARTING, PENDING or STOPPING (StatusSince) for longer than
+# STUCK_MINUTES are settled from what EC2 says about their instance:
+#   CREATING  config profile written -> OFFLINE, otherwise the item is removed
+#   STARTING  instance running -> RUNNING, pending -> PENDING, stopped -> OFFLINE (kept for resume), none -> OFFLINE
+#   PENDING   running -> RUNNING, stopped -> OFFLINE (kept), gone -> OFFLINE; still pending is left alone
+#   STOPPING  stopped -> OFFLINE (kept), running -> RUNNING and stopped again, gone -> OFFLINE
+#   DELETING  no pass for DELETE_STALE_MINUTES -> deleteServer is invoked to take it over
+# Writes are conditional on the status and StatusSince the server was found
+# with, so a slow handler that finishes meanwhile wins. A DesiredState recorded
+# during the transition is honoured as after a normal one.
+#
+# Also retires stopped instances (SHUTDOWN_MODE=stop/hibernate) that have not been
+# resumed for MAX_STOPPED_DAYS: turnOnServer would replace them anyway, and an
+# owner who never comes back would otherwise keep paying for the EBS volume.
+
+# Longer than a Lambda can run, so the handler that owns the status is gone
+STUCK_MINUTES = int(os.environ.get("STUCK_MINUTES", "20"))
+DELETE_STALE_MINUTES = int(os.environ.get("DELETE_STALE_MINUTES", "30"))
+# Same limit turnOnServer applies when it finds a stopped instance
+MAX_STOPPED_DAYS = int(os.environ.get("MAX_STOPPED_DAYS", "7"))
+
+LIVE_STATES = ["pending", "running", "stopping", "stopped"]
+STOPPED_STATES = ("stopping", "stopped")
+# Which of an owner's tagged instances to keep when a crash left several
+PREFERENCE = {"running": 0, "pending": 1, "stopping": 2, "stopped": 3}
+
+@instrumentation.handler
+def lambda_handler(event, context):
+    table = config_cache.get_table()
+    region = os.environ["REGION"]
+    now = datetime.now(timezone.utc)
+    older_than = now - timedelta(minutes=STUCK_MINUTES)
+
+    settle = {
+        "CREATING": settle_creating,
+        "STARTING": settle_starting,
+        "PENDING": settle_pending,
+        "STOPPING": settle_stopping,
+        "DELETING": settle_deleting,
+    }
+    results = {}
+    for status, settle_one in settle.items():
+        for server in status_index.iter_servers(table, status, [region], older_than):
+            owner = status_index.owner_of(server)
+            try:
+                outcome = settle_one(table, server, owner, now)
+            except ClientError as e:
+                print(f"Error settling {status} server of {owner}: {e}")
+                outcome = "error"
+            print(f"Stuck {status} server of {owner} since {server['StatusSince']}: {outcome}")
+            counts = results.setdefault(status, {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+    # OFFLINE since before the cutoff is a cheap superset of "stopped before the cutoff"
+    stopped_before = now - timedelta(days=MAX_STOPPED_DAYS)
+    for server in status_index.iter_servers(table, "OFFLINE", [region], stopped_before):
+        if not server.get("InstanceId") or server.get("StoppedAt", "") >= stopped_before.isoformat():
+            continue
+        owner = status_index.owner_of(server)
+        try:
+            outcome = retire_stopped(table, server, owner)
+        except ClientError as e:
+            print(f"Error retiring stopped instance of {owner}: {e}")
+            outcome = "error"
+        print(f"Stopped instance {server['InstanceId']} of {owner} since {server.get('StoppedAt')}: {outcome}")
+        counts = results.setdefault("STOPPED", {})
+        counts[outcome] = counts.get(outcome, 0) + 1
+
+    print(json.dumps({"stuckStateReaper": results}))
+    return {"statusCode": 200, "body": results}
+
+
+def settle_creating(table, server, owner, now):
+    config = table.get_item(Key={"PK": f"USERS#{owner}", "SK": "CONFIGPROFILE"}).get("Item")
+    if config:
+        return "OFFLINE" if move(table, server, owner, "OFFLINE") else "superseded"
+
+    # Nothing was created: free the slot so a new CREATE can claim it
+    try:
+        table.delete_item(
+            Key={"PK": f"USERS#{owner}", "SK": "SERVER"},
+            ConditionExpression="#s = :found AND StatusSince = :since",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues={":found": server["status"], ":since": server["StatusSince"]}
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return "superseded"
+    return "removed"
+
+
+def settle_starting(table, server, owner, now):
+    instance = find_instance(server, owner)
+    if not instance:
+        moved = move(table, server, owner, "OFFLINE", remove=("InstanceId", "StoppedAt", "StoppedInstanceType"))
+        return "OFFLINE" if moved else "superseded"
+
+    state = instance["State"]["Name"]
+    if state == "running":
+        return settle_running(table, server, owner, instance)
+    if state == "pending":
+        moved = move(table, server, owner, "PENDING", {"InstanceId": instance["InstanceId"]},
+                     remove=("StoppedAt", "StoppedInstanceType"))
+        return "PENDING" if moved else "superseded"
+    return settle_stopped(table, server, owner, instance, now)
+
+
+def settle_pending(table, server, owner, now):
+    instance = find_instance(server, owner)
+    if not instance:
+        return "OFFLINE" if move(table, server, owner, "OFFLINE", remove=("InstanceId",)) else "superseded"
+
+    state = instance["State"]["Name"]
+    if state == "running":
+        return settle_running(table, server, owner, instance)
+    if state == "pending":
+        return "still pending"
+    return settle_stopped(table, server, owner, instance, now)
+
+
+def settle_stopping(table, server, owner, now):
+    instance = find_instance(server, owner)
+    if not instance:
+        return "OFFLINE" if move(table, server, owner, "OFFLINE", remove=("InstanceId",)) else "superseded"
+
+    if instance["State"]["Name"] in STOPPED_STATES:
+        return settle_stopped(table, server, owner, instance, now)
+
+    # The stop never reached EC2: the server is still up, stop it again
+    # unless a TURNON arrived meanwhile
+    return settle_running(table, server, owner, instance, then="OFFLINE")
+
+
+def settle_deleting(table, server, owner, now):
+    last_pass = server.get("ProgressAt") or server["StatusSince"]
+    if last_pass >= (now - timedelta(minutes=DELETE_STALE_MINUTES)).isoformat():
+        return "in progress"
+    function_name = f"deleteServer-{os.environ['REGION']}"
+    clients.client("lambda").invoke(
+        FunctionName=function_name,
+        InvocationType="Event",
+        Payload=json.dumps({"owner": owner})
+    )
+    return "retried"
+
+
+def retire_stopped(table, server, owner):
+    """
+    Forget a long stopped instance, then terminate it. Forgetting first and only
+    while the server is still OFFLINE on it keeps a TURNON that is resuming it
+    right now from losing its instance.
+    """
+    instance_id = server["InstanceId"]
+    try:
+        table.update_item(
+            Key={"PK": f"USERS#{owner}", "SK": "SERVER"},
+            UpdateExpression="REMOVE InstanceId, StoppedAt, StoppedInstanceType",
+            ConditionExpression="#s = :offline AND InstanceId = :id",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues={":offline": "OFFLINE", ":id": instance_id}
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return "superseded"
+
+    try:
+        clients.client("ec2").terminate_instances(InstanceIds=[instance_id])
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "InvalidInstanceID.NotFound":
+            raise
+    return "terminated"
+
+
+def settle_running(table, server, owner, instance, then=None):
+    moved = move(table, server, owner, "RUNNING", {
+        "InstanceId": instance["InstanceId"],
+        "PublicIp": instance.get("PublicIpAddress", ""),
+        "LaunchedAt": instance["LaunchTime"].isoformat()
+    }, remove=("StoppedAt", "StoppedInstanceType"), then=then)
+    return "RUNNING" if moved else "superseded"
+
+
+def settle_stopped(table, server, owner, instance, now):
+    # Same record turnOffServer leaves, so the next start resumes the instance
+    moved = move(table, server, owner, "OFFLINE", {
+        "InstanceId": instance["InstanceId"],
+        "StoppedAt": server.get("StoppedAt") or now.isoformat(),
+        "StoppedInstanceType": instance["InstanceType"]
+    })
+    return "OFFLINE (stopped)" if moved else "superseded"
+
+
+def move(table, server, owner, status, attributes=None, remove=(), then=None):
+    """
+    Move a stuck server to `status`, setting `attributes` and removing `remove`.
+    Only if it is still in the status it was found in. Honours the DesiredState
+    it carried, or `then` when it carried none. False if something else moved it first.
+    """
+    attributes = attributes or {}
+    set_status, values = status_index.update(status)
+    update = f"SET {set_status}" + "".join(f", {name} = :{name}" for name in attributes)
+    update += " REMOVE " + ", ".join(("DesiredState", "DesiredAt") + tuple(remove))
+    values |= {f":{name}": value for name, value in attributes.items()}
+    values |= {":found": server["status"], ":since": server["StatusSince"]}
+    try:
+        previous = table.update_item(
+            Key={"PK": f"USERS#{owner}", "SK": "SERVER"},
+            UpdateExpression=update,
+            ConditionExpression="#s = :found AND StatusSince = :since",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues=values,
+            ReturnValues="ALL_OLD"
+        )["Attributes"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return False
+
+    if then and not previous.get("DesiredState"):
+        previous["DesiredState"] = then
+    desired_state.honour(previous, owner, status)
+    return True
+
+
+def find_instance(server, owner):
+    """
+    The live instance behind a stuck server: the item's InstanceId, or for an
+    item without one (crash before it was written) an instance tagged for the
+    owner. Extra tagged instances are terminated. None if there is none.
+    """
+    ec2 = clients.client("ec2")
+    if server.get("InstanceId"):
+        try:
+            reservations = ec2.describe_instances(InstanceIds=[server["InstanceId"]])["Reservations"]
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "InvalidInstanceID.NotFound":
+                return None
+            raise
+    else:
+        reservations = ec2.describe_instances(Filters=[
+            {"Name": "tag:serverOwner", "Values": [owner]},
+            {"Name": "instance-state-name", "Values": LIVE_STATES}
+        ])["Reservations"]
+
+    instances = [i for r in reservations for i in r["Instances"] if i["State"]["Name"] in LIVE_STATES]
+    if not instances:
+        return None
+
+    instances.sort(key=lambda i: PREFERENCE[i["State"]["Name"]])
+    extra = [i["InstanceId"] for i in instances[1:]]
+    if extra:
+        print(f"Terminating duplicate instances of {owner}: {extra}")
+        ec2.terminate_instances(InstanceIds=extra)
+    return instances[0]
@@ -1,42 +1,121 @@
-import boto3
 import os
+import clients
+import config_cache
+import instrumentation
+import status_index
+import desired_state
+import ssm_commands
+from datetime import datetime, timezone
 from botocore.exceptions import ClientError
 
-# ENV: REGION, GLOBAL_REGION
+# ENV: REGION, GLOBAL_REGION, SHUTDOWN_MODE, SAVE_WAIT_SECONDS
 
-def lambda_handler(event, context):
-    ec2 = boto3.client('ec2', region_name=os.environ["REGION"])
-    ssm = boto3.client('ssm', region_name=os.environ["GLOBAL_REGION"])
-    dynamodb = boto3.resource("dynamodb", region_name=os.environ["GLOBAL_REGION"])
+# terminate: instance is gone, next start launches and boots from scratch
+# stop:      instance is stopped, next start resumes it (EBS kept, no compute billed)
+# hibernate: like stop, but RAM is saved so the JVM comes back already warm
+SHUTDOWN_MODE = os.environ.get("SHUTDOWN_MODE", "terminate")
+# Hibernation freezes the instance without running systemd's ExecStop (save-all),
+# so the world is flushed over SSM first. Without a confirmed save the instance
+# is stopped instead, which does run ExecStop.
+SAVE_WAIT_SECONDS = int(os.environ.get("SAVE_WAIT_SECONDS", "60"))
+SAVE_COMMAND = "/usr/bin/python3 /usr/local/bin/mc-agent.py save"
 
-    table_name = ssm.get_parameter(Name="/global/dynamo/table-name")['Parameter']['Value']
-    table = dynamodb.Table(table_name)
+@instrumentation.handler
+def lambda_handler(event, context):
+    ec2 = clients.client('ec2')
+    table = config_cache.get_table()
 
     user_email = event.get('owner')
 
-    response = table.get_item(
-        Key={
-            "PK": f"USERS#{user_email}",
-            "SK": f"SERVER"
-        }
-    )
-    server = response.get("Item")
+    # Only a server with an instance can stop; a second TURNOFF finds it STOPPING/OFFLINE
+    set_status, status_values = status_index.update("STOPPING")
+    for _ in range(2):
+        try:
+            server = table.update_item(
+                Key={
+                    "PK": f"USERS#{user_email}",
+                    "SK": f"SERVER"
+                },
+                UpdateExpression=f"SET {set_status} REMOVE DesiredState, DesiredAt",
+                ConditionExpression="#s IN (:running, :pending) AND attribute_exists(InstanceId)",
+                ExpressionAttributeNames={"#s": "status"},
+                ExpressionAttributeValues={":running": "RUNNING", ":pending": "PENDING"} | status_values,
+                ReturnValues="ALL_OLD"
+            )["Attributes"]
+            break
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+        # Mid-transition (e.g. STARTING): stop once it is over. If it just
+        # ended, the second round finds the server RUNNING/PENDING and stops it.
+        if desired_state.record(table, user_email, "OFFLINE"):
+            return {'statusCode': 202, 'body': 'Stop queued behind the current transition'}
+    else:
+        print(f"Server for {user_email} is not running, nothing to stop")
+        return {'statusCode': 409, 'body': 'Server is not running'}
     instance_id = server.get('InstanceId')
 
-    try:
-        response = ec2.terminate_instances(InstanceIds=[instance_id])
-        print(f"Stopping instance {instance_id}...")
-    except Exception as e:
-        print(f"Error stopping instance {instance_id}: {e}")
-
-
     server_item = {
         "PK": f"USERS#{user_email}",
         "SK": "SERVER",
-        "status": "OFFLINE"
+        **status_index.item("OFFLINE")
     }
 
+    # From here on the server must end up OFFLINE whatever fails; only a hard
+    # timeout can leave it STOPPING, and stuckStateReaper settles that
+    try:
+        stopped = False
+        if SHUTDOWN_MODE in ("stop", "hibernate"):
+            hibernate = SHUTDOWN_MODE == "hibernate"
+            if hibernate:
+                with instrumentation.step("save_world"):
+                    hibernate = save_world(instance_id)
+            try:
+                ec2.stop_instances(InstanceIds=[instance_id], Hibernate=hibernate)
+                print(f"Stopping instance {instance_id} ({'hibernate' if hibernate else 'stop'})...")
+                stopped = True
+            except Exception as e:
+                # e.g. hibernation not configured on an older instance
+                print(f"Error stopping instance {instance_id}, terminating instead: {e}")
+
+        if stopped:
+            # Remember the instance so turnOnServer can start it again
+            server_item |= {
+                "InstanceId": instance_id,
+                "StoppedAt": datetime.now(timezone.utc).isoformat()
+            }
+            instance_type = stopped_type(ec2, instance_id, server)
+            if instance_type:
+                server_item["StoppedInstanceType"] = instance_type
+        else:
+            try:
+                response = ec2.terminate_instances(InstanceIds=[instance_id])
+                print(f"Terminating instance {instance_id}...")
+            except Exception as e:
+                print(f"Error terminating instance {instance_id}: {e}")
+    finally:
+        try:
+            previous = table.put_item(Item=server_item, ReturnValues="ALL_OLD").get("Attributes", {})
+            desired_state.honour(previous, user_email, "OFFLINE")
+        except ClientError as e:
+            print(f"Error writing to DynamoDB: {e}")
+
+
+def stopped_type(ec2, instance_id, server):
+    """Type of the stopped instance; the launch's InstanceType on the item if EC2 cannot tell."""
+    try:
+        return ec2.describe_instances(InstanceIds=[instance_id])["Reservations"][0]["Instances"][0]["InstanceType"]
+    except (ClientError, IndexError, KeyError) as e:
+        print(f"Error describing instance {instance_id}: {e}")
+        return server.get("InstanceType")
+
+
+def save_world(instance_id):
+    """Run `mc-agent.py save` on the instance over SSM and wait for it. True once the save succeeded."""
     try:
-        table.put_item(Item=server_item)
+        status = ssm_commands.run(instance_id, [SAVE_COMMAND], "save-all before hibernate", SAVE_WAIT_SECONDS)
     except ClientError as e:
-        print(f"Error writing to DynamoDB: {e}")
\ No newline at end of file
+        print(f"Error saving the world on {instance_id}: {e}")
+        return False
+    print(f"World save on {instance_id}: {status or f'not finished in {SAVE_WAIT_SECONDS}s'}")
+    return status == "Success"
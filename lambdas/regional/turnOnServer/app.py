@@ -1,168 +1,181 @@
 import os
-import boto3
+import clients
+import config_cache
+import launch_templates
+import jvm_flags
+import bootstrap
+import warm_pool
+import launch_planner
+import instrumentation
+import status_index
+import desired_state
+import ssm_commands
+from datetime import datetime, timezone, timedelta
 from botocore.exceptions import ClientError
 
-# ENV GLOBAL_REGION, EFS_ID, SECURITY_GROUP_ID, SUBNET_ID, CREDIT_DEDUCTION_LAMBDA
+# ENV GLOBAL_REGION, EFS_ID, SECURITY_GROUP_ID, SUBNET_ID, SUBNET_IDS, METRICS_LAMBDA, SHUTDOWN_MODE, MAX_STOPPED_DAYS, POOL_LAMBDA, CAPACITY_MEMORY_MINUTES, ATTACH_WAIT_SECONDS
 
-ssm = boto3.client('ssm', region_name=os.environ["GLOBAL_REGION"])
-dynamodb = boto3.resource("dynamodb", region_name=os.environ["GLOBAL_REGION"])
-ec2 = boto3.client('ec2', region_name=os.environ["REGION"])
-# Table
-table_name = ssm.get_parameter(Name="/global/dynamo/table-name")['Parameter']['Value']
-table = dynamodb.Table(table_name)
+# Stopped instances older than this are replaced by a fresh launch
+# (stuckStateReaper also retires them when no start comes)
+MAX_STOPPED_DAYS = int(os.environ.get("MAX_STOPPED_DAYS", "7"))
+# How long a pooled instance may take to attach and start the jar before it is
+# given up for a cold launch
+ATTACH_WAIT_SECONDS = int(os.environ.get("ATTACH_WAIT_SECONDS", "30"))
 
+@instrumentation.handler
 def lambda_handler(event, context):
+    table = config_cache.get_table()
     user_email = event['owner']
 
-    resp = table.get_item(Key={'PK': f'USERS#{user_email}', 'SK': 'PROFILE'})
+    with instrumentation.step("credits"):
+        resp = table.get_item(Key={'PK': f'USERS#{user_email}', 'SK': 'PROFILE'})
     item = resp.get('Item')
 
     if not item or item.get('Credits', 0) <= 0:
         return {'statusCode': 400, 'body': 'Not enough credits'}
 
-    server_item = {
-        "PK": f"USERS#{user_email}",
-        "SK": "SERVER",
-        "status": "STARTING"
-    }
-
-    try:
-        table.put_item(Item=server_item)
-    except ClientError as e:
-        print(f"Error writing to DynamoDB: {e}")
-
-    response = table.get_item(
-        Key={
-            "PK": f"USERS#{user_email}",
-            "SK": f"CONFIGPROFILE"
-        }
-    )
+    # Only an OFFLINE server can start: duplicate TURNONs (double clicks,
+    # redeliveries) find it STARTING/RUNNING and launch nothing.
+    # An update, not a put: a stopped instance (InstanceId, StoppedAt,
+    # StoppedInstanceType) stays recorded until it is resumed or terminated,
+    # so a crash in between cannot orphan it.
+    set_status, status_values = status_index.update("STARTING")
+    with instrumentation.step("mark_starting"):
+        for _ in range(2):
+            try:
+                previous = table.update_item(
+                    Key={"PK": f"USERS#{user_email}", "SK": "SERVER"},
+                    UpdateExpression=f"SET {set_status} REMOVE DesiredState, DesiredAt",
+                    ConditionExpression="#s = :offline",
+                    ExpressionAttributeNames={"#s": "status"},
+                    ExpressionAttributeValues={":offline": "OFFLINE"} | status_values,
+                    ReturnValues="ALL_OLD"
+                ).get("Attributes", {})
+                break
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+            # Mid-transition (e.g. STOPPING): start once it is over. If it just
+            # ended, the item is OFFLINE by now and the second round starts it.
+            if desired_state.record(table, user_email, "RUNNING"):
+                return {'statusCode': 202, 'body': 'Start queued behind the current transition'}
+        else:
+            print(f"Server for {user_email} is not OFFLINE, not starting it")
+            return {'statusCode': 409, 'body': 'Server is not OFFLINE'}
+
+    with instrumentation.step("config"):
+        response = table.get_item(
+            Key={
+                "PK": f"USERS#{user_email}",
+                "SK": f"CONFIGPROFILE"
+            }
+        )
     config = response.get("Item")
 
     # Config Profile variables
     serverUUID = config.get('ServerUUID')
     server_type = config.get('Type')
-    server_flags = getFlags(server_type)
-
-    # Get EFS, SG, Subnet, S3, VPC
-    efs_id = os.getenv('EFS_ID')
-    security_groups = [os.getenv('SECURITY_GROUP_ID')]
-    subnet = os.getenv("SUBNET_ID")
-
-    # Get latest Amazon Linux 2023 AMI
-    image_id = get_latest_ami()
-
-    # Build user data
-    user_data = f"""#!/bin/bash
-set -exo pipefail
-
-# Install dependencies
-dnf install -y amazon-efs-utils java-21-amazon-corretto aws-cli cronie
-
-# Enable cron service
-systemctl enable crond
-systemctl start crond
-
-# Mount EFS
-mkdir -p /mnt/efs
-mount -t efs -o tls {efs_id}:/ /mnt/efs/
-
-# Make sure everything under the server folder is writable
-chmod -R 777 /mnt/efs/{serverUUID} || true
-cd /mnt/efs/{serverUUID}
-rm -f world/session.lock || true
-
-# --- Reporting setup ---
-echo "OWNER_UUID={user_email}" >> /etc/environment
-echo "INSTANCE_TYPE={server_type}" >> /etc/environment
-echo "REPORT_LAMBDA_NAME={os.environ['CREDIT_DEDUCTION_LAMBDA']}" >> /etc/environment
-
-cat <<'EOF' > /usr/local/bin/report.sh
-#!/bin/bash
-set -e
-source /etc/environment
-payload=$(printf '{{"owner":"%s","instanceType":"%s"}}' "$OWNER_UUID" "$INSTANCE_TYPE")
-aws lambda invoke \
-  --function-name "$REPORT_LAMBDA_NAME" \
-  --invocation-type Event \
-  --cli-binary-format raw-in-base64-out \
-  --payload "$payload" \
-  /dev/null
-EOF
-
-chmod +x /usr/local/bin/report.sh
-set +e
-bash -c '(crontab -l 2>/dev/null; echo "*/10 * * * * /usr/local/bin/report.sh") | crontab -'
-set -e
-
-# Start as ec2-user (not root)
-sudo -u ec2-user java {server_flags} -jar server.jar nogui
-"""
-
-    # Launch EC2 instance
-    instance_params = {
-        'ImageId': image_id,
-        'InstanceType': server_type,
-        'MinCount': 1,
-        'MaxCount': 1,
-        'NetworkInterfaces': [{
-            'SubnetId': subnet,
-            'DeviceIndex': 0,
-            'AssociatePublicIpAddress': True,
-            'Groups': security_groups
-        }],
-        'UserData': user_data,
-        'IamInstanceProfile': {
-            'Name': "EC2ServerInstanceProfile"
-        },
-        'TagSpecifications': [
-        {
-            'ResourceType': 'instance',
-            'Tags': [
-                {'Key': 'Name', 'Value': serverUUID},
-                {'Key': 'serverOwner', 'Value': user_email}
-            ]
-        }
-        ]
-    }
+
+    # The configured type first, then the types that can stand in for it
+    instance_types = launch_planner.equivalent_types(server_type, config_cache.get_resources())
+
+    if previous.get('InstanceId') and previous.get('StoppedAt'):
+        with instrumentation.step("resume"):
+            instance_id = resume_instance(previous, instance_types)
+        if not instance_id:
+            forget_stopped(table, user_email, previous['InstanceId'])
+        else:
+            with instrumentation.step("mark_pending"):
+                pending = mark_pending(table, user_email, instance_id)
+            if not pending:
+                # Superseded: launching now would give the owner a second instance
+                return {'statusCode': 409, 'body': 'Start was superseded'}
+            return {
+                'statusCode': 200,
+                'body': {
+                    'instance_id': instance_id,
+                    'status': "PENDING",
+                    'serverUUID': serverUUID,
+                    'resumed': True
+                }
+            }
+
+    with instrumentation.step("jvm_flags"):
+        server_flags = jvm_flags.build_flags(server_type, config_cache.get_resources(), table, user_email)
+    java = launch_templates.java_for_version(config_cache.get_resources(), config.get('Version'))
+    region = os.environ["REGION"]
+
+    # Pre-booted instance from the warm pool if one is idle
+    pool_key = warm_pool.partition(region, server_type, java)
+    with instrumentation.step("warm_pool"):
+        try:
+            warm_pool.record_start(table, pool_key)
+            pooled = warm_pool.claim(table, pool_key, user_email)
+        except ClientError as e:
+            print(f"Warm pool unavailable: {e}")
+            pooled = None
+        warm_pool.request_refill(pool_key)
+
+    if pooled:
+        with instrumentation.step("attach_pooled"):
+            instance_id = attach_pooled(pooled, table, user_email, serverUUID, server_type, server_flags)
+        if instance_id:
+            return {
+                'statusCode': 200,
+                'body': {
+                    'instance_id': instance_id,
+                    'status': "RUNNING",
+                    'serverUUID': serverUUID,
+                    'pooled': True
+                }
+            }
+
+    # Cold launch
+    with instrumentation.step("launch_params"):
+        user_data = bootstrap.base_user_data(bootstrap.install_for(java), os.getenv('EFS_ID')) \
+            + bootstrap.server_user_data(user_email, serverUUID, server_type, server_flags)
+        instance_params = bootstrap.instance_params(server_type, java, user_data, {'Name': serverUUID, 'serverOwner': user_email})
 
     try:
-        response = ec2.run_instances(**instance_params)
+        with instrumentation.step("run_instances"):
+            response, launched = launch_planner.launch(table, instance_params, instance_types)
         instance_id = response['Instances'][0]['InstanceId']
 
-        # Wait until running and get IP
-        ec2_resource = boto3.resource('ec2', region_name=os.environ['REGION'])
-        instance = ec2_resource.Instance(instance_id)
-        # instance = ec2.Instance(instance_id)
-        instance.wait_until_running()
-        instance.load()
-        public_ip = instance.public_ip_address
-
-        table.put_item(Item={
-            "PK": f"USERS#{user_email}",
-            "SK": f"SERVER",
-            "status": "RUNNING",
-            "InstanceId": instance_id,
-            "PublicIp": instance.public_ip_address,
-            "LaunchedAt": instance.launch_time.isoformat()
-        })
+        with instrumentation.step("mark_pending"):
+            pending = mark_pending(table, user_email, instance_id, launched)
+        if not pending:
+            return {'statusCode': 409, 'body': 'Start was superseded'}
 
         return {
             'statusCode': 200,
             'body': {
                 'instance_id': instance_id,
-                'public_ip': public_ip,
-                'serverUUID': serverUUID
+                'status': "PENDING",
+                'serverUUID': serverUUID,
+                'instanceType': launched["InstanceType"]
             }
         }
     except Exception as e:
         server_item = {
             "PK": f"USERS#{user_email}",
             "SK": "SERVER",
-            "status": "OFFLINE"
+            **status_index.item("OFFLINE")
         }
 
-        table.put_item(Item=server_item)
+        try:
+            failed = table.put_item(
+                Item=server_item,
+                ConditionExpression="#s = :starting",
+                ExpressionAttributeNames={"#s": "status"},
+                ExpressionAttributeValues={":starting": "STARTING"},
+                ReturnValues="ALL_OLD"
+            ).get("Attributes", {})
+            # A DELETE that arrived meanwhile still runs; a queued TURNON would
+            # only fail the same way, so that one is dropped
+            if failed.get("DesiredState") == "DELETED":
+                desired_state.honour(failed, user_email, "OFFLINE")
+        except ClientError:
+            pass
         print(f"Error launching EC2 instance: {e}")
         return {
             'statusCode': 500,
@@ -170,34 +183,157 @@ sudo -u ec2-user java {server_flags} -jar server.jar nogui
         }
 
 
-def getFlags(server_type: str):
-    response = table.get_item(Key={"PK": "GLOBAL", "SK": "RESOURCES"})
-    item = response.get("Item")
-
-    if not item or "types" not in item:
+def mark_pending(table, user_email, instance_id, launched=None):
+    # Don't wait for the instance: serverStateChange fills in RUNNING,
+    # PublicIp and LaunchedAt when EC2 reports the instance as running.
+    # If that event already arrived (RUNNING on this InstanceId), leave its write alone.
+    # A resumed instance is already the item's InstanceId; its stop record goes.
+    # Any other state means the start was superseded (e.g. by a DELETE) and
+    # the instance belongs to no one: terminate it. Returns False in that case.
+    # `launched` is the candidate the launch planner used, kept on the item.
+    set_status, status_values = status_index.update("PENDING")
+    update = f"SET {set_status}, InstanceId = :id"
+    remove = " REMOVE StoppedAt, StoppedInstanceType, DesiredState, DesiredAt"
+    values = {":starting": "STARTING", ":id": instance_id} | status_values
+    if launched:
+        update += ", InstanceType = :type, SubnetId = :subnet, LaunchAttempts = :attempts"
+        values |= {":type": launched["InstanceType"], ":subnet": launched["SubnetId"], ":attempts": launched["Attempts"]}
+    try:
+        previous = table.update_item(
+            Key={"PK": f"USERS#{user_email}", "SK": "SERVER"},
+            UpdateExpression=update + remove,
+            ConditionExpression="#s = :starting AND (attribute_not_exists(InstanceId) OR InstanceId = :id)",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues=values,
+            ReturnValues="ALL_OLD"
+        )["Attributes"]
+        desired_state.honour(previous, user_email, "PENDING")
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        current = table.get_item(Key={"PK": f"USERS#{user_email}", "SK": "SERVER"}).get("Item") or {}
+        if current.get("InstanceId") != instance_id:
+            print(f"Start for {user_email} superseded ({current.get('status')}), terminating {instance_id}")
+            clients.client('ec2').terminate_instances(InstanceIds=[instance_id])
+            return False
+    return True
+
+
+def forget_stopped(table, user_email, instance_id):
+    """Drop the record of a stopped instance resume_instance() terminated, so a fresh launch can take its place."""
+    try:
+        table.update_item(
+            Key={"PK": f"USERS#{user_email}", "SK": "SERVER"},
+            UpdateExpression="REMOVE InstanceId, StoppedAt, StoppedInstanceType",
+            ConditionExpression="#s = :starting AND InstanceId = :id",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues={":starting": "STARTING", ":id": instance_id}
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+
+
+def resume_instance(previous, instance_types):
+    """
+    Start the owner's stopped instance. Returns its id, or None after terminating
+    it when it should not be reused (type changed, stopped too long, start failed).
+    Any of `instance_types` counts as unchanged, since a launch may have fallen back.
+    """
+    ec2 = clients.client('ec2')
+    instance_id = previous['InstanceId']
+    stopped_at = datetime.fromisoformat(previous['StoppedAt'])
+
+    if previous.get('StoppedInstanceType') not in instance_types:
+        reason = "instance type changed"
+    elif datetime.now(timezone.utc) - stopped_at > timedelta(days=MAX_STOPPED_DAYS):
+        reason = f"stopped for more than {MAX_STOPPED_DAYS} days"
+    else:
+        try:
+            ec2.start_instances(InstanceIds=[instance_id])
+            print(f"Resuming stopped instance {instance_id}")
+            return instance_id
+        except ClientError as e:
+            reason = f"start failed: {e}"
+
+    print(f"Not resuming {instance_id} ({reason}), terminating it")
+    try:
+        ec2.terminate_instances(InstanceIds=[instance_id])
+    except ClientError as e:
+        print(f"Error terminating instance {instance_id}: {e}")
+    return None
+
+
+def attach_pooled(pooled, table, user_email, serverUUID, server_type, server_flags):
+    """
+    Hand a claimed pool instance to the owner: retag it and run the per-server
+    part of the user data over SSM, which starts the jar. Only once that command
+    succeeded (systemctl started the server) does the SERVER item go to RUNNING;
+    the instance is already running, so no state-change event follows.
+    The pool item is released either way.
+    Returns the instance id, or None after terminating an instance that could not be attached.
+    """
+    instance_id = pooled["InstanceId"]
+    ec2 = clients.client('ec2')
+    try:
+        ec2.create_tags(Resources=[instance_id], Tags=[
+            {'Key': 'Name', 'Value': serverUUID},
+            {'Key': 'serverOwner', 'Value': user_email}
+        ])
+        ec2.delete_tags(Resources=[instance_id], Tags=[{'Key': 'pool'}])
+        status = ssm_commands.run(
+            instance_id,
+            [bootstrap.server_user_data(user_email, serverUUID, server_type, server_flags)],
+            f"Attach {serverUUID}",
+            ATTACH_WAIT_SECONDS
+        )
+    except ClientError as e:
+        status = f"error: {e}"
+
+    if status != "Success":
+        print(f"Could not attach pooled instance {instance_id} ({status or 'timed out'}), launching instead")
+        try:
+            ec2.terminate_instances(InstanceIds=[instance_id])
+        except ClientError as e:
+            print(f"Error terminating instance {instance_id}: {e}")
+        warm_pool.release(table, pooled)
         return None
 
-    for t in item["types"]:
-        if t.get("id") == server_type:
-            return t.get("serverFlags")
-
-    return "-Xms512M -Xmx1G"
+    set_status, status_values = status_index.update("RUNNING")
+    try:
+        previous = table.update_item(
+            Key={"PK": f"USERS#{user_email}", "SK": "SERVER"},
+            UpdateExpression=f"SET {set_status}, InstanceId = :id, PublicIp = :ip, LaunchedAt = :launched"
+                             " REMOVE DesiredState, DesiredAt",
+            ConditionExpression="#s = :starting",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues={
+                ":starting": "STARTING",
+                ":id": instance_id,
+                ":ip": pooled.get("PublicIp", ""),
+                ":launched": datetime.now(timezone.utc).isoformat()
+            } | status_values,
+            ReturnValues="ALL_OLD"
+        )["Attributes"]
+        desired_state.honour(previous, user_email, "RUNNING")
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        print(f"Start for {user_email} superseded, terminating {instance_id}")
+        ec2.terminate_instances(InstanceIds=[instance_id])
+        warm_pool.release(table, pooled)
+        return None
+    warm_pool.release(table, pooled)
+    print(f"Attached pooled instance {instance_id} to {serverUUID}")
+    return instance_id
 
 
 def getSubnet(region: str):
-    ssm = boto3.client("ssm", region_name=region)
     subnet_param = f"/subnet/{region}/id"
 
     try:
-        subnet_id = ssm.get_parameter(Name=subnet_param)["Parameter"]["Value"]
+        subnet_id = config_cache.get_parameter(subnet_param, region=region)
     except ClientError as e:
         raise RuntimeError(f"Failed to get Subnet ID from SSM ({subnet_param}): {e}")
 
     return subnet_id
-
-
-def get_latest_ami():
-    # AWS publishes a parameter for the latest Amazon Linux 2023 AMI
-    regional_ssm = boto3.client('ssm', region_name=os.environ["REGION"])
-    param = regional_ssm.get_parameter(Name="/aws/service/ami-amazon-linux-latest/al2023-ami-kernel-default-x86_64")
-    return param['Parameter']['Value']
\ No newline at end of file
@@ -0,0 +1,80 @@
+import os
+import json
+import gzip
+import base64
+from decimal import Decimal
+from boto3.dynamodb.types import Binary
+import http_utils
+
+# JSON responses for the HTTP API handlers (payload format 1.0).
+#   - DynamoDB types are encoded by the C JSON encoder in one pass: Decimal becomes
+#     an int or float (never a string), sets become lists, Binary becomes base64
+#   - table and index key attributes are dropped from the top-level item(s)
+#   - bodies of GZIP_MIN_BYTES or more are gzipped when the client accepts it
+# ENV: GZIP_MIN_BYTES (optional, default 1024), GZIP_LEVEL (optional, default 6)
+
+GZIP_MIN_BYTES = int(os.environ.get("GZIP_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+KEY_ATTRIBUTES = frozenset(("PK", "SK", "StatusRegion", "StatusSince"))
+
+
+def _default(obj):
+    if type(obj) is Decimal:
+        number = float(obj)
+        # int() keeps large integers exact; the float test is the cheap part
+        return int(obj) if number.is_integer() else number
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=str)
+    if isinstance(obj, Binary):
+        return base64.b64encode(obj.value).decode()
+    if isinstance(obj, (bytes, bytearray)):
+        return base64.b64encode(obj).decode()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+_encoder = json.JSONEncoder(default=_default, ensure_ascii=False, separators=(",", ":"))
+_sorted_encoder = json.JSONEncoder(default=_default, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+
+
+def strip_keys(payload):
+    """`payload` without key attributes: an item, a list of items, or anything else unchanged.
+    Only the top level is rebuilt; nested values are shared, not copied."""
+    if isinstance(payload, dict):
+        if KEY_ATTRIBUTES.isdisjoint(payload):
+            return payload
+        return {k: v for k, v in payload.items() if k not in KEY_ATTRIBUTES}
+    if isinstance(payload, list):
+        return [strip_keys(item) if isinstance(item, dict) else item for item in payload]
+    return payload
+
+
+def encode(payload, sort_keys=False):
+    """JSON text for a DynamoDB item (or list of items) with key attributes removed.
+    sort_keys gives a stable text for ETags."""
+    return (_sorted_encoder if sort_keys else _encoder).encode(strip_keys(payload))
+
+
+def compress(body):
+    """Base64 of the gzipped body, as API Gateway expects binary bodies."""
+    return base64.b64encode(gzip.compress(body.encode(), compresslevel=GZIP_LEVEL, mtime=0)).decode()
+
+
+def json_response(event, body, status_code=200, headers=None, gzipped=None):
+    """
+    Response for an encoded JSON `body`. Gzipped when it is large enough and the
+    client accepts gzip; `gzipped` is a compress(body) the caller already has cached.
+    """
+    headers = (headers or {}) | {"Content-Type": "application/json", "Vary": "Accept-Encoding"}
+
+    if len(body) < GZIP_MIN_BYTES or not http_utils.accepts_encoding(event, "gzip"):
+        return {"statusCode": status_code, "headers": headers, "body": body}
+
+    if "ETag" in headers and not headers["ETag"].startswith("W/"):
+        # Same content, different bytes: the validator becomes weak
+        headers["ETag"] = "W/" + headers["ETag"]
+    return {
+        "statusCode": status_code,
+        "headers": headers | {"Content-Encoding": "gzip"},
+        "body": gzipped or compress(body),
+        "isBase64Encoded": True,
+    }
@@ -0,0 +1,170 @@
+import os
+import config_cache
+import jvm_flags
+import launch_templates
+
+# Instance bootstrap shared by turnOnServer and the warm pool (poolManager).
+# base_user_data prepares a machine (deps, EFS, agent, minecraft@ unit);
+# server_user_data attaches it to one server folder and starts it, either at
+# the end of the user data or later over SSM for a pooled instance.
+# ENV: REGION, EFS_ID, SECURITY_GROUP_ID, SUBNET_ID, METRICS_LAMBDA, SHUTDOWN_MODE
+
+AGENT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mc_agent.py")
+_agent_source = None
+
+
+def get_agent_source():
+    global _agent_source
+    if _agent_source is None:
+        with open(AGENT_PATH) as f:
+            _agent_source = f.read().rstrip("\n")
+    return _agent_source
+
+
+def base_user_data(install, efs_id):
+    """Dependencies, EFS mount, metrics agent and the minecraft@ unit; nothing server specific."""
+    return f"""#!/bin/bash
+set -exo pipefail
+
+# Install dependencies (empty when launching from a pre-baked template)
+{install}
+
+# Mount EFS, also on every later boot (stop/start)
+mkdir -p /mnt/efs
+grep -q "{efs_id}:/ /mnt/efs" /etc/fstab || echo "{efs_id}:/ /mnt/efs efs _netdev,tls 0 0" >> /etc/fstab
+mount /mnt/efs || mount -t efs -o tls {efs_id}:/ /mnt/efs/
+
+# Credits are billed by the global billingSweep, no per-instance reporting needed
+
+cat <<'AGENT' > /usr/local/bin/mc-agent.py
+{get_agent_source()}
+AGENT
+
+cat <<'EOF' > /etc/systemd/system/mc-agent.service
+[Unit]
+Description=Minecraft metrics agent
+After=network-online.target
+
+[Service]
+EnvironmentFile=/etc/mc-agent.env
+ExecStart=/usr/bin/python3 /usr/local/bin/mc-agent.py
+Restart=always
+RestartSec=15
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
+# One unit per server folder; ExecStop saves and stops the world over RCON,
+# so stopping or terminating the instance never cuts a save short
+mkdir -p /etc/minecraft
+cat <<'EOF' > /etc/systemd/system/minecraft@.service
+[Unit]
+Description=Minecraft server %i
+After=network-online.target
+RequiresMountsFor=/mnt/efs
+
+[Service]
+User=ec2-user
+WorkingDirectory=/mnt/efs/%i
+EnvironmentFile=/etc/mc-agent.env
+EnvironmentFile=/etc/minecraft/%i.env
+ExecStartPre=+/bin/bash -c 'chmod -R 777 /mnt/efs/%i || true; rm -f /mnt/efs/%i/world/session.lock'
+ExecStart=/usr/bin/java $JAVA_FLAGS -jar server.jar nogui
+ExecStop=/usr/bin/python3 /usr/local/bin/mc-agent.py stop $MAINPID
+TimeoutStopSec=90
+Restart=on-failure
+
+[Install]
+WantedBy=multi-user.target
+EOF
+systemctl daemon-reload
+"""
+
+
+def server_user_data(user_email, serverUUID, server_type, server_flags):
+    """Attach this instance to one server folder and start it."""
+    return f"""
+cd /mnt/efs/{serverUUID}
+
+# --- Metrics agent (TPS/players over local RCON, heap, CPU, disk) ---
+RCON_PASSWORD=$(openssl rand -hex 16)
+touch server.properties
+sed -i '/^enable-rcon=/d;/^rcon\\.port=/d;/^rcon\\.password=/d' server.properties
+printf 'enable-rcon=true\\nrcon.port=25575\\nrcon.password=%s\\n' "$RCON_PASSWORD" >> server.properties
+
+cat <<EOF > /etc/mc-agent.env
+OWNER={user_email}
+SERVER_UUID={serverUUID}
+INSTANCE_TYPE={server_type}
+METRICS_LAMBDA={os.environ['METRICS_LAMBDA']}
+RCON_PORT=25575
+RCON_PASSWORD=$RCON_PASSWORD
+AWS_DEFAULT_REGION={os.environ['REGION']}
+EOF
+chmod 600 /etc/mc-agent.env
+
+echo 'JAVA_FLAGS={server_flags}' > /etc/minecraft/{serverUUID}.env
+
+# Start as ec2-user (not root)
+systemctl enable --now mc-agent.service "minecraft@{serverUUID}.service"
+"""
+
+
+def instance_params(server_type, java, user_data, tags, count=1):
+    """run_instances arguments for a server instance: network, image/template, hibernation."""
+    template = launch_templates.get_launch_template(os.environ["REGION"], java)
+
+    params = {
+        'InstanceType': server_type,
+        'MinCount': 1,
+        'MaxCount': count,
+        'NetworkInterfaces': [{
+            'SubnetId': os.getenv("SUBNET_ID"),
+            'DeviceIndex': 0,
+            'AssociatePublicIpAddress': True,
+            'Groups': [os.getenv('SECURITY_GROUP_ID')]
+        }],
+        'UserData': user_data,
+        'TagSpecifications': [
+        {
+            'ResourceType': 'instance',
+            'Tags': [{'Key': k, 'Value': v} for k, v in tags.items()]
+        }
+        ]
+    }
+
+    # Pre-baked launch template if registered, otherwise latest AL2023 + installs at boot
+    if template:
+        params['LaunchTemplate'] = {
+            'LaunchTemplateId': template['id'],
+            'Version': template['version']
+        }
+    else:
+        params['ImageId'] = get_latest_ami()
+        params['IamInstanceProfile'] = {'Name': "EC2ServerInstanceProfile"}
+
+    if os.environ.get("SHUTDOWN_MODE") == "hibernate":
+        # Hibernation needs an encrypted root volume large enough to hold RAM
+        memory_mb, _ = jvm_flags.instance_shape(server_type)
+        params['HibernationOptions'] = {'Configured': True}
+        params['BlockDeviceMappings'] = [{
+            'DeviceName': '/dev/xvda',
+            'Ebs': {'Encrypted': True, 'VolumeSize': max(16, memory_mb // 1024 + 8), 'VolumeType': 'gp3'}
+        }]
+
+    return params
+
+
+def install_for(java):
+    """Install commands for user data: none when a template for this Java is registered."""
+    template = launch_templates.get_launch_template(os.environ["REGION"], java)
+    return "" if template else launch_templates.install_commands(java)
+
+
+def get_latest_ami():
+    # AWS publishes a parameter for the latest Amazon Linux 2023 AMI
+    return config_cache.get_parameter(
+        "/aws/service/ami-amazon-linux-latest/al2023-ami-kernel-default-x86_64",
+        region=os.environ["REGION"]
+    )
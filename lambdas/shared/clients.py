@@ -0,0 +1,41 @@
+import os
+import threading
+import boto3
+import instrumentation
+
+# Lazy, per-container boto3 clients and resources.
+# Nothing is built at import time; each (service, region) pair is created on
+# first use and reused for the rest of the container's life. Every client is
+# instrumented so its API calls show up in the handler's timings.
+
+_clients = {}
+_resources = {}
+_lock = threading.Lock()
+
+
+def _default_region():
+    return os.environ.get("REGION") or os.environ.get("GLOBAL_REGION")
+
+
+def client(service, region=None, endpoint_url=None):
+    # endpoint_url: for APIs addressed per resource (apigatewaymanagementapi)
+    key = (service, region or _default_region()) + ((endpoint_url,) if endpoint_url else ())
+    if key not in _clients:
+        # boto3's default session is not thread-safe to build clients from
+        with _lock:
+            if key not in _clients:
+                _clients[key] = instrumentation.instrument(
+                    boto3.client(service, region_name=key[1], endpoint_url=endpoint_url)
+                )
+    return _clients[key]
+
+
+def resource(service, region=None):
+    key = (service, region or _default_region())
+    if key not in _resources:
+        with _lock:
+            if key not in _resources:
+                res = boto3.resource(service, region_name=key[1])
+                instrumentation.instrument(res.meta.client)
+                _resources[key] = res
+    return _resources[key]
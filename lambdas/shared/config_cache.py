@@ -0,0 +1,98 @@
+import os
+import time
+import clients
+
+# Shared warm-container cache for SSM parameters and the GLOBAL#RESOURCES item.
+# Everything lives at module level so it survives across warm invocations.
+# ENV: GLOBAL_REGION (regional stacks) or REGION (global stack), TABLE_NAME (optional),
+#      CONFIG_TTL_SECONDS (optional, default 300)
+
+CONFIG_TTL = int(os.environ.get("CONFIG_TTL_SECONDS", "300"))
+TABLE_NAME_PARAM = "/global/dynamo/table-name"
+RESOURCES_KEY = {"PK": "GLOBAL", "SK": "RESOURCES"}
+
+_params = {}
+_tables = {}
+_resources = None
+_resources_expires_at = 0
+
+
+def global_region():
+    return os.environ.get("GLOBAL_REGION") or os.environ["REGION"]
+
+
+def get_parameter(name, region=None):
+    """Return an SSM parameter value, cached for CONFIG_TTL seconds."""
+    region = region or global_region()
+    key = (region, name)
+    cached = _params.get(key)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    value = clients.client("ssm", region).get_parameter(Name=name)["Parameter"]["Value"]
+    _params[key] = (value, time.monotonic() + CONFIG_TTL)
+    return value
+
+
+def get_table():
+    """Return the global app table, resolving its name from env or SSM once per container."""
+    table_name = os.environ.get("TABLE_NAME") or get_parameter(TABLE_NAME_PARAM)
+    if table_name not in _tables:
+        _tables[table_name] = clients.resource("dynamodb", global_region()).Table(table_name)
+    return _tables[table_name]
+
+
+class Resources:
+    """GLOBAL#RESOURCES item with id-keyed indexes for types, versions and regions."""
+
+    def __init__(self, item):
+        self.item = item
+        self.version = item.get("version")
+        self.types = {t.get("id"): t for t in item.get("types", [])}
+        self.versions = {v.get("id"): v for v in item.get("versions", [])}
+        self.regions = {r.get("id"): r for r in item.get("regions", [])}
+
+    def type_name(self, type_id):
+        return self.types.get(type_id, {}).get("name", type_id)
+
+    def region_name(self, region_id):
+        return self.regions.get(region_id, {}).get("name", region_id)
+
+
+def get_resources(force=False):
+    """
+    Return the cached Resources, or None if the item does not exist.
+    Once the TTL expires only the item's version is read back; the full item
+    is fetched again when the version changed (or the item has no version).
+    """
+    global _resources, _resources_expires_at
+
+    now = time.monotonic()
+    if not force and _resources is not None and _resources_expires_at > now:
+        return _resources
+
+    table = get_table()
+    if not force and _resources is not None and _resources.version is not None:
+        current = table.get_item(
+            Key=RESOURCES_KEY,
+            ProjectionExpression="#v",
+            ExpressionAttributeNames={"#v": "version"},
+        ).get("Item") or {}
+        if current.get("version") == _resources.version:
+            _resources_expires_at = now + CONFIG_TTL
+            return _resources
+
+    item = table.get_item(Key=RESOURCES_KEY).get("Item")
+    if not item:
+        invalidate_resources()
+        return None
+
+    _resources = Resources(item)
+    _resources_expires_at = now + CONFIG_TTL
+    return _resources
+
+
+def invalidate_resources():
+    global _resources, _resources_expires_at
+    _resources = None
+    _resources_expires_at = 0
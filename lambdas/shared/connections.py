@@ -0,0 +1,53 @@
+import os
+import time
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+# WebSocket connection registry in the App table:
+#   PK WS#<owner>          SK <connectionId>   ConnectedAt       owner -> connections (fan-out)
+#   PK WSCONN#<connectionId>  SK CONNECTION    Owner             connection -> owner ($disconnect)
+# API Gateway closes WebSocket connections after 2 hours, so both items expire
+# shortly after that even if $disconnect never ran. Connections that went away
+# unnoticed are removed when a push to them fails with GoneException.
+# ENV: CONNECTION_TTL_SECONDS (optional, default 3 hours)
+
+CONNECTION_TTL_SECONDS = int(os.environ.get("CONNECTION_TTL_SECONDS", str(3 * 3600)))
+
+
+def register(table, owner, connection_id):
+    now = int(time.time())
+    expires = now + CONNECTION_TTL_SECONDS
+    table.put_item(Item={"PK": f"WS#{owner}", "SK": connection_id, "ConnectedAt": now, "ttl": expires})
+    table.put_item(Item={"PK": f"WSCONN#{connection_id}", "SK": "CONNECTION", "Owner": owner, "ttl": expires})
+
+
+def unregister(table, connection_id, owner=None):
+    """Drop a connection; the owner is looked up when the caller does not know it."""
+    key = {"PK": f"WSCONN#{connection_id}", "SK": "CONNECTION"}
+    if owner is None:
+        owner = (table.get_item(Key=key).get("Item") or {}).get("Owner")
+    table.delete_item(Key=key)
+    if owner:
+        table.delete_item(Key={"PK": f"WS#{owner}", "SK": connection_id})
+
+
+def for_owner(table, owner):
+    """Live connection ids of an owner."""
+    now = int(time.time())
+    items = table.query(KeyConditionExpression=Key("PK").eq(f"WS#{owner}")).get("Items", [])
+    # TTL deletion lags, so expired items can still be returned
+    return [item["SK"] for item in items if item.get("ttl", now + 1) > now]
+
+
+def post(api, connection_id, data):
+    """
+    Send `data` (bytes) to one connection. Returns False when the connection is
+    gone and should be unregistered; other errors are logged and count as sent.
+    """
+    try:
+        api.post_to_connection(ConnectionId=connection_id, Data=data)
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "GoneException":
+            return False
+        print(f"Error posting to {connection_id}: {e}")
+    return True
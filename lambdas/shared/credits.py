@@ -0,0 +1,73 @@
+from botocore.exceptions import ClientError
+
+# Atomic credit decrement on USERS#<owner> / PROFILE.
+# The common case is a single conditional UpdateItem; only an account that
+# cannot cover the full deduction needs a second write to floor it at zero.
+
+MAX_ATTEMPTS = 3
+
+
+class CreditsContention(Exception):
+    """The profile kept changing under us (top-ups racing the deduction); retry later."""
+
+
+def _conditional_failed(e):
+    return e.response["Error"]["Code"] == "ConditionalCheckFailedException"
+
+
+def deduct_credits(table, owner, deduction):
+    """
+    Subtract `deduction` credits from the owner's profile, flooring at zero.
+    A profile without a Credits attribute counts as 0.
+    Returns a dict with name, oldCredits, deducted, newCredits and depleted,
+    or None if the profile does not exist. Raises CreditsContention when
+    MAX_ATTEMPTS rounds all lost a race.
+    """
+    key = {"PK": f"USERS#{owner}", "SK": "PROFILE"}
+
+    for _ in range(MAX_ATTEMPTS):
+        try:
+            item = table.update_item(
+                Key=key,
+                UpdateExpression="SET Credits = Credits - :d",
+                ConditionExpression="attribute_exists(PK) AND Credits >= :d",
+                ExpressionAttributeValues={":d": deduction},
+                ReturnValues="ALL_NEW",
+            )["Attributes"]
+            return {
+                "name": item.get("Name", ""),
+                "oldCredits": item["Credits"] + deduction,
+                "deducted": deduction,
+                "newCredits": item["Credits"],
+                "depleted": item["Credits"] <= 0,
+            }
+        except ClientError as e:
+            if not _conditional_failed(e):
+                raise
+
+        # Not enough credits (or none recorded): floor at zero. Fails if the
+        # profile is missing or a top-up landed in between; only the latter is retried.
+        try:
+            item = table.update_item(
+                Key=key,
+                UpdateExpression="SET Credits = :zero",
+                ConditionExpression="attribute_exists(PK) AND (attribute_not_exists(Credits) OR Credits < :d)",
+                ExpressionAttributeValues={":zero": 0, ":d": deduction},
+                ReturnValues="ALL_OLD",
+                ReturnValuesOnConditionCheckFailure="ALL_OLD",
+            )["Attributes"]
+            old_credits = item.get("Credits", 0)
+            return {
+                "name": item.get("Name", ""),
+                "oldCredits": old_credits,
+                "deducted": old_credits,
+                "newCredits": 0,
+                "depleted": True,
+            }
+        except ClientError as e:
+            if not _conditional_failed(e):
+                raise
+            if not e.response.get("Item"):
+                return None
+
+    raise CreditsContention(f"Credits of {owner} changed during {MAX_ATTEMPTS} attempts")
@@ -0,0 +1,78 @@
+import os
+import json
+import clients
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+
+# Operations that reach a server mid-transition. operationSwitch dispatches
+# asynchronously, so a 409 from a handler would be lost; instead the handler
+# records what the owner asked for on the SERVER item:
+#   DesiredState  RUNNING | OFFLINE | DELETED   (the last request wins)
+#   DesiredAt     ISO time it was recorded
+# Whatever write ends the transition removes it (ReturnValues ALL_OLD) and
+# calls honour(), which invokes the handler that moves the server on. A write
+# that starts a new transition removes it too: that operation is newer.
+# ENV: REGION
+
+TRANSITIONS = ("CREATING", "STARTING", "PENDING", "STOPPING")
+
+HANDLERS = {
+    "RUNNING": "turnOnServer",
+    "OFFLINE": "turnOffServer",
+    "DELETED": "deleteServer",
+}
+
+# Statuses that already are (or are on their way to) the desired state
+SATISFIED_BY = {
+    "RUNNING": ("PENDING", "RUNNING"),
+    "OFFLINE": ("OFFLINE",),
+    "DELETED": (),
+}
+
+def record(table, owner, desired):
+    """Remember `desired` for a server in transition. False if it is not in one (anymore)."""
+    try:
+        table.update_item(
+            Key={"PK": f"USERS#{owner}", "SK": "SERVER"},
+            UpdateExpression="SET DesiredState = :desired, DesiredAt = :at",
+            ConditionExpression="#s IN (:creating, :starting, :pending, :stopping)",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues={
+                ":desired": desired,
+                ":at": datetime.now(timezone.utc).isoformat(),
+                ":creating": "CREATING",
+                ":starting": "STARTING",
+                ":pending": "PENDING",
+                ":stopping": "STOPPING"
+            }
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return False
+    print(f"Server for {owner} is in transition, recorded desired state {desired}")
+    return True
+
+
+def honour(previous, owner, status):
+    """
+    After a transition ended in `status`: if the replaced item (`previous`) carried
+    a DesiredState that `status` does not satisfy, invoke the handler for it.
+    Returns the invoked function name, or None.
+    """
+    desired = (previous or {}).get("DesiredState")
+    if not desired or status in SATISFIED_BY.get(desired, ()):
+        return None
+
+    function_name = f"{HANDLERS[desired]}-{os.environ['REGION']}"
+    try:
+        clients.client("lambda").invoke(
+            FunctionName=function_name,
+            InvocationType="Event",
+            Payload=json.dumps({"owner": owner})
+        )
+    except ClientError as e:
+        print(f"Error invoking {function_name} for desired state {desired} of {owner}: {e}")
+        return None
+    print(f"Server for {owner} is {status}, moving on to desired state {desired} via {function_name}")
+    return function_name
@@ -0,0 +1,43 @@
+# Helpers for API Gateway (payload format 1.0) events
+
+
+def get_header(event, name):
+    """Case-insensitive request header lookup."""
+    name = name.lower()
+    for key, value in (event.get("headers") or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _opaque(tag):
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def etag_matches(event, etag):
+    """True when the client's If-None-Match covers `etag` (weak comparison, so a
+    gzipped response's W/ tag matches its plain one)."""
+    header = get_header(event, "If-None-Match")
+    if not header:
+        return False
+    return header.strip() == "*" or _opaque(etag) in [_opaque(tag) for tag in header.split(",")]
+
+
+def accepts_encoding(event, coding):
+    """True when Accept-Encoding lists `coding` (or *) without q=0."""
+    header = get_header(event, "Accept-Encoding")
+    if not header:
+        return False
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        if name.strip().lower() not in (coding, "*"):
+            continue
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
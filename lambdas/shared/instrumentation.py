@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import time
+import functools
+import threading
+from contextlib import contextmanager
+
+# Per-invocation timings, emitted as CloudWatch Embedded Metric Format (EMF) lines.
+#   - every AWS API call made through `clients` is timed by service and operation
+#     (botocore before-call/after-call events, retries included)
+#   - handlers mark named steps:  with instrumentation.step("run_instances"): ...
+#   - @instrumentation.handler resets the state per invocation and, on the way out,
+#     prints one line per API operation, one per step and a summary line.
+# Nothing is sent anywhere: Lambda ships stdout to CloudWatch Logs, which extracts the
+# metrics. Locally, `with instrumentation.capture() as records:` collects them instead.
+# ENV: METRICS_NAMESPACE (optional, default MineHosting), EMF_ENABLED (optional, "0" disables output)
+
+NAMESPACE = os.environ.get("METRICS_NAMESPACE", "MineHosting")
+ENABLED = os.environ.get("EMF_ENABLED", "1") != "0"
+START_KEY = "instrumentation_start"
+OPERATION_KEY = "instrumentation_operation"
+
+_lock = threading.Lock()
+_calls = {}   # (service, operation) -> [latencies ms], errors counted separately
+_errors = {}
+_steps = []   # (name, ms) in completion order
+_cold = True
+_sink = None
+_listeners = []  # fn(service, operation, ms, error) for every call, across invocations
+
+
+def instrument(client):
+    """Time every API call of a boto3 client. Safe to call once per client."""
+    events = client.meta.events
+    events.register("before-call.*.*", _before_call, unique_id="instrumentation-before")
+    events.register("after-call.*.*", _after_call, unique_id="instrumentation-after")
+    events.register("after-call-error.*.*", _after_call_error, unique_id="instrumentation-error")
+    return client
+
+
+def _before_call(model, context, **kwargs):
+    # after-call-error gets no model, so the key travels in the request context
+    context[OPERATION_KEY] = (model.service_model.service_id.hyphenize(), model.name)
+    context[START_KEY] = time.perf_counter()
+
+
+def _record(context, error):
+    started = context.pop(START_KEY, None)
+    key = context.pop(OPERATION_KEY, None)
+    if started is None or key is None:
+        return
+    elapsed = (time.perf_counter() - started) * 1000
+    with _lock:
+        _calls.setdefault(key, []).append(elapsed)
+        if error:
+            _errors[key] = _errors.get(key, 0) + 1
+    for listener in _listeners:
+        listener(key[0], key[1], elapsed, error)
+
+
+def add_listener(fn):
+    """Also report every API call to fn(service, operation, ms, error), e.g. for load tests."""
+    _listeners.append(fn)
+
+
+def _after_call(http_response, context, **kwargs):
+    _record(context, http_response.status_code >= 300)
+
+
+def _after_call_error(context, exception=None, **kwargs):
+    # Transport failures (connection errors, read timeouts); the caller still gets the exception
+    _record(context, True)
+
+
+@contextmanager
+def step(name):
+    """Time a named step of the handler. Steps may nest and run in threads."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - started) * 1000
+        with _lock:
+            _steps.append((name, elapsed))
+
+
+def handler(fn):
+    """Decorator for lambda_handler: one set of EMF lines per invocation."""
+    @functools.wraps(fn)
+    def wrapper(event, context):
+        global _cold
+        reset()
+        cold, _cold = _cold, False
+        started = time.perf_counter()
+        failed = False
+        try:
+            return fn(event, context)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            function_name = getattr(context, "function_name", None) \
+                or os.environ.get("AWS_LAMBDA_FUNCTION_NAME") or fn.__module__
+            flush(function_name, (time.perf_counter() - started) * 1000, cold, failed)
+    return wrapper
+
+
+def reset():
+    with _lock:
+        _calls.clear()
+        _errors.clear()
+        _steps.clear()
+
+
+def summary():
+    """Current invocation's timings: {"calls": {"service.Operation": {...}}, "steps": {...}}."""
+    with _lock:
+        calls = {
+            f"{service}.{operation}": {
+                "count": len(latencies),
+                "totalMs": round(sum(latencies), 2),
+                "maxMs": round(max(latencies), 2),
+                "errors": _errors.get((service, operation), 0)
+            }
+            for (service, operation), latencies in _calls.items()
+        }
+        steps = {}
+        for name, elapsed in _steps:
+            steps[name] = round(steps.get(name, 0) + elapsed, 2)
+    return {"calls": calls, "steps": steps}
+
+
+def flush(function_name, duration_ms, cold=False, failed=False):
+    if not ENABLED:
+        return
+    timestamp = int(time.time() * 1000)
+
+    with _lock:
+        calls = {key: list(latencies) for key, latencies in _calls.items()}
+        errors = dict(_errors)
+        steps = list(_steps)
+
+    for (service, operation), latencies in calls.items():
+        _emit(timestamp, [["Function", "Service", "Operation"], ["Service", "Operation"]], {
+            "Function": function_name,
+            "Service": service,
+            "Operation": operation,
+            # EMF accepts up to 100 values per metric
+            "AwsCallLatency": [round(ms, 2) for ms in latencies[:100]],
+            "AwsCallErrors": errors.get((service, operation), 0)
+        }, {"AwsCallLatency": "Milliseconds", "AwsCallErrors": "Count"})
+
+    step_times = {}
+    for name, elapsed in steps:
+        step_times.setdefault(name, []).append(round(elapsed, 2))
+    for name, values in step_times.items():
+        _emit(timestamp, [["Function", "Step"]], {
+            "Function": function_name,
+            "Step": name,
+            "StepDuration": values[:100]
+        }, {"StepDuration": "Milliseconds"})
+
+    aws_ms = sum(sum(latencies) for latencies in calls.values())
+    _emit(timestamp, [["Function"]], {
+        "Function": function_name,
+        "InvocationDuration": round(duration_ms, 2),
+        "AwsCallTime": round(aws_ms, 2),
+        "AwsCalls": sum(len(latencies) for latencies in calls.values()),
+        "ColdStart": int(cold),
+        "Failed": int(failed),
+        # Not metrics, just searchable in Logs Insights
+        "steps": {name: round(sum(values), 2) for name, values in step_times.items()},
+        "calls": {f"{s}.{o}": round(sum(l), 2) for (s, o), l in calls.items()}
+    }, {"InvocationDuration": "Milliseconds", "AwsCallTime": "Milliseconds", "AwsCalls": "Count",
+        "ColdStart": "Count", "Failed": "Count"})
+
+
+def _emit(timestamp, dimensions, values, units):
+    record = {
+        "_aws": {
+            "Timestamp": timestamp,
+            "CloudWatchMetrics": [{
+                "Namespace": NAMESPACE,
+                "Dimensions": dimensions,
+                "Metrics": [{"Name": name, "Unit": unit} for name, unit in units.items()]
+            }]
+        },
+        **values
+    }
+    if _sink is not None:
+        _sink.append(record)
+    else:
+        sys.stdout.write(json.dumps(record) + "\n")
+
+
+@contextmanager
+def capture():
+    """Collect EMF records in a list instead of printing them (local runs, benchmarks)."""
+    global _sink
+    previous, _sink = _sink, []
+    try:
+        yield _sink
+    finally:
+        _sink = previous
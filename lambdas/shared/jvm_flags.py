@@ -0,0 +1,151 @@
+import time
+import clients
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+# JVM flags derived from the instance type's memory and vCPUs instead of the
+# static `serverFlags` string. Starts from the well-known G1 tuning set for
+# Minecraft servers, sizes the heap to what the instance can actually spare,
+# optionally adjusts for observed lag / heap pressure (METRICS#<owner> rollups)
+# and finally applies the type's `jvmOverrides` from GLOBAL#RESOURCES, e.g.
+#   {"Xmx": "3G", "MaxGCPauseMillis": 150, "AlwaysPreTouch": false, "-Dfile.encoding": "UTF-8"}
+# A null value drops a flag.
+
+MIN_HEAP_MB = 512
+OS_RESERVE_MB = 768
+OS_RESERVE_RATIO = 0.2
+HISTORY_HOURS = 24
+
+# Used when describe_instance_types is unavailable
+KNOWN_SHAPES = {
+    "t2.small": (2048, 1),
+    "t2.medium": (4096, 2),
+    "t2.large": (8192, 2),
+    "t3.small": (2048, 2),
+    "t3.medium": (4096, 2),
+    "t3.large": (8192, 2),
+}
+
+_shapes = {}
+
+
+def instance_shape(instance_type):
+    """(memory MiB, vCPUs) for an instance type, cached per container."""
+    if instance_type not in _shapes:
+        try:
+            info = clients.client("ec2").describe_instance_types(InstanceTypes=[instance_type])["InstanceTypes"][0]
+            _shapes[instance_type] = (info["MemoryInfo"]["SizeInMiB"], info["VCpuInfo"]["DefaultVCpus"])
+        except (ClientError, IndexError, KeyError) as e:
+            print(f"Could not describe {instance_type}: {e}")
+            return KNOWN_SHAPES.get(instance_type, (2048, 1))
+    return _shapes[instance_type]
+
+
+def heap_mb(memory_mb):
+    """Leave room for the OS, metaspace, thread stacks and direct buffers."""
+    reserve = max(OS_RESERVE_MB, int(memory_mb * OS_RESERVE_RATIO))
+    return max(MIN_HEAP_MB, (memory_mb - reserve) // 256 * 256)
+
+
+def base_flags(memory_mb, vcpus):
+    heap = heap_mb(memory_mb)
+    large = heap >= 12 * 1024
+
+    return {
+        "Xms": f"{heap}M",
+        "Xmx": f"{heap}M",
+        "UseG1GC": True,
+        "ParallelRefProcEnabled": True,
+        "MaxGCPauseMillis": 200,
+        # Has to precede the experimental G1 options below
+        "UnlockExperimentalVMOptions": True,
+        "DisableExplicitGC": True,
+        "AlwaysPreTouch": True,
+        "G1NewSizePercent": 40 if large else 30,
+        "G1MaxNewSizePercent": 50 if large else 40,
+        "G1HeapRegionSize": "16M" if large else "8M",
+        "G1ReservePercent": 15 if large else 20,
+        "G1HeapWastePercent": 5,
+        "G1MixedGCCountTarget": 4,
+        "InitiatingHeapOccupancyPercent": 20 if large else 15,
+        "G1MixedGCLiveThresholdPercent": 90,
+        "G1RSetUpdatingPauseTimePercent": 5,
+        "SurvivorRatio": 32,
+        "PerfDisableSharedMem": True,
+        "MaxTenuringThreshold": 1,
+        "ParallelGCThreads": max(1, vcpus),
+        "ConcGCThreads": max(1, vcpus // 4),
+    }
+
+
+def observed(table, owner, hours=HISTORY_HOURS):
+    """Summarize the owner's recent metrics rollups, or None without history."""
+    since = time.strftime("HOUR#%Y-%m-%dT%H", time.gmtime(time.time() - hours * 3600))
+    try:
+        items = table.query(
+            KeyConditionExpression=Key("PK").eq(f"METRICS#{owner}") & Key("SK").between(since, "HOUR#~")
+        ).get("Items", [])
+    except ClientError as e:
+        print(f"Could not read metrics for {owner}: {e}")
+        return None
+
+    minutes = [v for item in items for k, v in item.items() if k.startswith("m") and k[1:].isdigit()]
+    if not minutes:
+        return None
+
+    tps_count = sum(item.get("tps_count", 0) for item in items)
+    return {
+        "tps_avg": float(sum(item.get("tps_sum", 0) for item in items) / tps_count) if tps_count else None,
+        "tps_min": min((float(m["tps_min"]) for m in minutes if "tps_min" in m), default=None),
+        "heap_max_mb": max((float(m["heapUsedMB_max"]) for m in minutes if "heapUsedMB_max" in m), default=None),
+        "heap_committed_mb": max((float(m["heapCommittedMB"]) for m in minutes if "heapCommittedMB" in m), default=None),
+    }
+
+
+def adjust(flags, history):
+    """Tune the G1 set from what the server actually did last time."""
+    if not history:
+        return flags
+
+    # Short, deep TPS drops on an otherwise healthy server point at GC pauses
+    if history["tps_min"] is not None and history["tps_min"] < 15 and (history["tps_avg"] or 0) >= 18:
+        flags["MaxGCPauseMillis"] = 100
+
+    # Old gen close to full: start concurrent marking earlier
+    if history["heap_max_mb"] and history["heap_committed_mb"] and history["heap_max_mb"] >= 0.9 * history["heap_committed_mb"]:
+        flags["InitiatingHeapOccupancyPercent"] = 10
+        flags["G1ReservePercent"] = max(flags["G1ReservePercent"], 25)
+
+    return flags
+
+
+def render(flags):
+    parts = []
+    for name, value in flags.items():
+        if value is None:
+            continue
+        if name in ("Xms", "Xmx", "Xss"):
+            parts.append(f"-{name}{value}")
+        elif name.startswith("-D"):
+            parts.append(f"{name}={value}")
+        elif value is True:
+            parts.append(f"-XX:+{name}")
+        elif value is False:
+            parts.append(f"-XX:-{name}")
+        else:
+            parts.append(f"-XX:{name}={value}")
+    return " ".join(parts)
+
+
+def build_flags(instance_type, resources=None, table=None, owner=None):
+    """JVM flags string for launching a server of `instance_type`."""
+    memory_mb, vcpus = instance_shape(instance_type)
+    flags = base_flags(memory_mb, vcpus)
+
+    if table is not None and owner:
+        flags = adjust(flags, observed(table, owner))
+
+    type_entry = resources.types.get(instance_type, {}) if resources else {}
+    flags.update(type_entry.get("jvmOverrides") or {})
+
+    return render(flags)
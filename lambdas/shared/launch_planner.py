@@ -0,0 +1,160 @@
+import os
+import time
+import random
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+import clients
+
+# Capacity-aware run_instances for server launches.
+# Candidates are (instance type, subnet) pairs: the configured type and its
+# equivalents (same size in a sibling family, newest first) in the first subnet,
+# then the same types in each other subnet/AZ. Capacity errors move on to the next
+# candidate, throttling retries the same one with jittered backoff, anything else
+# is raised. Capacity failures are remembered per region in the App table so other
+# starts skip them for a while:
+#   PK CAPACITY#<region>
+#     SK <type>#<subnet>   FailedUntil (epoch), Code; expires with ttl
+# ENV: REGION, SUBNET_IDS (comma separated, falls back to SUBNET_ID),
+#      CAPACITY_MEMORY_MINUTES (optional, default 10)
+
+CAPACITY_MEMORY_MINUTES = int(os.environ.get("CAPACITY_MEMORY_MINUTES", "10"))
+THROTTLE_ATTEMPTS = 4
+BACKOFF_BASE_SECONDS = 0.25
+BACKOFF_CAP_SECONDS = 4
+
+# Same vCPU/memory at each size, newest first
+EQUIVALENT_FAMILIES = [
+    ("t3", "t3a", "t2"),
+    ("m7i", "m6i", "m6a", "m5", "m5a"),
+    ("c7i", "c6i", "c6a", "c5", "c5a"),
+    ("r7i", "r6i", "r6a", "r5", "r5a"),
+]
+
+# No capacity for this candidate right now: try the next one
+CAPACITY_ERRORS = {"InsufficientInstanceCapacity", "InsufficientHostCapacity", "InsufficientCapacity", "Unsupported"}
+# The subnet itself is the problem: skip the rest of its types
+SUBNET_ERRORS = {"InsufficientFreeAddressesInSubnet"}
+THROTTLE_ERRORS = {"RequestLimitExceeded", "Throttling", "ThrottlingException", "RequestThrottled"}
+
+
+def subnets():
+    ids = os.environ.get("SUBNET_IDS") or os.environ.get("SUBNET_ID") or ""
+    return [s.strip() for s in ids.split(",") if s.strip()]
+
+
+def equivalent_types(server_type, resources=None):
+    """
+    `server_type` followed by the types that can stand in for it. A catalog
+    type's `fallbackTypes` list wins over the family table.
+    """
+    if resources and server_type in resources.types and "fallbackTypes" in resources.types[server_type]:
+        fallbacks = list(resources.types[server_type]["fallbackTypes"])
+    else:
+        family, _, size = server_type.partition(".")
+        siblings = next((f for f in EQUIVALENT_FAMILIES if family in f), ())
+        fallbacks = [f"{sibling}.{size}" for sibling in siblings]
+    return [server_type] + [t for t in fallbacks if t != server_type]
+
+
+def _memory_key(region):
+    return f"CAPACITY#{region}"
+
+
+def recent_failures(table, region):
+    """{(type, subnet)} that failed for capacity within CAPACITY_MEMORY_MINUTES."""
+    now = int(time.time())
+    items = table.query(KeyConditionExpression=Key("PK").eq(_memory_key(region))).get("Items", [])
+    return {tuple(item["SK"].split("#", 1)) for item in items if item.get("FailedUntil", 0) > now}
+
+
+def remember_failure(table, region, instance_type, subnet, code):
+    until = int(time.time()) + CAPACITY_MEMORY_MINUTES * 60
+    try:
+        table.put_item(Item={
+            "PK": _memory_key(region),
+            "SK": f"{instance_type}#{subnet}",
+            "FailedUntil": until,
+            "Code": code,
+            "ttl": until + 3600,
+        })
+    except ClientError as e:
+        print(f"Could not record capacity failure for {instance_type} in {subnet}: {e}")
+
+
+def forget_failure(table, region, instance_type, subnet):
+    try:
+        table.delete_item(Key={"PK": _memory_key(region), "SK": f"{instance_type}#{subnet}"})
+    except ClientError as e:
+        print(f"Could not clear capacity failure for {instance_type} in {subnet}: {e}")
+
+
+def candidates(types, subnet_ids, failed):
+    """Launch order: types within a subnet, subnets in order; remembered failures go last."""
+    ordered = [(t, s) for s in subnet_ids for t in types]
+    return [c for c in ordered if c not in failed] + [c for c in ordered if c in failed]
+
+
+def _with_candidate(params, instance_type, subnet):
+    params = dict(params, InstanceType=instance_type)
+    if subnet and params.get("NetworkInterfaces"):
+        params["NetworkInterfaces"] = [dict(params["NetworkInterfaces"][0], SubnetId=subnet)] + params["NetworkInterfaces"][1:]
+    return params
+
+
+def _run(ec2, params):
+    """run_instances, retrying throttling with full-jitter exponential backoff."""
+    for attempt in range(THROTTLE_ATTEMPTS):
+        try:
+            return ec2.run_instances(**params)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in THROTTLE_ERRORS or attempt == THROTTLE_ATTEMPTS - 1:
+                raise
+            delay = random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+            print(f"run_instances throttled, retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+
+def launch(table, params, types):
+    """
+    Launch one instance from `params` on the first candidate with capacity.
+    Returns (run_instances response, {"InstanceType", "SubnetId", "Attempts"}).
+    Raises the last capacity error when every candidate failed.
+    """
+    region = os.environ["REGION"]
+    ec2 = clients.client("ec2")
+
+    try:
+        failed = recent_failures(table, region)
+    except ClientError as e:
+        print(f"Capacity memory unavailable: {e}")
+        failed = set()
+
+    subnet_ids = subnets() or [None]
+    full_subnets = set()
+    last_error = None
+    attempts = 0
+
+    for instance_type, subnet in candidates(types, subnet_ids, failed):
+        if subnet in full_subnets:
+            continue
+        attempts += 1
+        try:
+            response = _run(ec2, _with_candidate(params, instance_type, subnet))
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code in SUBNET_ERRORS:
+                full_subnets.add(subnet)
+            elif code not in CAPACITY_ERRORS:
+                raise
+            print(f"No capacity for {instance_type} in {subnet} ({code}), trying next candidate")
+            remember_failure(table, region, instance_type, subnet, code)
+            last_error = e
+            continue
+
+        if (instance_type, subnet) in failed:
+            forget_failure(table, region, instance_type, subnet)
+        if attempts > 1 or instance_type != types[0]:
+            print(f"Launched {instance_type} in {subnet} after {attempts} attempt(s)")
+        return response, {"InstanceType": instance_type, "SubnetId": subnet, "Attempts": attempts}
+
+    raise last_error
@@ -0,0 +1,47 @@
+import json
+import time
+from botocore.exceptions import ClientError
+import config_cache
+
+# Registry of pre-baked launch templates, one SSM parameter per region and Java version:
+#   /launch-template/<region>/java-<java> = {"id": "lt-...", "version": "3"}
+# The image behind each template already has amazon-efs-utils and the matching
+# Corretto installed, so instances only need the per-server bits at boot.
+# Hits are cached by config_cache; misses are remembered here for MISS_TTL seconds.
+
+DEFAULT_JAVA = "21"
+MISS_TTL = 300
+
+_misses = {}
+
+
+def java_for_version(resources, mc_version):
+    """Java major version for a Minecraft version, from its optional `java` field."""
+    if resources and mc_version in resources.versions:
+        return str(resources.versions[mc_version].get("java", DEFAULT_JAVA))
+    return DEFAULT_JAVA
+
+
+def get_launch_template(region, java):
+    """Return {"id", "version"} for the region/Java pair, or None to fall back to user-data installs."""
+    name = f"/launch-template/{region}/java-{java}"
+    if _misses.get(name, 0) > time.monotonic():
+        return None
+
+    try:
+        entry = json.loads(config_cache.get_parameter(name, region=region))
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ParameterNotFound":
+            print(f"Error reading launch template registry ({name}): {e}")
+        _misses[name] = time.monotonic() + MISS_TTL
+        return None
+
+    if not entry.get("id"):
+        return None
+    return {"id": entry["id"], "version": str(entry.get("version", "$Default"))}
+
+
+def install_commands(java):
+    """Dependency install for instances not launched from a pre-baked template."""
+    corretto = "java-1.8.0-amazon-corretto" if java == "8" else f"java-{java}-amazon-corretto"
+    return f"dnf install -y amazon-efs-utils {corretto}"
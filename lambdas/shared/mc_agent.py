@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# Metrics agent installed on every server instance (bootstrap.base_user_data).
+# Samples every SAMPLE_SECONDS and sends one batch per minute to ingestMetrics.
+# Uses only the standard library plus the aws cli that ships with AL2023.
+#
+#   mc-agent.py             run the sampling loop
+#   mc-agent.py stop <pid>  save-all + stop over RCON and wait for the server to exit
+#                           (ExecStop of minecraft@.service, so every shutdown is graceful)
+#   mc-agent.py save        save-all flush over RCON, exit 1 if it failed
+#                           (run over SSM by turnOffServer before hibernating, which skips ExecStop)
+#
+# Environment (from /etc/mc-agent.env): OWNER, SERVER_UUID, INSTANCE_TYPE,
+# METRICS_LAMBDA, RCON_PORT, RCON_PASSWORD, AWS_DEFAULT_REGION
+import json
+import os
+import re
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+SAMPLE_SECONDS = 15
+SAMPLES_PER_BATCH = 4
+STOP_WAIT_SECONDS = 80
+FLUSH_TIMEOUT_SECONDS = 60
+DISK_RE = re.compile(r"^(nvme\d+n\d+|xvd[a-z]+|sd[a-z]+)$")
+
+
+def rcon(command, timeout=5):
+    """Minimal Source RCON client for the local Minecraft server."""
+    def packet(req_id, kind, body):
+        data = struct.pack("<ii", req_id, kind) + body.encode() + b"\x00\x00"
+        return struct.pack("<i", len(data)) + data
+
+    def read(sock):
+        length = struct.unpack("<i", sock.recv(4))[0]
+        data = b""
+        while len(data) < length:
+            data += sock.recv(length - len(data))
+        req_id, _ = struct.unpack("<ii", data[:8])
+        return req_id, data[8:-2].decode(errors="replace")
+
+    with socket.create_connection(("127.0.0.1", int(os.environ["RCON_PORT"])), timeout=timeout) as sock:
+        sock.sendall(packet(1, 3, os.environ["RCON_PASSWORD"]))
+        if read(sock)[0] == -1:
+            raise PermissionError("RCON login failed")
+        sock.sendall(packet(2, 2, command))
+        return read(sock)[1]
+
+
+def game_metrics():
+    metrics = {}
+    try:
+        players = re.search(r"There are (\d+)", rcon("list"))
+        if players:
+            metrics["players"] = int(players.group(1))
+        # /tick query exists from 1.20.3 on
+        mspt = re.search(r"Average time per tick: ([\d.]+)ms", rcon("tick query"))
+        if mspt:
+            metrics["mspt"] = float(mspt.group(1))
+            metrics["tps"] = min(20.0, 1000.0 / max(float(mspt.group(1)), 0.001))
+    except (OSError, PermissionError, struct.error):
+        pass
+    return metrics
+
+
+def java_pid():
+    try:
+        return subprocess.check_output(["pgrep", "-f", "server.jar"], text=True).split()[0]
+    except (subprocess.CalledProcessError, IndexError):
+        return None
+
+
+def heap_metrics(pid):
+    if not pid:
+        return {}
+    try:
+        header, values = subprocess.check_output(["jstat", "-gc", pid], text=True).strip().splitlines()[:2]
+        gc = dict(zip(header.split(), (float(v) for v in values.split())))
+        return {
+            "heapUsedMB": (gc["S0U"] + gc["S1U"] + gc["EU"] + gc["OU"]) / 1024,
+            "heapCommittedMB": (gc["S0C"] + gc["S1C"] + gc["EC"] + gc["OC"]) / 1024,
+        }
+    except (OSError, subprocess.CalledProcessError, ValueError, KeyError):
+        # No jstat: fall back to the process RSS
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                rss = re.search(r"VmRSS:\s+(\d+)", f.read())
+            return {"rssMB": int(rss.group(1)) / 1024} if rss else {}
+        except OSError:
+            return {}
+
+
+def cpu_times():
+    with open("/proc/stat") as f:
+        fields = [int(v) for v in f.readline().split()[1:]]
+    idle = fields[3] + fields[4]
+    return sum(fields), idle
+
+
+def disk_sectors():
+    read = written = 0
+    with open("/proc/diskstats") as f:
+        for line in f:
+            parts = line.split()
+            if DISK_RE.match(parts[2]):
+                read += int(parts[5])
+                written += int(parts[9])
+    return read, written
+
+
+def send(batch):
+    payload = json.dumps({
+        "owner": os.environ["OWNER"],
+        "serverUUID": os.environ["SERVER_UUID"],
+        "instanceType": os.environ["INSTANCE_TYPE"],
+        "samples": batch,
+    })
+    subprocess.run([
+        "aws", "lambda", "invoke",
+        "--function-name", os.environ["METRICS_LAMBDA"],
+        "--invocation-type", "Event",
+        "--cli-binary-format", "raw-in-base64-out",
+        "--payload", payload,
+        "/dev/null",
+    ], stdout=subprocess.DEVNULL, check=False)
+
+
+def save():
+    """save-all flush only answers once every chunk is on disk."""
+    try:
+        print(rcon("save-all flush", timeout=FLUSH_TIMEOUT_SECONDS))
+    except (OSError, PermissionError, struct.error) as e:
+        print(f"RCON save failed: {e}")
+        return False
+    return True
+
+
+def stop(pid):
+    try:
+        rcon("save-all flush", timeout=FLUSH_TIMEOUT_SECONDS)
+        rcon("stop")
+    except (OSError, PermissionError, struct.error) as e:
+        print(f"RCON stop failed: {e}")
+        return
+
+    deadline = time.monotonic() + STOP_WAIT_SECONDS
+    while pid and os.path.exists(f"/proc/{pid}") and time.monotonic() < deadline:
+        time.sleep(1)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "stop":
+        stop(sys.argv[2] if len(sys.argv) > 2 else None)
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "save":
+        sys.exit(0 if save() else 1)
+
+    batch = []
+    prev_cpu, prev_disk, prev_time = cpu_times(), disk_sectors(), time.monotonic()
+
+    while True:
+        time.sleep(SAMPLE_SECONDS)
+        cpu, disk, now = cpu_times(), disk_sectors(), time.monotonic()
+        elapsed = now - prev_time
+        total, idle = cpu[0] - prev_cpu[0], cpu[1] - prev_cpu[1]
+
+        sample = {
+            "ts": int(time.time()),
+            "cpu": round(100.0 * (total - idle) / total, 1) if total else 0.0,
+            "diskReadKBs": round((disk[0] - prev_disk[0]) * 512 / 1024 / elapsed, 1),
+            "diskWriteKBs": round((disk[1] - prev_disk[1]) * 512 / 1024 / elapsed, 1),
+        }
+        sample.update(game_metrics())
+        sample.update(heap_metrics(java_pid()))
+        batch.append({k: round(v, 2) if isinstance(v, float) else v for k, v in sample.items()})
+        prev_cpu, prev_disk, prev_time = cpu, disk, now
+
+        if len(batch) >= SAMPLES_PER_BATCH:
+            send(batch)
+            batch = []
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import time
+import clients
+from botocore.exceptions import ClientError
+
+# Shell commands on a server instance over SSM Run Command, waited for, so the
+# caller knows whether they actually ran (attaching a pooled instance, flushing
+# the world before hibernation).
+
+PENDING_STATUSES = ("Pending", "InProgress", "Delayed")
+
+
+def run(instance_id, commands, comment, wait_seconds):
+    """
+    Run `commands` with AWS-RunShellScript and poll until they finish.
+    Returns the final invocation status ("Success", "Failed", "TimedOut", ...),
+    or None if it had not finished after `wait_seconds`. send_command errors are raised.
+    """
+    ssm = clients.client("ssm")
+    command_id = ssm.send_command(
+        InstanceIds=[instance_id],
+        DocumentName="AWS-RunShellScript",
+        Comment=comment,
+        # The agent's own limit; 30 s is the least SSM accepts
+        TimeoutSeconds=max(30, wait_seconds),
+        Parameters={"commands": commands}
+    )["Command"]["CommandId"]
+
+    deadline = time.monotonic() + wait_seconds
+    while time.monotonic() < deadline:
+        time.sleep(1)
+        try:
+            status = ssm.get_command_invocation(CommandId=command_id, InstanceId=instance_id)["Status"]
+        except ClientError as e:
+            # The invocation shows up a moment after send_command
+            if e.response["Error"]["Code"] == "InvocationDoesNotExist":
+                continue
+            raise
+        if status not in PENDING_STATUSES:
+            return status
+    return None
@@ -0,0 +1,91 @@
+import os
+import json
+import base64
+from datetime import datetime, timezone
+from boto3.dynamodb.conditions import Key
+
+# Sparse GSI over SERVER items, so fleet-wide questions ("RUNNING in sa-east-1",
+# "STARTING for more than 10 minutes") are a Query instead of a Scan.
+#   StatusRegion  (hash)   "<status>#<region>"
+#   StatusSince   (range)  ISO time of the last status write
+# Only SERVER items carry these attributes, so the index holds one entry per
+# server and nothing for profiles, pools or metrics. Every status write must set
+# both (use item()/update()), otherwise the server stays listed under its old status.
+
+INDEX_NAME = "StatusRegionIndex"
+
+
+def index_key(status, region=None):
+    return f"{status}#{region or os.environ['REGION']}"
+
+
+def item(status, region=None):
+    """Attributes to merge into a SERVER put_item."""
+    return {
+        "status": status,
+        "StatusRegion": index_key(status, region),
+        "StatusSince": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def update(status, region=None):
+    """SET clause and values for a SERVER update_item that moves it to `status`.
+    The clause sets #s, so callers map "#s" to "status"."""
+    values = {
+        ":ix_status": status,
+        ":ix_key": index_key(status, region),
+        ":ix_since": datetime.now(timezone.utc).isoformat(),
+    }
+    return "#s = :ix_status, StatusRegion = :ix_key, StatusSince = :ix_since", values
+
+
+def query_page(table, status, region, older_than=None, limit=100, start_key=None):
+    """One page of SERVER items in `status` in `region`, oldest first.
+    `older_than` (datetime) keeps only servers that entered the status before it."""
+    condition = Key("StatusRegion").eq(index_key(status, region))
+    if older_than:
+        condition &= Key("StatusSince").lt(older_than.isoformat())
+
+    kwargs = {
+        "IndexName": INDEX_NAME,
+        "KeyConditionExpression": condition,
+        "Limit": limit,
+    }
+    if start_key:
+        kwargs["ExclusiveStartKey"] = start_key
+
+    response = table.query(**kwargs)
+    return response.get("Items", []), response.get("LastEvaluatedKey")
+
+
+def iter_servers(table, status, regions, older_than=None, page_size=100):
+    """Yield every SERVER item in `status` across `regions`, page by page."""
+    for region in regions:
+        start_key = None
+        while True:
+            items, start_key = query_page(table, status, region, older_than, page_size, start_key)
+            yield from items
+            if not start_key:
+                break
+
+
+def encode_token(status, region, start_key):
+    position = {"status": status, "region": region, "key": start_key}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_token(token):
+    """(status, region, start_key) from a token made by encode_token; ValueError if it is not one."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return data["status"], data["region"], data["key"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid pagination token: {e}")
+
+
+def owner_of(server_item):
+    return server_item["PK"].split("#", 1)[1]
+
+
+def region_of(server_item):
+    return server_item["StatusRegion"].split("#", 1)[1]
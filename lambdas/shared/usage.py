@@ -0,0 +1,83 @@
+import os
+import uuid
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+
+# Credit usage history, written next to every deduction:
+#   PK USAGE#<owner>
+#     SK EVENT#<iso time>#<id>  one deduction: d (credits), b (balance after), t (type), src; expires
+#     SK DAY#<yyyy-mm-dd>       Credits / Ticks summed for the day, InstanceTypes, first/last balance
+#     SK MONTH#<yyyy-mm>        the same for the month, kept
+# Rollups are folded in with ADD as events arrive, so reading N days of history
+# is one Query over N items however many ticks they cover.
+# ENV: USAGE_EVENT_RETENTION_DAYS (optional, default 35), USAGE_DAY_RETENTION_DAYS (optional, default 400)
+
+EVENT_RETENTION_DAYS = int(os.environ.get("USAGE_EVENT_RETENTION_DAYS", "35"))
+DAY_RETENTION_DAYS = int(os.environ.get("USAGE_DAY_RETENTION_DAYS", "400"))
+
+
+def partition(owner):
+    return f"USAGE#{owner}"
+
+
+def day_key(day):
+    return f"DAY#{day}"
+
+
+def month_key(month):
+    return f"MONTH#{month}"
+
+
+def record(table, owner, result, instance_type, source):
+    """
+    Append a usage event for a deduct_credits() result and fold it into the
+    owner's day and month rollups. Best effort: billing already happened, so
+    errors are logged, not raised.
+    """
+    if not result or not result["deducted"]:
+        return
+
+    now = datetime.now(timezone.utc)
+    epoch = int(now.timestamp())
+    pk = partition(owner)
+    deducted = result["deducted"]
+    balance = result["newCredits"]
+
+    try:
+        table.put_item(Item={
+            "PK": pk,
+            "SK": f"EVENT#{now.isoformat()}#{uuid.uuid4().hex[:8]}",
+            "d": deducted,
+            "b": balance,
+            "t": instance_type or "",
+            "src": source,
+            "ttl": epoch + EVENT_RETENTION_DAYS * 86400,
+        })
+
+        adds = "Credits :d, Ticks :one" + (", InstanceTypes :types" if instance_type else "")
+        day_update = (f"ADD {adds} SET LastBalance = :b, LastAt = :at,"
+                      " FirstBalance = if_not_exists(FirstBalance, :before), #ttl = if_not_exists(#ttl, :ttl)")
+        values = {
+            ":d": deducted,
+            ":one": 1,
+            ":b": balance,
+            ":before": result["oldCredits"],
+            ":at": now.isoformat(),
+            ":ttl": epoch + DAY_RETENTION_DAYS * 86400,
+        }
+        if instance_type:
+            values[":types"] = {instance_type}
+
+        table.update_item(
+            Key={"PK": pk, "SK": day_key(f"{now:%Y-%m-%d}")},
+            UpdateExpression=day_update,
+            ExpressionAttributeNames={"#ttl": "ttl"},
+            ExpressionAttributeValues=values
+        )
+        table.update_item(
+            Key={"PK": pk, "SK": month_key(f"{now:%Y-%m}")},
+            UpdateExpression=f"ADD {adds} SET LastBalance = :b, LastAt = :at, FirstBalance = if_not_exists(FirstBalance, :before)",
+            ExpressionAttributeValues={k: v for k, v in values.items() if k != ":ttl"}
+        )
+    except ClientError as e:
+        print(f"Error recording usage for {owner}: {e}")
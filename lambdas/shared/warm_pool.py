@@ -0,0 +1,106 @@
+import os
+import json
+from datetime import datetime, timezone, timedelta
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+import clients
+
+# Warm pool of pre-booted instances (deps installed, EFS mounted, no world),
+# one partition per region, instance type and Java version in the App table:
+#   PK POOL#<region>#<type>#java-<java>
+#     SK INSTANCE#<instanceId>  status BOOTING -> IDLE once the instance reports ready
+#                               -> CLAIMED (ClaimedBy, ClaimedAt) by the turnOnServer taking it,
+#                               which deletes the item once the attach succeeded or failed.
+#                               poolManager retires claims left by a crashed start.
+#     SK DEMAND#<%Y-%m-%dT%H>   starts: turnOnServer launches that needed a fresh instance
+# poolManager sizes each pool from DEMAND and keeps it filled.
+# ENV: POOL_LAMBDA
+
+DEMAND_RETENTION_DAYS = 8
+
+
+def partition(region, server_type, java):
+    return f"POOL#{region}#{server_type}#java-{java}"
+
+
+def parse_partition(pk):
+    """POOL#<region>#<type>#java-<java> -> (region, type, java)"""
+    _, region, server_type, java = pk.split("#")
+    return region, server_type, java.removeprefix("java-")
+
+
+def record_start(table, pk):
+    now = datetime.now(timezone.utc)
+    expires = int((now + timedelta(days=DEMAND_RETENTION_DAYS)).timestamp())
+    table.update_item(
+        Key={"PK": pk, "SK": f"DEMAND#{now:%Y-%m-%dT%H}"},
+        UpdateExpression="ADD starts :one SET #ttl = if_not_exists(#ttl, :ttl)",
+        ExpressionAttributeNames={"#ttl": "ttl"},
+        ExpressionAttributeValues={":one": 1, ":ttl": expires}
+    )
+
+
+def members(table, pk):
+    return table.query(
+        KeyConditionExpression=Key("PK").eq(pk) & Key("SK").begins_with("INSTANCE#"),
+        ConsistentRead=True
+    ).get("Items", [])
+
+
+def claim(table, pk, owner):
+    """
+    Take one IDLE instance out of the pool for `owner`, oldest first. The
+    conditional IDLE -> CLAIMED update is the claim: of two concurrent starts
+    only one gets the item. The item stays until release(), so an instance
+    whose start crashed mid-attach is still known to poolManager.
+    Returns the pool item, or None if nothing is idle.
+    """
+    idle = sorted((m for m in members(table, pk) if m.get("status") == "IDLE"), key=lambda m: m.get("ReadyAt", ""))
+    for item in idle:
+        try:
+            return table.update_item(
+                Key={"PK": pk, "SK": item["SK"]},
+                UpdateExpression="SET #s = :claimed, ClaimedBy = :owner, ClaimedAt = :now",
+                ConditionExpression="#s = :idle",
+                ExpressionAttributeNames={"#s": "status"},
+                ExpressionAttributeValues={
+                    ":idle": "IDLE",
+                    ":claimed": "CLAIMED",
+                    ":owner": owner,
+                    ":now": datetime.now(timezone.utc).isoformat()
+                },
+                ReturnValues="ALL_NEW"
+            )["Attributes"]
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+    return None
+
+
+def release(table, item):
+    """Drop a CLAIMED item once its instance is attached to a server or terminated."""
+    try:
+        table.delete_item(
+            Key={"PK": item["PK"], "SK": item["SK"]},
+            ConditionExpression="#s = :claimed",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues={":claimed": "CLAIMED"}
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+
+
+def request_refill(pk):
+    """Ask poolManager to top the pool up without waiting for it."""
+    function_name = os.environ.get("POOL_LAMBDA")
+    if not function_name:
+        return
+    try:
+        clients.client("lambda").invoke(
+            FunctionName=function_name,
+            InvocationType="Event",
+            Payload=json.dumps({"refill": pk})
+        )
+    except ClientError as e:
+        print(f"Error requesting pool refill for {pk}: {e}")